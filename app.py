@@ -30,20 +30,19 @@ from dotenv import load_dotenv
 import dash
 from dash import ctx, dcc, html, Input, Output, callback
 from dash.exceptions import PreventUpdate
-import pandas as pd
 
 # import local functions
-from pages.load_data import ethnicity, subgroup, ethnicity, info_categories, get_academic_data, \
-    get_school_coordinates, get_k8_corporation_academic_data, get_academic_dropdown_years, get_school_corporation_list, get_public_school_list
+from pages.load_data import get_academic_data, get_school_coordinates, get_k8_corporation_academic_data, \
+    get_academic_dropdown_years, get_school_corporation_list, get_public_school_list
 from pages.process_data import process_k8_academic_data, process_k8_corp_academic_data
 from pages.calculations import find_nearest, calculate_proficiency, recalculate_total_proficiency, get_excluded_years
-from pages.chart_helpers import no_data_fig_label, make_line_chart, make_bar_chart, make_group_bar_chart
-from pages.table_helpers import create_comparison_table, no_data_page, no_data_table, combine_group_barchart_and_table, \
-    combine_barchart_and_table
-from pages.string_helpers import create_school_label, identify_missing_categories, combine_school_name_and_grade_levels, \
-    create_school_label, create_chart_label
+from pages.table_helpers import no_data_page
 from pages.calculate_metrics import calculate_k8_comparison_metrics
 from pages.subnav import subnav_academic
+from pages.analysis_helpers import build_analysis_figures
+from pages.cache import memoize_output, single_flight
+from pages.traffic import init_traffic_recorder
+from pages.instrumentation import init_instrumentation, instrument, metrics_path, skip_request
 
 
 # Used to generate metric rating svg circles
@@ -94,6 +93,9 @@ def check_login():
     if request.method == "GET":
         if request.path in ["/login"]:
             return
+        # the Prometheus endpoint (if enabled) is scraped without a session
+        if metrics_path and request.path == metrics_path:
+            return
         if current_user:
             if current_user.is_authenticated:
                 return
@@ -102,11 +104,14 @@ def check_login():
                     if request.path == dash.page_registry[pg]["path"]:
                         session["url"] = request.url
 
+        # rejected requests are not recorded in the request metrics
+        skip_request()
         return redirect(url_for("login"))
     else:
         if current_user:
             if request.path == "/login" or current_user.is_authenticated:
                 return
+        skip_request()
         return jsonify({"status": "401", "statusText": "unauthorized access"})
 
 # Login logic
@@ -155,11 +160,37 @@ def logout():
             logout_user()
     return render_template("login.html", message="You have been logged out.")
 
+# Background callbacks. With BACKGROUND_CALLBACKS=1, the heavy page callbacks (currently
+# update_academic_analysis) run as jobs in separate processes managed through a local
+# diskcache directory (BACKGROUND_CACHE_DIR, default: background_cache) - no broker is
+# needed. A progress bar is shown while a job runs, and when a session submits new inputs
+# before its job finishes, Dash terminates the stale job. NOTE: jobs do not share the
+# in-process output cache tier, so set OUTPUT_CACHE_DIR as well (see pages/cache.py).
+background_callbacks = os.getenv("BACKGROUND_CALLBACKS", "0") == "1"
+
+if background_callbacks:
+    import diskcache
+    from dash import DiskcacheManager
+
+    background_callback_manager = DiskcacheManager(diskcache.Cache(os.getenv("BACKGROUND_CACHE_DIR", "background_cache")))
+
+    # passed to @callback for the heavy callbacks
+    background_options = {
+        "background": True,
+        "running": [
+            (Output("academic-analysis-progress", "style"), {"display": "block"}, {"display": "none"}),
+        ],
+    }
+else:
+    background_callback_manager = None
+    background_options = {}
+
 app = dash.Dash(
     __name__,
     server=server,
     # use_pages=True,
     external_stylesheets=external_stylesheets,
+    background_callback_manager=background_callback_manager,
     suppress_callback_exceptions=True,
     # compress=False, # testing
     meta_tags=[
@@ -169,6 +200,14 @@ app = dash.Dash(
     }
 ],
 )
+
+# opt-in recording of callback requests for benchmarks/replay.py (see pages/traffic.py)
+init_traffic_recorder(server)
+
+# stage timings in a Server-Timing header, and a metrics endpoint if METRICS_PATH is set
+# (see pages/instrumentation.py)
+init_instrumentation(server, callbacks=app.callback_map)
+
 years = get_academic_dropdown_years()
 
 @callback(
@@ -177,6 +216,8 @@ years = get_academic_dropdown_years()
     Input("year-dropdown", "value"),
     Input("corporation-dropdown", "value"),
 )
+@single_flight()
+@instrument("callback")
 def set_corp_dropdown_options(year, corp_value):
 
     school_corporations = get_school_corporation_list(year)
@@ -198,6 +239,8 @@ def set_corp_dropdown_options(year, corp_value):
     Input("corporation-dropdown", "value"),
     Input("school-dropdown", "value")
 )
+@single_flight()
+@instrument("callback")
 def set_school_dropdown_options(selected_corp, selected_schools):
 
     if not selected_schools:
@@ -253,8 +296,12 @@ def set_school_dropdown_options(selected_corp, selected_schools):
     Output("academic-analysis-empty-container", "style"),
     Output("academic-analysis-no-data", "children"),
     Input("year-dropdown", "value"),
-    [Input("school-dropdown", "value"),]
+    [Input("school-dropdown", "value"),],
+    **background_options
 )
+# the outputs only depend on the year and the set of selected schools (not their order)
+@memoize_output(key=lambda year, school_list: (year, frozenset(school_list or [])))
+@instrument("callback")
 def update_academic_analysis(year: str, school_list: list):
     if not school_list:
         raise PreventUpdate
@@ -407,217 +454,18 @@ def update_academic_analysis(year: str, school_list: list):
     # # reset indicies
     # comparison_schools = comparison_schools.reset_index(drop=True)
 
-    #### Current Year ELA Proficiency Compared to Similar Schools (1.4.c) #
-    category = "School Total|ELA Proficient %"
-
-    # Get school value for specific category
-    if category in display_academic_data.columns:
-
-        fig14c_k8_data = display_academic_data[info_categories + [category]].copy()
-
-        # add corp average for category to dataframe - note we are using 'clean_corp_data'
-        # because the 'Corp' values have been dropped from raw_comparison_data
-        # fig14c_k8_school_data.loc[len(fig14c_k8_school_data.index)] = \
-        #     [corp_name,"3","8",clean_corp_data[clean_corp_data['Category'] == category][string_year].values[0]]
-
-        # fig14c_comp_data = comparison_schools[info_categories + [category]]
-
-        # # Combine data, fix dtypes, and send to chart function
-        # fig14c_all_data = pd.concat([fig14c_k8_school_data,fig14c_comp_data])
-
-        fig14c_table_data = fig14c_k8_data.copy()
-
-        fig14c_k8_data[category] = pd.to_numeric(fig14c_k8_data[category])
-
-        fig14c_chart = make_bar_chart(fig14c_k8_data, category, "Comparison: Current Year ELA Proficiency")
-
-        fig14c_table_data["School Name"] = create_school_label(fig14c_table_data)
-
-        fig14c_table_data = fig14c_table_data[["School Name", category]]
-        fig14c_table_data = fig14c_table_data.reset_index(drop=True)
-
-        fig14c_table = create_comparison_table(fig14c_table_data, "Proficiency")
-
-
-    else:
-        # NOTE: This should never ever happen. So yeah.
-        fig14c_chart = no_data_fig_label("Comparison: Current Year ELA Proficiency",200)
-        fig14c_table = no_data_table(["Proficiency"])
-
-    fig14c = combine_barchart_and_table(fig14c_chart,fig14c_table)
-
-    #### Current Year Math Proficiency Compared to Similar Schools (1.4.d) #
-    category = "School Total|Math Proficient %"
-
-    if category in display_academic_data.columns:
-
-        fig14d_k8_data = display_academic_data[info_categories + [category]].copy()
-
-        # fig14d_k8_school_data.loc[len(fig14d_k8_school_data.index)] = \
-        #     [corp_name, "3","8",clean_corp_data[clean_corp_data['Category'] == category][string_year].values[0]]
-
-        # Get comparable school values for the specific category
-        # fig14d_comp_data = comparison_schools[info_categories + [category]]
-
-        # fig14d_all_data = pd.concat([fig14d_k8_school_data,fig14d_comp_data])
-
-        fig14d_table_data = fig14d_k8_data.copy()
-
-        fig14d_k8_data[category] = pd.to_numeric(fig14d_k8_data[category])
-
-        fig14d_chart = make_bar_chart(fig14d_k8_data, category, "Comparison: Current Year Math Proficiency")
-
-        fig14d_table_data["School Name"] = create_school_label(fig14d_table_data)
-        
-        fig14d_table_data = fig14d_table_data[["School Name", category]]
-        fig14d_table_data = fig14d_table_data.reset_index(drop=True)
-
-        fig14d_table = create_comparison_table(fig14d_table_data, "Proficiency")
-    
-    else:
-        fig14d_chart = no_data_fig_label("Comparison: Current Year Math Proficiency",200)
-        fig14d_table = no_data_table(["Proficiency"])
-
-    fig14d = combine_barchart_and_table(fig14d_chart,fig14d_table)
-
-    #### Current Year IREAD Proficiency Compared to Similar Schools #
-    category = "IREAD Proficient %"
-
-    if category in display_academic_data.columns:
-
-        fig_iread_data = display_academic_data[info_categories + [category]].copy()
-
-        # fig_iread_k8_school_data.loc[len(fig_iread_k8_school_data.index)] = \
-        #     [corp_name, "3","8",clean_corp_data[clean_corp_data['Category'] == category][string_year].values[0]]
-
-        # fig_iread_comp_data = comparison_schools[info_categories + [category]]
-        
-        # fig_iread_all_data = pd.concat([fig_iread_k8_school_data,fig_iread_comp_data])
-
-        fig_iread_table_data = fig_iread_data.copy()
-
-        fig_iread_data[category] = pd.to_numeric(fig_iread_data[category])
+    # the seven figure/table pairs only read display_academic_data, so they can be
+    # built in parallel (see pages/analysis_helpers.py)
+    figures = build_analysis_figures(display_academic_data)
 
-        fig_iread_chart = make_bar_chart(fig_iread_data,category, "Comparison: Current Year IREAD Proficiency")
+    fig14c = figures["fig14c"]
+    fig14d = figures["fig14d"]
+    fig_iread = figures["fig_iread"]
 
-        fig_iread_table_data["School Name"] = create_school_label(fig_iread_table_data)
-
-        fig_iread_table_data = fig_iread_table_data[["School Name", category]]
-        fig_iread_table_data = fig_iread_table_data.reset_index(drop=True)
-
-        fig_iread_table = create_comparison_table(fig_iread_table_data, "Proficiency")
-
-    else:
-        fig_iread_chart = no_data_fig_label("Comparison: Current Year IREAD Proficiency",200)
-        fig_iread_table = no_data_table(["Proficiency"])
-
-    fig_iread = combine_barchart_and_table(fig_iread_chart,fig_iread_table)
-
-    # ELA Proficiency by Ethnicity Compared to Similar Schools (1.6.a.1)
-    headers_16a1 = []
-    for e in ethnicity:
-        headers_16a1.append(e + "|" + "ELA Proficient %")
-
-    categories_16a1 =  info_categories + headers_16a1
-
-    # filter dataframe by categories
-    fig16a1_k8_data = display_academic_data.loc[:, (display_academic_data.columns.isin(categories_16a1))]
-
-    if len(fig16a1_k8_data.columns) > 3:
-        
-        fig16a1_final_data, fig16a1_category_string, fig16a1_school_string = \
-            identify_missing_categories(fig16a1_k8_data, headers_16a1)
-        
-        fig16a1_label = create_chart_label(fig16a1_final_data)
-        fig16a1_chart = make_group_bar_chart(fig16a1_final_data, fig16a1_label)
-        fig16a1_table_data = combine_school_name_and_grade_levels(fig16a1_final_data)
-        fig16a1_table = create_comparison_table(fig16a1_table_data, "")
-
-        fig16a1 = combine_group_barchart_and_table(fig16a1_chart,fig16a1_table,fig16a1_category_string,fig16a1_school_string)
-        
-        fig16a1_container = {"display": "block"}
-    
-    else:
-        fig16a1 = no_data_fig_label("Comparison: ELA Proficiency by Ethnicity", 200)             
-        fig16a1_container = {"display": "none"}
-
-    # Math Proficiency by Ethnicity Compared to Similar Schools (1.6.b.1)
-    headers_16b1 = []
-    for e in ethnicity:
-        headers_16b1.append(e + "|" + "Math Proficient %")
-
-    categories_16b1 =  info_categories + headers_16b1
-
-    fig16b1_k8_school_data = display_academic_data.loc[:, (display_academic_data.columns.isin(categories_16b1))]
-
-    if len(fig16b1_k8_school_data.columns) > 3:
-        
-        fig16b1_final_data, fig16b1_category_string, fig16b1_school_string = \
-            identify_missing_categories(fig16b1_k8_school_data, headers_16b1)
-        fig16b1_label = create_chart_label(fig16b1_final_data)
-        fig16b1_chart = make_group_bar_chart(fig16b1_final_data, fig16b1_label)
-        fig16b1_table_data = combine_school_name_and_grade_levels(fig16b1_final_data)
-        fig16b1_table = create_comparison_table(fig16b1_table_data,"")
-
-        fig16b1 = combine_group_barchart_and_table(fig16b1_chart,fig16b1_table,fig16b1_category_string,fig16b1_school_string)
-
-        fig16b1_container = {"display": "block"}
-    
-    else:
-        fig16b1 = no_data_fig_label("Comparison: Math Proficiency by Ethnicity", 200)
-    
-        fig16b1_container = {"display": "none"}
-
-    # ELA Proficiency by Subgroup Compared to Similar Schools (1.6.a.2)
-    headers_16a2 = []
-    for s in subgroup:
-        headers_16a2.append(s + "|" + "ELA Proficient %")
-    
-    categories_16a2 =  info_categories + headers_16a2
-
-    fig16a2_k8_school_data = display_academic_data.loc[:, (display_academic_data.columns.isin(categories_16a2))]
-
-    if len(fig16a2_k8_school_data.columns) > 3:
-
-        fig16a2_final_data, fig16a2_category_string, fig16a2_school_string = \
-            identify_missing_categories(fig16a2_k8_school_data, headers_16a2)
-        fig16a2_label = create_chart_label(fig16a2_final_data)
-        fig16a2_chart = make_group_bar_chart(fig16a2_final_data, fig16a2_label)
-        fig16a2_table_data = combine_school_name_and_grade_levels(fig16a2_final_data)
-        fig16a2_table = create_comparison_table(fig16a2_table_data,"")
-        
-        fig16a2 = combine_group_barchart_and_table(fig16a2_chart, fig16a2_table,fig16a2_category_string,fig16a2_school_string)
-        fig16a2_container = {"display": "block"}
-    
-    else:
-        fig16a2 = no_data_fig_label("Comparison: ELA Proficiency by Subgroup", 200)                
-        fig16a2_container = {"display": "none"}
-
-    # Math Proficiency by Subgroup Compared to Similar Schools (1.6.b.2)
-    headers_16b2 = []
-    for s in subgroup:
-        headers_16b2.append(s + "|" + "Math Proficient %")
-
-    categories_16b2 =  info_categories + headers_16b2
-
-    fig16b2_k8_school_data = display_academic_data.loc[:, (display_academic_data.columns.isin(categories_16b2))]
-
-    if len(fig16b2_k8_school_data.columns) > 3:
-
-        fig16b2_final_data, fig16b2_category_string, fig16b2_school_string = \
-            identify_missing_categories(fig16b2_k8_school_data, headers_16b2)
-        fig16b2_label = create_chart_label(fig16b2_final_data)
-        fig16b2_chart = make_group_bar_chart(fig16b2_final_data, fig16b2_label)
-        fig16b2_table_data = combine_school_name_and_grade_levels(fig16b2_final_data)
-        fig16b2_table = create_comparison_table(fig16b2_table_data,"")
-
-        fig16b2 = combine_group_barchart_and_table(fig16b2_chart, fig16b2_table,fig16b2_category_string,fig16b2_school_string)
-        fig16b2_container = {"display": "block"}
-
-    
-    else:
-        fig16b2 = no_data_fig_label("Comparison: Math Proficiency by Subgroup", 200)            
-        fig16b2_container = {"display": "none"}
+    fig16a1, fig16a1_container = figures["fig16a1"]
+    fig16b1, fig16b1_container = figures["fig16b1"]
+    fig16a2, fig16a2_container = figures["fig16a2"]
+    fig16b2, fig16b2_container = figures["fig16b2"]
 
     return (
         fig14c, fig14d, fig_iread, fig16a1, fig16a1_container, fig16b1, fig16b1_container, fig16a2,
@@ -704,6 +552,12 @@ html.Div(
                     #     ],
                     #     className="row"
                     # ),
+                    # indeterminate progress bar, shown while a background job runs
+                    html.Progress(
+                        id="academic-analysis-progress",
+                        className="progress_bar",
+                        style={"display": "none"},
+                    ),
                     html.Div(
                         [
                             # NOTE: This is an awkward workaround. Want a loading spinner on load, but for it not
@@ -0,0 +1,18 @@
+##################################
+# ICSB Dashboard - Benchmarks    #
+##################################
+# author:   jbetley
+# version:  1.09
+# date:     08/14/23
+
+# Benchmarks for the data pipeline, run against a synthetic db_all.db so results are
+# reproducible and can be compared between branches and machines.
+#
+#   python -m benchmarks.generate_db --scale 1      - build benchmarks/data/db_1x.db
+#   python -m benchmarks.run --scale 1              - time every stage and write JSON results
+#   python -m benchmarks.compare BASELINE CURRENT   - report regressions (exit 1 on a hot path)
+#   python -m benchmarks.replay TRAFFIC --url URL   - replay recorded traffic (TRAFFIC_LOG) at a server
+#
+# See generate_db.py for the shape of the synthetic data, run.py for the stages,
+# compare.py for the regression thresholds, and replay.py (with pages/traffic.py) for
+# recording and replaying real traffic.
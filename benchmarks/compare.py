@@ -0,0 +1,216 @@
+#############################################
+# ICSB Dashboard - Benchmark Comparison     #
+#############################################
+# author:   jbetley
+# version:  1.09
+# date:     08/14/23
+
+# Compares two benchmark results files (see run.py) and prints a table of regressions
+# and improvements. Exits 1 when a hot path (hot_paths) regresses beyond its threshold,
+# moves beyond it with too few rounds to judge, is missing from the current results, or
+# has no timed inputs in them because every call raised (with --strict, any
+# benchmark), so it can gate a deploy:
+#
+#   python -m benchmarks.run --scale 1 --rounds 10 --output current.json
+#   python -m benchmarks.compare benchmarks/baseline.json current.json
+#
+# A benchmark has regressed when its median is slower than the baseline median by
+# more than its threshold (a fraction of the baseline - see thresholds) AND by more
+# than the noise of the two runs (noise_factor x the larger of the two IQRs). Medians
+# and IQRs are recomputed from the per-round samples, so both runs need a few rounds
+# (the default of 5 is the minimum that gives a useful IQR). A change beyond the
+# threshold in a run with fewer than min_rounds rounds cannot be judged, and fails like
+# a regression. Improvements are reported the same way but never fail the comparison.
+#
+# Thresholds can be overridden per benchmark (or by prefix) on the command line:
+#   --threshold update_academic_analysis=0.05 --threshold run_query.=0.5
+
+import argparse
+import json
+import statistics
+import sys
+
+# the paths every page view goes through - a regression here fails the comparison
+hot_paths = [
+    "calculate_proficiency",
+    "process_k8_academic_data",
+    "process_k8_corp_academic_data",
+    "calculate_k8_comparison_metrics",
+    "build_analysis_figures",
+    "update_academic_analysis",
+    "run_query.get_academic_data.cold",
+]
+
+# allowed slowdown as a fraction of the baseline median. The longest matching prefix
+# wins; the empty prefix is the default. Cold queries depend on the OS page cache and
+# warm ones take microseconds, so both get more room
+thresholds = {
+    "": 0.25,
+    "run_query.": 0.5,
+    "calculate_proficiency": 0.1,
+    "process_k8_academic_data": 0.15,
+    "update_academic_analysis": 0.1,
+    "build_analysis_figures": 0.15,
+}
+
+noise_factor = 1.5
+min_rounds = 3
+
+# statuses that fail the comparison for a hot path (with --strict, for any benchmark)
+failing_statuses = ["regression", "too few rounds", "missing", "skipped"]
+
+def get_threshold(name: str, limits: dict) -> float:
+    prefix = max((p for p in limits if name.startswith(p)), key=len)
+
+    return limits[prefix]
+
+def get_statistics(result: dict) -> dict:
+    # median and IQR from the samples (results written without samples fall back to
+    # the stored values)
+    samples = result.get("samples") or []
+
+    if len(samples) > 1:
+        q1, median, q3 = statistics.quantiles(sorted(samples), n=4, method="inclusive")
+        return {"median": median, "iqr": q3 - q1, "rounds": len(samples)}
+
+    return {"median": result.get("median"), "iqr": result.get("iqr", 0), "rounds": len(samples)}
+
+def compare_results(baseline: dict, current: dict, limits: dict = thresholds, noise: float = noise_factor) -> list:
+    """
+    Compares every benchmark in either results file.
+
+    Args:
+        baseline (dict): the stored results (run.py output)
+        current (dict): the results to check
+        limits (dict, optional): thresholds by benchmark name prefix. Defaults to thresholds.
+        noise (float, optional): IQR multiple a change must exceed. Defaults to noise_factor.
+
+    Returns:
+        list: one dict per benchmark with name, baseline, current, change, threshold,
+        and status ("regression", "improvement", "ok", "noise", "too few rounds", "new",
+        "missing", or "skipped"). "missing" means the benchmark is not in the current
+        results, and "skipped" that it has no timed inputs in them. "new" is also used
+        when only the baseline has no timed inputs
+    """
+    base_benchmarks = baseline.get("benchmarks", {})
+    current_benchmarks = current.get("benchmarks", {})
+
+    rows = []
+    for name in list(base_benchmarks) + [n for n in current_benchmarks if n not in base_benchmarks]:
+        row = {"name": name, "baseline": None, "current": None, "change": None,
+            "threshold": get_threshold(name, limits), "hot": name in hot_paths}
+
+        base = get_statistics(base_benchmarks[name]) if name in base_benchmarks else None
+        cur = get_statistics(current_benchmarks[name]) if name in current_benchmarks else None
+
+        if base and base["median"] is not None:
+            row["baseline"] = base["median"]
+        if cur and cur["median"] is not None:
+            row["current"] = cur["median"]
+
+        if cur is None:
+            row["status"] = "missing"
+        elif row["current"] is None:
+            # no timed inputs - every call raised, or the stage's setup failed
+            row["status"] = "skipped"
+        elif base is None or row["baseline"] is None:
+            # not in the baseline, or no timed inputs there
+            row["status"] = "new"
+        else:
+            difference = row["current"] - row["baseline"]
+            row["change"] = difference / row["baseline"] if row["baseline"] else 0.0
+
+            spread = noise * max(base["iqr"], cur["iqr"])
+
+            if abs(row["change"]) <= row["threshold"]:
+                row["status"] = "ok"
+            elif min(base["rounds"], cur["rounds"]) < min_rounds:
+                row["status"] = "too few rounds"
+            elif abs(difference) <= spread:
+                # beyond the threshold, but within the noise of the runs
+                row["status"] = "noise"
+            else:
+                row["status"] = "regression" if difference > 0 else "improvement"
+
+        rows.append(row)
+
+    return rows
+
+def _format_ms(value) -> str:
+    return "-" if value is None else "{:.2f}".format(value * 1000)
+
+def print_table(rows: list):
+    print("{:<52} {:>12} {:>12} {:>9} {:>7}  {}".format("benchmark", "baseline ms", "current ms", "change", "limit", "status"))
+
+    for row in rows:
+        change = "-" if row["change"] is None else "{:+.1%}".format(row["change"])
+        status = row["status"] + (" (hot path)" if row["hot"] and row["status"] in failing_statuses else "")
+
+        print("{:<52} {:>12} {:>12} {:>9} {:>7}  {}".format(
+            row["name"], _format_ms(row["baseline"]), _format_ms(row["current"]), change,
+            "{:.0%}".format(row["threshold"]), status))
+
+def check_metadata(baseline: dict, current: dict) -> list:
+    # comparing runs on different data or library versions is allowed, but worth a warning
+    warnings = []
+    for key in ["database_bytes", "scale", "sample_size", "python", "pandas", "numpy", "plotly"]:
+        first = baseline.get("metadata", {}).get(key)
+        second = current.get("metadata", {}).get(key)
+
+        if first != second:
+            warnings.append(key + " differs: " + str(first) + " -> " + str(second))
+
+    return warnings
+
+def parse_thresholds(values: list) -> dict:
+    limits = dict(thresholds)
+
+    for value in values:
+        name, _, limit = value.partition("=")
+        if not limit:
+            raise ValueError("expected NAME=FRACTION, got " + value)
+        limits[name] = float(limit)
+
+    return limits
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark results files")
+    parser.add_argument("baseline", help="stored baseline results")
+    parser.add_argument("current", help="results to check")
+    parser.add_argument("--threshold", action="append", default=[], metavar="NAME=FRACTION",
+        help="allowed slowdown for a benchmark (or name prefix), e.g. update_academic_analysis=0.05")
+    parser.add_argument("--noise", type=float, default=noise_factor, help="IQR multiple a change must exceed")
+    parser.add_argument("--strict", action="store_true",
+        help="fail on a regression, missing or skipped result in any benchmark, not only hot paths")
+    options = parser.parse_args(argv)
+
+    try:
+        limits = parse_thresholds(options.threshold)
+    except ValueError as e:
+        parser.error(str(e))
+
+    with open(options.baseline) as f:
+        baseline = json.load(f)
+    with open(options.current) as f:
+        current = json.load(f)
+
+    for warning in check_metadata(baseline, current):
+        print("Warning: " + warning)
+
+    rows = compare_results(baseline, current, limits, options.noise)
+    print_table(rows)
+
+    regressions = [r for r in rows if r["status"] == "regression"]
+    failures = [r for r in rows if r["status"] in failing_statuses and (options.strict or r["hot"])]
+
+    improvements = sum(r["status"] == "improvement" for r in rows)
+    print(str(len(regressions)) + " regression(s), " + str(improvements) + " improvement(s)")
+
+    if failures:
+        print("FAILED: " + ", ".join(r["name"] + " (" + r["status"] + ")" for r in failures))
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,441 @@
+#############################################
+# ICSB Dashboard - Synthetic Database       #
+#############################################
+# author:   jbetley
+# version:  1.09
+# date:     08/14/23
+
+# Builds a synthetic db_all.db with the same tables and column names as the real
+# database (academic_data_k8, corporation_data_k8, academic_data_hs, corporation_data_hs,
+# demographic_data, growth, school_index), sized as a multiple of the state's school count.
+# The values are random but internally consistent, so the whole pipeline runs on them:
+#   - proficient/graduate/benchmark counts never exceed the tested/cohort counts
+#   - a category with fewer than 10 students is suppressed ("***", sometimes "^") in
+#     every column of the category; a grade the school does not serve is null
+#   - charter schools are their own corporation (CorporationID) inside a geographic
+#     corporation (school_index.GEOCorp) that has traditional schools of the same
+#     level, and the corporation tables hold the sums of those traditional schools -
+#     so every charter K8 and high school has corporation data
+# The comparable_schools table is derived from these, and is built by
+# "python -m pages.db_maintenance comparable" (benchmarks.run does it when missing).
+#
+# Usage (from the project root):
+#   python -m benchmarks.generate_db --scale 1 [--output benchmarks/data/db_1x.db] [--seed 0]
+#
+# Approximate sizes: 1x ~ 25 MB (a second or two), 10x ~ 240 MB (~15s), 100x ~ 2.4 GB
+# (several minutes, and a few GB of memory).
+
+import argparse
+import os
+import sqlite3
+import sys
+import numpy as np
+
+# roughly the number of public and charter schools in Indiana
+state_school_count = 1900
+
+# share of the schools that are high schools, and that are charters
+high_school_share = 0.25
+charter_share = 0.1
+
+# traditional schools per geographic corporation
+schools_per_corporation = 6
+
+k8_years = [2019, 2021, 2022, 2023]     # no K8 academic data for 2020
+hs_years = [2019, 2020, 2021, 2022, 2023]
+growth_years = [2022, 2023]
+growth_students_per_school = 50
+
+ethnicity = ["AmericanIndian", "Asian", "Black", "Hispanic", "Multiracial", "NativeHawaiianorOtherPacificIslander", "White"]
+subgroup = ["SpecialEducation", "GeneralEducation", "PaidMeals", "FreeorReducedPriceMeals", "EnglishLanguageLearners",
+    "NonEnglishLanguageLearners"]
+grades = ["Grade3", "Grade4", "Grade5", "Grade6", "Grade7", "Grade8"]
+
+# display names used in the growth table
+growth_ethnicity = ["American Indian", "Asian", "Black", "Hispanic", "Multiracial", "Native Hawaiian or Other Pacific Islander",
+    "White"]
+growth_grades = ["Grade 3", "Grade 4", "Grade 5", "Grade 6", "Grade 7", "Grade 8"]
+
+types = {
+    "Year": "INTEGER", "TestYear": "INTEGER", "SchoolID": "INTEGER", "CorporationID": "INTEGER", "GEOCorp": "INTEGER",
+    "MajorityEnrolledSchoolID": "INTEGER", "Lat": "REAL", "Lon": "REAL", "AvgAttendance": "REAL",
+}
+
+# numpy integers are not ints - without an adapter sqlite3 stores them as blobs
+for _type in (np.int8, np.int16, np.int32, np.int64):
+    sqlite3.register_adapter(_type, int)
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def create_table(db: sqlite3.Connection, table: str, columns: list):
+    db.execute("CREATE TABLE {} ({})".format(
+        quote(table), ", ".join((quote(c) + " " + types.get(c, "")).strip() for c in columns)
+    ))
+
+def insert_rows(db: sqlite3.Connection, table: str, columns: list, rows: list):
+    db.executemany(
+        "INSERT INTO {} VALUES ({})".format(quote(table), ", ".join("?" * len(columns))), rows
+    )
+
+def k8_measure_columns() -> list:
+    columns = []
+    for category in grades + ethnicity + subgroup + ["SchoolTotal"]:
+        for subject in ["ELA", "Math", "ELAandMath"]:
+            columns += [category + "|" + subject + "TotalTested", category + "|" + subject + "TotalProficient"]
+
+    return columns + ["IREADPassN", "IREADTestN"]
+
+def hs_measure_columns() -> list:
+    columns = []
+    for category in ethnicity + subgroup + ["Total", "NonWaiver"]:
+        columns += [category + "|Graduates", category + "|CohortCount", category + "|GraduationRate"]
+
+    for category in ethnicity + subgroup + ["SchoolTotal"]:
+        for subject in ["EBRW", "Math"]:
+            columns += [
+                category + "|" + subject + "TotalTested", category + "|" + subject + "BelowBenchmark",
+                category + "|" + subject + "ApproachingBenchmark", category + "|" + subject + "AtBenchmark",
+            ]
+
+    return columns + ["AHS|GradAll", "AHS|CCR", "StateGrade", "FederalRating"]
+
+class SchoolSet:
+    # the generated schools - one array per attribute
+    def __init__(self, count: int, rng: np.random.Generator):
+        self.count = count
+        self.ids = np.arange(1000, 1000 + count)
+
+        self.is_hs = rng.random(count) < high_school_share
+        self.is_charter = rng.random(count) < charter_share
+
+        corporation_count = max(1, int(count * (1 - charter_share)) // schools_per_corporation)
+        self.geo_corp = 5000 + rng.integers(0, corporation_count, count)
+
+        # charters sit inside a geographic corporation that has a traditional school of
+        # the same level (the next one up by ID when theirs has none), so every charter
+        # has corporation data to be compared with
+        for level in [self.is_hs, ~self.is_hs]:
+            hosts = np.unique(self.geo_corp[level & ~self.is_charter])
+            charters = level & self.is_charter
+
+            if len(hosts) and charters.any():
+                positions = np.minimum(np.searchsorted(hosts, self.geo_corp[charters]), len(hosts) - 1)
+                self.geo_corp[charters] = hosts[positions]
+
+        # charters are their own corporation
+        self.corp = np.where(self.is_charter, 10000 + np.arange(count), self.geo_corp)
+
+        self.lat = rng.uniform(37.8, 41.7, count)
+        self.lon = rng.uniform(-88.0, -84.8, count)
+
+        self.low_grade = np.where(self.is_hs, 9, rng.choice([0, 0, 0, 3, 5, 6], count))
+        self.high_grade = np.where(
+            self.is_hs, 12, np.maximum(self.low_grade + 2, rng.choice([5, 5, 8, 8, 8], count))
+        )
+
+        # students per grade
+        self.size = rng.integers(15, 160, count)
+        self.school_type = np.where(
+            self.is_hs, np.where(rng.random(count) < 0.1, "AHS", "HS"), "K8"
+        )
+
+    def grade_label(self, grade: int) -> str:
+        return "K" if grade == 0 else str(grade)
+
+def _suppress(tested: np.ndarray, rng: np.random.Generator, *counts: np.ndarray) -> list:
+    # object columns with null for missing categories (tested < 0) and "***"/"^" for
+    # small ones (tested < 10) - the same cells in every column of the category
+    missing = tested < 0
+    small = (tested < 10) & ~missing
+    code = np.where(rng.random(len(tested)) < 0.85, "***", "^")
+
+    columns = []
+    for values in (tested,) + counts:
+        column = values.astype(object)
+        column[missing] = None
+        column[small] = code[small]
+        columns.append(column)
+
+    return columns
+
+def k8_rows(schools: SchoolSet, year: int, rng: np.random.Generator) -> list:
+    n = schools.count
+    columns = [
+        np.full(n, year), schools.corp, np.array(["Corporation " + str(c) for c in schools.corp], dtype=object),
+        schools.ids, np.array(["School " + str(s) for s in schools.ids], dtype=object),
+        np.array([schools.grade_label(g) for g in schools.low_grade], dtype=object),
+        np.array([schools.grade_label(g) for g in schools.high_grade], dtype=object),
+        schools.lat, schools.lon,
+    ]
+
+    # a proficiency rate per school (school quality) plus noise per category
+    base_rate = rng.beta(4, 4, n)
+
+    measures = []
+    grade_tested = {}
+    for i, grade in enumerate(grades):
+        number = i + 3
+        served = (schools.low_grade <= number) & (schools.high_grade >= number)
+        grade_tested[grade] = np.where(served, rng.poisson(schools.size), -1)
+
+    def category_columns(tested: np.ndarray):
+        result = []
+        for subject_tested in [tested, tested]:
+            rate = np.clip(base_rate + rng.normal(0, 0.1, n), 0, 1)
+            proficient = rng.binomial(np.maximum(subject_tested, 0), rate)
+            result += _suppress(subject_tested, rng, proficient)
+
+        # ELA and Math
+        rate = np.clip(base_rate + rng.normal(0, 0.1, n) - 0.1, 0, 1)
+        proficient = rng.binomial(np.maximum(tested, 0), rate)
+        result += _suppress(tested, rng, proficient)
+
+        return result
+
+    for grade in grades:
+        measures += category_columns(grade_tested[grade])
+
+    total_tested = sum(np.maximum(t, 0) for t in grade_tested.values())
+    total_tested = np.where(total_tested == 0, -1, total_tested)
+
+    for shares in [rng.dirichlet(np.ones(len(ethnicity)), n), rng.dirichlet(np.ones(2), n), rng.dirichlet(np.ones(2), n),
+        rng.dirichlet(np.ones(2), n)]:
+        for j in range(shares.shape[1]):
+            tested = np.where(total_tested < 0, -1, np.round(np.maximum(total_tested, 0) * shares[:, j]).astype(int))
+            measures += category_columns(tested)
+
+    measures += category_columns(total_tested)
+
+    # IREAD (grade 3 only)
+    iread_tested = grade_tested["Grade3"]
+    iread_pass = rng.binomial(np.maximum(iread_tested, 0), np.clip(base_rate + 0.3, 0, 1))
+    iread_tested, iread_pass = _suppress(iread_tested, rng, iread_pass)
+    measures += [iread_pass, iread_tested]
+
+    return list(zip(*(columns + measures)))
+
+def corporation_rows(schools: SchoolSet, rows: list, year: int, start: int) -> list:
+    # sums of the traditional schools in each geographic corporation with a school in
+    # schools (never suppressed). rows are the school rows, with the measures starting
+    # at index start - a measure without any counts (a rate or a letter grade) is null
+    traditional = ~schools.is_charter
+    data = np.array([row[start:] for row in rows], dtype=object)
+
+    result = []
+    for corp in np.unique(schools.geo_corp):
+        members = data[traditional & (schools.geo_corp == corp)]
+
+        numbers = []
+        for j in range(members.shape[1]):
+            counts = [int(v) for v in members[:, j] if isinstance(v, (int, np.integer))]
+            numbers.append(sum(counts) if counts else None)
+
+        result.append(tuple([year, int(corp), "Corporation " + str(corp)] + numbers))
+
+    return result
+
+def hs_rows(schools: SchoolSet, year: int, rng: np.random.Generator, suppress: bool = True) -> list:
+    n = schools.count
+    columns = [
+        np.full(n, year), schools.corp, np.array(["Corporation " + str(c) for c in schools.corp], dtype=object),
+        schools.ids, np.array(["School " + str(s) for s in schools.ids], dtype=object), schools.school_type,
+    ]
+
+    base_rate = rng.beta(8, 2, n)
+    cohort_total = rng.poisson(schools.size * 2)
+
+    def split(total: np.ndarray, parts: int) -> np.ndarray:
+        shares = rng.dirichlet(np.full(parts, 4), n)
+        return np.round(total[:, None] * shares).astype(int)
+
+    def finish(tested: np.ndarray, *counts: np.ndarray) -> list:
+        if suppress:
+            return _suppress(tested, rng, *counts)
+        return [c.astype(object) for c in (tested,) + counts]
+
+    graduation = []
+    cohorts = [split(cohort_total, len(ethnicity)), split(cohort_total, 2), split(cohort_total, 2), split(cohort_total, 2)]
+    cohort_columns = [c[:, j] for c in cohorts for j in range(c.shape[1])] + [cohort_total, cohort_total]
+
+    for cohort in cohort_columns:
+        graduates = rng.binomial(cohort, base_rate)
+        cohort_col, graduates_col = finish(cohort, graduates)
+        rate = np.where(cohort > 0, graduates / np.maximum(cohort, 1), None).astype(object)
+        graduation += [graduates_col, cohort_col, rate]
+
+    sat = []
+    tested_total = rng.binomial(cohort_total, 0.9)
+    tested_groups = [split(tested_total, len(ethnicity)), split(tested_total, 2), split(tested_total, 2), split(tested_total, 2)]
+    tested_columns = [t[:, j] for t in tested_groups for j in range(t.shape[1])] + [tested_total]
+
+    for tested in tested_columns:
+        for _ in ["EBRW", "Math"]:
+            shares = rng.dirichlet([3, 3, 4], n)
+            below = np.round(tested * shares[:, 0]).astype(int)
+            approaching = np.round(tested * shares[:, 1]).astype(int)
+            at = np.maximum(tested - below - approaching, 0)
+            sat += finish(tested, below, approaching, at)
+
+    ahs = schools.school_type == "AHS"
+    grad_all = np.where(ahs, cohort_total, None).astype(object)
+    ccr = np.where(ahs, rng.binomial(cohort_total, 0.4), None).astype(object)
+    grades_letter = np.array(rng.choice(["A", "B", "C", "D", "F"], n), dtype=object)
+    ratings = np.array(rng.choice(["Meets Expectations", "Approaches Expectations"], n), dtype=object)
+
+    return list(zip(*(columns + graduation + sat + [grad_all, ccr, grades_letter, ratings])))
+
+def demographic_rows(ids: np.ndarray, names: list, sizes: np.ndarray, year: int, rng: np.random.Generator) -> list:
+    n = len(ids)
+    enrollment = sizes * 6
+    eth = np.round(enrollment[:, None] * rng.dirichlet(np.ones(len(ethnicity)), n)).astype(int)
+    sub = np.round(enrollment[:, None] * rng.dirichlet(np.ones(len(subgroup)), n)).astype(int)
+    attendance = rng.uniform(0.85, 0.98, n).round(4)
+
+    rows = []
+    for i in range(n):
+        rows.append(
+            tuple([year, int(ids[i]), names[i], float(attendance[i]), int(enrollment[i])]
+            + [int(v) for v in eth[i]] + [int(v) for v in sub[i]])
+        )
+
+    return rows
+
+def growth_rows(schools: SchoolSet, year: int, rng: np.random.Generator) -> list:
+    k8 = np.flatnonzero(~schools.is_hs)
+    count = len(k8) * growth_students_per_school
+
+    school = np.repeat(schools.ids[k8], growth_students_per_school)
+    day_162 = np.where(rng.random(count) < 0.85, "TRUE", "FALSE")
+    subject = rng.choice(["ELA", "Math"], count)
+    grade = rng.choice(growth_grades, count)
+    eth = rng.choice(growth_ethnicity, count)
+    ses = rng.choice(["Free or Reduced Price Meals", "Paid Meals"], count)
+    ell = rng.choice(["English Language Learners", "Non English Language Learners"], count)
+    sped = rng.choice(["Special Education", "General Education"], count)
+    level = np.where(rng.random(count) < 0.6, "Adequate Growth", "Not Adequate Growth")
+
+    return [
+        (year, int(school[i]), day_162[i], subject[i], grade[i], eth[i], ses[i], ell[i], sped[i], level[i])
+        for i in range(count)
+    ]
+
+def generate_database(path: str, scale: float = 1, seed: int = 0) -> dict:
+    """
+    Writes a synthetic database (replacing any existing file at path).
+
+    Args:
+        path (str): output path
+        scale (float, optional): multiple of the state's school count. Defaults to 1.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        dict: rows written per table
+    """
+    rng = np.random.default_rng(seed)
+    schools = SchoolSet(max(10, int(state_school_count * scale)), rng)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    db = sqlite3.connect(tmp_path)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+
+    counts = {}
+
+    def write(table: str, columns: list, rows: list):
+        if table not in counts:
+            create_table(db, table, columns)
+            counts[table] = 0
+        insert_rows(db, table, columns, rows)
+        counts[table] += len(rows)
+
+    # K8
+    k8 = ~schools.is_hs
+    k8_schools = _subset(schools, k8)
+    k8_columns = ["Year", "CorporationID", "CorporationName", "SchoolID", "SchoolName", "LowGrade", "HighGrade", "Lat", "Lon"] \
+        + k8_measure_columns()
+    corp_k8_columns = ["Year", "CorporationID", "CorporationName"] + k8_measure_columns()
+
+    for year in k8_years:
+        rows = k8_rows(k8_schools, year, rng)
+        write("academic_data_k8", k8_columns, rows)
+        write("corporation_data_k8", corp_k8_columns, corporation_rows(k8_schools, rows, year, 9))
+
+    # HS
+    hs_schools = _subset(schools, schools.is_hs)
+    hs_columns = ["Year", "CorporationID", "CorporationName", "SchoolID", "SchoolName", "SchoolType"] + hs_measure_columns()
+    corp_hs_columns = ["Year", "CorporationID", "CorporationName"] + hs_measure_columns()
+
+    for year in hs_years:
+        write("academic_data_hs", hs_columns, hs_rows(hs_schools, year, rng))
+
+        # the corporation sums come from the unsuppressed numbers
+        rows = hs_rows(hs_schools, year, rng, suppress=False)
+        write("corporation_data_hs", corp_hs_columns, corporation_rows(hs_schools, rows, year, 6))
+
+    # demographics - schools and corporations (for corporations SchoolID is the CorporationID)
+    demographic_columns = ["Year", "SchoolID", "SchoolName", "AvgAttendance", "TotalEnrollment"] + ethnicity + subgroup
+    corp_ids = np.unique(schools.geo_corp)
+    corp_sizes = np.array([schools.size[schools.geo_corp == c].sum() for c in corp_ids])
+
+    for year in sorted(set(k8_years + hs_years)):
+        write("demographic_data", demographic_columns,
+            demographic_rows(schools.ids, ["School " + str(s) for s in schools.ids], schools.size, year, rng))
+        write("demographic_data", demographic_columns,
+            demographic_rows(corp_ids, ["Corporation " + str(c) for c in corp_ids], corp_sizes, year, rng))
+
+    # growth (one row per student)
+    growth_columns = ["TestYear", "MajorityEnrolledSchoolID", "Day162", "Subject", "GradeLevel", "Ethnicity",
+        "SocioeconomicStatus", "EnglishLearnerStatus", "SpecialEducationStatus", "ILEARNGrowthLevel"]
+
+    for year in growth_years:
+        write("growth", growth_columns, growth_rows(schools, year, rng))
+
+    # school index
+    index_columns = ["SchoolID", "SchoolName", "CorporationID", "GEOCorp", "SchoolType", "Lat", "Lon", "LowGrade", "HighGrade"]
+    write("school_index", index_columns, [
+        (int(schools.ids[i]), "School " + str(schools.ids[i]), int(schools.corp[i]), int(schools.geo_corp[i]),
+            str(schools.school_type[i]), float(schools.lat[i]), float(schools.lon[i]),
+            schools.grade_label(schools.low_grade[i]), schools.grade_label(schools.high_grade[i]))
+        for i in range(schools.count)
+    ])
+
+    db.commit()
+    db.close()
+
+    os.replace(tmp_path, path)
+
+    return counts
+
+def _subset(schools: SchoolSet, mask: np.ndarray) -> SchoolSet:
+    subset = SchoolSet.__new__(SchoolSet)
+    subset.__dict__ = {k: (v[mask] if isinstance(v, np.ndarray) else v) for k, v in schools.__dict__.items()}
+    subset.count = int(mask.sum())
+
+    return subset
+
+def default_path(scale: float) -> str:
+    return os.path.join("benchmarks", "data", "db_" + format(scale, "g") + "x.db")
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Build a synthetic db_all.db for benchmarking")
+    parser.add_argument("--scale", type=float, default=1, help="multiple of the state's school count (e.g. 1, 10, 100)")
+    parser.add_argument("--output", default="", help="output path (default: benchmarks/data/db_<scale>x.db)")
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args(argv)
+
+    path = options.output or default_path(options.scale)
+    counts = generate_database(path, options.scale, options.seed)
+
+    for table, rows in counts.items():
+        print(table + ": " + str(rows) + " rows")
+    print("Wrote " + path)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
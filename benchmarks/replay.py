@@ -0,0 +1,317 @@
+#############################################
+# ICSB Dashboard - Traffic Replay           #
+#############################################
+# author:   jbetley
+# version:  1.09
+# date:     08/14/23
+
+# Fires recorded callback traffic (TRAFFIC_LOG - see pages/traffic.py) at a running
+# dashboard and reports latency percentiles, throughput and error rate, overall and
+# per callback - production load reproduced against a candidate build.
+#
+#   python -m benchmarks.replay traffic.jsonl --url http://127.0.0.1:8050 \
+#       --username USER --password PASSWORD [--concurrency 8] [--speed 0] [--output FILE]
+#
+# Every worker thread logs in once (the callback endpoint requires a session) and then
+# takes the next request from the recording. By default requests are sent as fast as
+# the workers allow; --speed 1 keeps the recorded spacing (2 = twice as fast). Only
+# the POSTs with a body are replayed - the recorded background callback polls
+# (?job=...) refer to jobs on the recording server. A background callback answers
+# with a job id instead of its outputs, so the replayer polls for the job's result
+# (every --poll-interval seconds, as the renderer does) and the latency covers the
+# job, not just its submission. A request fails if it raises, gets a status other
+# than 200/204, or its job does not finish within --timeout.
+
+import argparse
+import http.cookiejar
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+def load_traffic(path: str, limit: int = 0) -> list:
+    """
+    Reads the replayable records from a traffic log.
+
+    Args:
+        path (str): JSON-lines file written by pages/traffic.py
+        limit (int, optional): maximum number of records (0 for all). Defaults to 0.
+
+    Returns:
+        list: the records, in recorded order
+    """
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            record = json.loads(line)
+            if record.get("method") != "POST" or not record.get("body") or "job=" in record.get("query", ""):
+                continue
+
+            records.append(record)
+            if limit and len(records) >= limit:
+                break
+
+    return records
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return None
+
+    position = (len(ordered) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize(results: list, elapsed: float) -> dict:
+    latencies = [r["ms"] for r in results]
+    errors = [r for r in results if not r["ok"]]
+
+    summary = {
+        "requests": len(results),
+        "errors": len(errors),
+        "error_rate": len(errors) / len(results) if results else 0.0,
+        "seconds": elapsed,
+        "throughput": len(results) / elapsed if elapsed else 0.0,
+        "bytes": sum(r["bytes"] for r in results),
+    }
+
+    if latencies:
+        summary.update({
+            "mean_ms": statistics.fmean(latencies),
+            "p50_ms": percentile(latencies, 50),
+            "p90_ms": percentile(latencies, 90),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "max_ms": max(latencies),
+        })
+
+    return summary
+
+def _is_unauthorized(body: bytes) -> bool:
+    try:
+        return json.loads(body).get("status") == "401"
+    except (ValueError, AttributeError):
+        return False
+
+def _background_job(body: bytes):
+    # the {"cacheKey": ..., "job": ...} answer to a background callback, or None
+    if len(body) > 4096:
+        return None
+
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+
+    if isinstance(data, dict) and "cacheKey" in data and "job" in data and "response" not in data:
+        return data
+
+    return None
+
+class Replayer:
+    # one logged-in opener (cookie jar) per worker thread
+    def __init__(self, url: str, username: str = "", password: str = "", timeout: float = 120,
+        poll_interval: float = 0.1):
+        self.url = url.rstrip("/")
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+
+    def _opener(self):
+        opener = getattr(self._local, "opener", None)
+
+        if opener is None:
+            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+            if self.username:
+                form = urllib.parse.urlencode({"username": self.username, "password": self.password}).encode()
+                with opener.open(self.url + "/login", form, timeout=self.timeout) as response:
+                    # a failed login redirects back to /login?error=1
+                    if "error=" in response.geturl():
+                        raise RuntimeError("login failed for " + self.username)
+
+            self._local.opener = opener
+
+        return opener
+
+    def _post(self, url: str, data: bytes) -> tuple:
+        request = urllib.request.Request(url, data=data, method="POST", headers={"Content-Type": "application/json"})
+
+        with self._opener().open(request, timeout=self.timeout) as response:
+            return response.read(), response.status
+
+    def _wait_for_job(self, endpoint: str, data: bytes, job: dict, start: float) -> tuple:
+        # polls a background job with the same body until it answers with its outputs
+        # (or 204 - no update, e.g. the job was cancelled)
+        url = self.url + endpoint + "?" + urllib.parse.urlencode({"cacheKey": job["cacheKey"], "job": job["job"]})
+        polls = 0
+
+        while True:
+            if time.perf_counter() - start > self.timeout:
+                raise TimeoutError("background job " + str(job["job"]) + " did not finish")
+
+            time.sleep(self.poll_interval)
+            body, status = self._post(url, data)
+            polls += 1
+
+            if status == 204 or b'"response"' in body:
+                return body, status, polls
+
+    def send(self, record: dict) -> dict:
+        endpoint = record.get("endpoint") or "/_dash-update-component"
+        data = json.dumps(record["body"]).encode("utf-8")
+
+        result = {"output": record.get("output"), "status": None, "bytes": 0, "ok": False, "error": None, "polls": 0}
+
+        start = time.perf_counter()
+        try:
+            body, result["status"] = self._post(self.url + endpoint, data)
+
+            job = _background_job(body) if result["status"] == 200 else None
+            if job is not None:
+                body, result["status"], result["polls"] = self._wait_for_job(endpoint, data, job, start)
+
+            result["bytes"] = len(body)
+            result["ok"] = result["status"] in (200, 204)
+
+            # an expired or missing session is answered with 200 and a small 401 body
+            if len(body) < 256 and _is_unauthorized(body):
+                result["ok"] = False
+                result["error"] = "unauthorized"
+
+        except urllib.error.HTTPError as e:
+            result["status"] = e.code
+            result["error"] = "HTTP " + str(e.code)
+
+        except Exception as e:
+            result["error"] = type(e).__name__ + ": " + str(e)
+
+        result["ms"] = (time.perf_counter() - start) * 1000
+
+        return result
+
+def replay(records: list, replayer: Replayer, concurrency: int = 8, speed: float = 0) -> dict:
+    """
+    Sends the records with a pool of worker threads.
+
+    Args:
+        records (list): from load_traffic()
+        replayer (Replayer): target server and credentials
+        concurrency (int, optional): worker threads. Defaults to 8.
+        speed (float, optional): 0 to send as fast as possible, otherwise the recorded
+            spacing divided by speed. Defaults to 0.
+
+    Returns:
+        dict: overall summary, per-callback summaries, and the individual errors
+    """
+    first = records[0].get("ts", 0) if records else 0
+
+    def run(record):
+        if speed > 0:
+            delay = (record.get("ts", first) - first) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        return replayer.send(record)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(run, records))
+    elapsed = time.perf_counter() - start
+
+    by_output = {}
+    for result in results:
+        by_output.setdefault(result["output"], []).append(result)
+
+    errors = {}
+    for result in results:
+        if not result["ok"]:
+            key = result["error"] or "HTTP " + str(result["status"])
+            errors[key] = errors.get(key, 0) + 1
+
+    return {
+        "summary": summarize(results, elapsed),
+        "callbacks": {output: summarize(items, elapsed) for output, items in by_output.items()},
+        "errors": errors,
+    }
+
+def _short(output: str) -> str:
+    # first output of a (multi output) callback id
+    if output and output.startswith(".."):
+        return output[2:-2].split("...")[0] + (" (+)" if "..." in output[2:-2] else "")
+    return str(output)
+
+def print_report(report: dict):
+    line = "{:<44} {:>7} {:>7} {:>9} {:>9} {:>9} {:>9}"
+    print(line.format("callback", "count", "errors", "p50 ms", "p95 ms", "p99 ms", "max ms"))
+
+    def row(name, s):
+        fmt = lambda v: "-" if v is None else "{:.1f}".format(v)
+        print(line.format(name[:44], s["requests"], s["errors"], fmt(s.get("p50_ms")), fmt(s.get("p95_ms")),
+            fmt(s.get("p99_ms")), fmt(s.get("max_ms"))))
+
+    for output, s in sorted(report["callbacks"].items(), key=lambda item: -item[1]["requests"]):
+        row(_short(output), s)
+    row("all", report["summary"])
+
+    s = report["summary"]
+    print("{} requests in {:.1f}s - {:.1f} req/s, error rate {:.2%}".format(
+        s["requests"], s["seconds"], s["throughput"], s["error_rate"]))
+
+    for error, count in report["errors"].items():
+        print("  " + str(count) + " x " + error)
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay recorded dashboard traffic against a server")
+    parser.add_argument("traffic", help="JSON-lines file recorded with TRAFFIC_LOG")
+    parser.add_argument("--url", default="http://127.0.0.1:8050")
+    parser.add_argument("--username", default=os.getenv("REPLAY_USERNAME", ""))
+    parser.add_argument("--password", default=os.getenv("REPLAY_PASSWORD", ""))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--speed", type=float, default=0, help="0: as fast as possible, 1: recorded pacing")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N requests")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds per request (including its background job)")
+    parser.add_argument("--poll-interval", type=float, default=0.1, help="seconds between background job polls")
+    parser.add_argument("--output", default="", help="write the report as JSON")
+    options = parser.parse_args(argv)
+
+    records = load_traffic(options.traffic, options.limit)
+    if not records:
+        print("No replayable requests in " + options.traffic)
+        return 1
+
+    replayer = Replayer(options.url, options.username, options.password, options.timeout, options.poll_interval)
+    report = replay(records, replayer, options.concurrency, options.speed)
+
+    report["metadata"] = {
+        "traffic": os.path.abspath(options.traffic),
+        "url": options.url,
+        "concurrency": options.concurrency,
+        "speed": options.speed,
+    }
+
+    print_report(report)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Wrote " + options.output)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
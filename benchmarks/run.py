@@ -0,0 +1,761 @@
+#############################################
+# ICSB Dashboard - Stage Benchmarks         #
+#############################################
+# author:   jbetley
+# version:  1.09
+# date:     08/14/23
+
+# Times each stage of the academic data pipeline against a synthetic database (see
+# generate_db.py) and writes the results as JSON, so runs can be compared between
+# branches and machines.
+#
+# Every stage has a setup function that runs the earlier stages once for a sample of
+# schools and returns one call per input - only the stage itself is timed. Inputs the
+# stage cannot handle (e.g. a school with every category suppressed) raise during
+# setup and are counted as skipped rather than timed. Each round times one call per
+# input; a stage's samples are the mean time per call of each round. A stage left with
+# fewer than --min-inputs timed inputs is reported as an error (and the run exits 1), as
+# its numbers would describe too few schools - or none.
+#
+# Caching is disabled (OUTPUT_CACHE_MAX_ENTRIES=0, and the query cache is cleared
+# where a stage is "cold"), so the numbers measure the work itself.
+#
+# Usage (from the project root):
+#   python -m benchmarks.run --scale 1 [--rounds 5] [--schools 20] [--filter REGEX] [--output FILE]
+#   python -m benchmarks.run --db path/to/db_all.db
+#
+# To measure the series end to end, copy benchmarks/ into a checkout of an older tree and
+# run it there - stages that need an API the tree does not have yet are reported as
+# errors rather than stopping the run. Trees that predate DB_PATH always open
+# data/db_all.db, so copy the synthetic database there and pass --db data/db_all.db.
+#
+# The database for --scale is generated first if it does not exist. The comparable_schools
+# table is built from it (pages.db_maintenance) before the run if it is missing.
+
+import argparse
+import datetime
+import inspect
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import time
+import warnings
+
+from .generate_db import generate_database, default_path
+
+stages = []
+
+def stage(name: str, group: str):
+    """
+    Registers a stage. The decorated function takes the benchmark context and
+    returns a list of zero-argument callables, one per input.
+    """
+    def decorator(setup):
+        stages.append({"name": name, "group": group, "setup": setup})
+        return setup
+
+    return decorator
+
+def error_message(e: Exception) -> str:
+    return type(e).__name__ + ": " + str(e).split("\n")[0][:120]
+
+def prepare(calls: list) -> tuple:
+    # runs each call once (warm-up). calls that raise are dropped, as are inputs the
+    # setup could not prepare (a setup puts the exception in the list instead)
+    ready = []
+    errors = {}
+
+    for call in calls:
+        try:
+            if isinstance(call, Exception):
+                raise call
+            call()
+        except Exception as e:
+            message = error_message(e)
+            errors[message] = errors.get(message, 0) + 1
+            continue
+
+        ready.append(call)
+
+    return ready, errors
+
+def summarize(samples: list) -> dict:
+    ordered = sorted(samples)
+
+    if len(ordered) > 1:
+        q1, _, q3 = statistics.quantiles(ordered, n=4, method="inclusive")
+    else:
+        q1 = q3 = ordered[0]
+
+    return {
+        "min": ordered[0],
+        "max": ordered[-1],
+        "mean": statistics.fmean(ordered),
+        "median": statistics.median(ordered),
+        "q1": q1,
+        "q3": q3,
+        "iqr": q3 - q1,
+    }
+
+def run_stage(item: dict, context: dict, rounds: int) -> dict:
+    result = {"group": item["group"], "inputs": 0, "skipped": 0, "errors": {}}
+
+    start = time.perf_counter()
+
+    try:
+        calls = item["setup"](context)
+    except Exception as e:
+        result["errors"] = {error_message(e): 1}
+        return result
+
+    calls, errors = prepare(calls)
+
+    result["setup_seconds"] = time.perf_counter() - start
+    result["inputs"] = len(calls)
+    result["skipped"] = sum(errors.values())
+    result["errors"] = errors
+
+    if not calls:
+        return result
+
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for call in calls:
+            call()
+        samples.append((time.perf_counter() - start) / len(calls))
+
+    result["samples"] = samples
+    result.update(summarize(samples))
+
+    return result
+
+## Context ##
+
+def has_table(db_path: str, table: str) -> bool:
+    import sqlite3
+
+    db = sqlite3.connect(db_path)
+
+    try:
+        return db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+    finally:
+        db.close()
+
+def build_context(db_path: str, sample_size: int) -> dict:
+    # sample schools that have data in the most recent year. charter schools are
+    # used, as the school and corporation data are then distinct (as they are for
+    # the schools the dashboard covers)
+    import sqlite3
+
+    db = sqlite3.connect(db_path)
+
+    try:
+        year = db.execute("SELECT MAX(Year) FROM academic_data_k8").fetchone()[0]
+
+        k8 = [row[0] for row in db.execute('''
+            SELECT a.SchoolID
+                FROM academic_data_k8 a JOIN school_index s ON a.SchoolID = s.SchoolID
+                WHERE a.Year = ? AND a.CorporationID != s.GEOCorp
+                ORDER BY a.SchoolID LIMIT ?''', (year, sample_size))]
+
+        hs = [row[0] for row in db.execute('''
+            SELECT DISTINCT a.SchoolID
+                FROM academic_data_hs a JOIN school_index s ON a.SchoolID = s.SchoolID
+                WHERE a.CorporationID != s.GEOCorp
+                ORDER BY a.SchoolID LIMIT ?''', (sample_size,))]
+
+        years = [row[0] for row in db.execute("SELECT DISTINCT Year FROM academic_data_k8 ORDER BY Year DESC")]
+
+    finally:
+        db.close()
+
+    return {"year": str(year), "years": [str(y) for y in years], "k8": k8, "hs": hs, "prepared": {}}
+
+# The suite is also run against older trees (e.g. the baseline, to measure a change
+# end to end), so APIs added later in the series are used only where they exist
+def uncached(function):
+    # __wrapped__ skips the output cache, on trees that have one
+    return getattr(function, "__wrapped__", function)
+
+def academic_data(get_academic_data, schools: list, year: str, columns: str):
+    # get_academic_data with only the columns matching a regex (columns= selects them
+    # in SQL, on trees that support it)
+    if "columns" in inspect.signature(get_academic_data).parameters:
+        return get_academic_data(schools, year, columns=columns)
+
+    return get_academic_data(schools, year).filter(regex=columns)
+
+def cached(context: dict, key, build):
+    # setup results shared between stages (e.g. processed school data)
+    prepared = context["prepared"]
+    if key not in prepared:
+        prepared[key] = build()
+
+    return prepared[key]
+
+def raw_k8_data(context: dict, school, year: str):
+    from pages.load_data import get_academic_data
+
+    return cached(context, ("raw_k8", school, year),
+        lambda: get_academic_data([school], year).replace({"^": "***"}))
+
+def k8_school_data(context: dict, school, year: str):
+    from pages.process_data import process_k8_academic_data
+
+    return cached(context, ("k8", school, year), lambda: process_k8_academic_data(raw_k8_data(context, school, year)))
+
+def k8_yearly_data(context: dict, school):
+    # Category plus YYYYSchool and YYYYN-Size columns, most recent year first - the
+    # layout calculate_k8_yearly_metrics() and calculate_k8_comparison_metrics() take
+    import pandas as pd
+
+    def build():
+        frames = []
+        for year in context["years"]:
+            raw = raw_k8_data(context, school, year)
+            if len(raw.index) == 0:
+                continue
+
+            data = k8_school_data(context, school, year)
+            data = data[~data["Category"].isin(["Low Grade", "High Grade"])]
+            data = data.set_axis(["Category", year + "School"], axis=1)
+
+            tested = data["Category"].replace("IREAD Proficient %", "IREAD Test N") \
+                .str.replace(r" Proficient %$", " Total Tested", regex=True)
+            data[year + "N-Size"] = pd.to_numeric(tested.map(raw.iloc[0]), errors="coerce").to_numpy()
+
+            frames.append(data.set_index("Category"))
+
+        return pd.concat(frames, axis=1).reset_index() if frames else pd.DataFrame()
+
+    return cached(context, ("k8_yearly", school), build)
+
+def k8_corp_data(context: dict, school):
+    from pages.load_data import get_k8_corporation_academic_data
+    from pages.process_data import process_k8_corp_academic_data
+
+    return cached(context, ("k8_corp", school), lambda: process_k8_corp_academic_data(
+        get_k8_corporation_academic_data(school), k8_school_data(context, school, context["year"])))
+
+def hs_data(context: dict, school) -> tuple:
+    from pages.load_data import get_high_school_academic_data, get_hs_corporation_academic_data
+    from pages.process_data import filter_high_school_academic_data, process_high_school_academic_data
+
+    def build():
+        school_data = process_high_school_academic_data(
+            filter_high_school_academic_data(get_high_school_academic_data(school)), str(school))
+        corp_data = process_high_school_academic_data(
+            filter_high_school_academic_data(get_hs_corporation_academic_data(school)), str(school))
+
+        return school_data, corp_data
+
+    return cached(context, ("hs", school), build)
+
+def analysis_data(context: dict, schools: list):
+    # the display academic data for update_academic_analysis (one row per school)
+    from pages.load_data import get_academic_data
+    from pages.process_data import process_k8_academic_data
+
+    def build():
+        raw = get_academic_data(schools, context["year"]).replace({"^": "***"})
+        data = process_k8_academic_data(raw)
+
+        return data.set_index("Category").T.rename_axis("School Name").rename_axis(None, axis=1).reset_index()
+
+    return cached(context, ("analysis", tuple(schools)), build)
+
+def school_groups(context: dict) -> list:
+    # single schools plus one multi-school selection
+    schools = context["k8"]
+
+    return [[s] for s in schools[:5]] + ([schools[:10]] if len(schools) > 1 else [])
+
+## run_query ##
+
+def _query_stage(accessor: str, schools: str, cold: bool):
+    def setup(context: dict) -> list:
+        from pages import load_data
+
+        fetch = getattr(load_data, accessor)
+
+        if accessor == "get_academic_data":
+            args = [([s], context["year"]) for s in context[schools]]
+        elif accessor == "get_nearest_schools":
+            args = [(s, context["year"]) for s in context[schools]]
+        else:
+            args = [(s,) for s in context[schools]]
+
+        # trees without a query cache run every query cold
+        clear_cache = getattr(load_data, "clear_query_cache", lambda: None)
+
+        def call(a):
+            if cold:
+                clear_cache()
+            return fetch(*a)
+
+        return [lambda a=a: call(a) for a in args]
+
+    return setup
+
+for _accessor, _schools in [
+    ("get_academic_data", "k8"),
+    ("get_k8_corporation_academic_data", "k8"),
+    ("get_high_school_academic_data", "hs"),
+    ("get_hs_corporation_academic_data", "hs"),
+    ("get_demographic_data", "k8"),
+    ("get_growth_data", "k8"),
+    ("get_nearest_schools", "k8"),
+]:
+    stage("run_query." + _accessor + ".cold", "run_query")(_query_stage(_accessor, _schools, True))
+    stage("run_query." + _accessor + ".warm", "run_query")(_query_stage(_accessor, _schools, False))
+
+## process_data ##
+
+@stage("calculate_proficiency", "calculations")
+def _calculate_proficiency(context: dict) -> list:
+    import pandas as pd
+    from pages.calculations import calculate_proficiency
+
+    calls = []
+    for group in school_groups(context):
+        def setup_data(group=group):
+            from pages.load_data import get_academic_data
+
+            data = get_academic_data(group, context["year"]).replace({"^": "***"})
+            data = data.filter(regex=r"Total Tested$|Total Proficient$", axis=1)
+            data.update(data.apply(pd.to_numeric, errors="coerce"))
+
+            return data
+
+        data = setup_data()
+        calls.append(lambda data=data: calculate_proficiency(data.copy()))
+
+    return calls
+
+@stage("process_k8_academic_data", "process_data")
+def _process_k8_academic_data(context: dict) -> list:
+    from pages.process_data import process_k8_academic_data
+
+    return [
+        lambda s=s: process_k8_academic_data(raw_k8_data(context, s, context["year"]))
+        for s in context["k8"]
+    ]
+
+@stage("process_k8_corp_academic_data", "process_data")
+def _process_k8_corp_academic_data(context: dict) -> list:
+    from pages.load_data import get_k8_corporation_academic_data
+    from pages.process_data import process_k8_corp_academic_data
+
+    calls = []
+    for s in context["k8"]:
+        corp = get_k8_corporation_academic_data(s)
+        school = k8_school_data(context, s, context["year"])
+        calls.append(lambda corp=corp, school=school: process_k8_corp_academic_data(corp, school))
+
+    return calls
+
+@stage("filter_high_school_academic_data", "process_data")
+def _filter_high_school_academic_data(context: dict) -> list:
+    from pages.load_data import get_high_school_academic_data
+    from pages.process_data import filter_high_school_academic_data
+
+    return [
+        lambda data=get_high_school_academic_data(s): filter_high_school_academic_data(data)
+        for s in context["hs"]
+    ]
+
+@stage("process_high_school_academic_data", "process_data")
+def _process_high_school_academic_data(context: dict) -> list:
+    from pages.load_data import get_high_school_academic_data, get_hs_corporation_academic_data
+    from pages.process_data import filter_high_school_academic_data, process_high_school_academic_data
+
+    calls = []
+    for s in context["hs"]:
+        for fetch in [get_high_school_academic_data, get_hs_corporation_academic_data]:
+            data = filter_high_school_academic_data(fetch(s))
+            calls.append(lambda data=data, s=s: process_high_school_academic_data(data, str(s)))
+
+    return calls
+
+@stage("merge_high_school_data", "process_data")
+def _merge_high_school_data(context: dict) -> list:
+    from pages.process_data import merge_high_school_data
+
+    calls = []
+    for s in context["hs"]:
+        school_data, corp_data = hs_data(context, s)
+
+        # merge_high_school_data() changes the column type of its arguments
+        calls.append(lambda a=school_data, b=corp_data: merge_high_school_data(a.copy(), b.copy()))
+
+    return calls
+
+@stage("process_growth_data", "process_data")
+def _process_growth_data(context: dict) -> list:
+    from pages.load_data import get_growth_data
+    from pages.process_data import process_growth_data
+
+    calls = []
+    for s in context["k8"]:
+        data = get_growth_data(s)
+        for category in ["Grade Level", "Ethnicity", "Socioeconomic Status"]:
+            calls.append(lambda data=data, category=category: process_growth_data(data, category))
+
+    return calls
+
+## calculate_metrics ##
+
+@stage("calculate_attendance_metrics", "calculate_metrics")
+def _calculate_attendance_metrics(context: dict) -> list:
+    from pages.calculate_metrics import calculate_attendance_metrics
+
+    calculate = uncached(calculate_attendance_metrics)
+
+    return [
+        lambda s=s: calculate(str(s), context["year"])
+        for s in context["k8"]
+    ]
+
+@stage("calculate_k8_yearly_metrics", "calculate_metrics")
+def _calculate_k8_yearly_metrics(context: dict) -> list:
+    from pages.calculate_metrics import calculate_k8_yearly_metrics
+
+    return [
+        lambda data=k8_yearly_data(context, s): calculate_k8_yearly_metrics(data.copy())
+        for s in context["k8"]
+    ]
+
+@stage("calculate_k8_comparison_metrics", "calculate_metrics")
+def _calculate_k8_comparison_metrics(context: dict) -> list:
+    from pages.calculate_metrics import calculate_k8_comparison_metrics
+
+    calls = []
+    for s in context["k8"]:
+        school_data = k8_yearly_data(context, s)
+        corp_data = k8_corp_data(context, s)
+        calls.append(lambda a=school_data, b=corp_data: calculate_k8_comparison_metrics(a.copy(), b.copy(), context["year"]))
+
+    return calls
+
+@stage("calculate_iread_metrics", "calculate_metrics")
+def _calculate_iread_metrics(context: dict) -> list:
+    from pages.calculate_metrics import calculate_iread_metrics
+
+    calls = []
+    for s in context["k8"]:
+        data = k8_yearly_data(context, s)
+        data = data.loc[data["Category"] == "IREAD Proficient %", ["Category"] + [c for c in data.columns if c.endswith("School")]]
+        data.columns = data.columns.str.replace("School", "")
+
+        if len(data.index) > 0:
+            calls.append(lambda data=data: calculate_iread_metrics(data.copy()))
+
+    return calls
+
+@stage("calculate_high_school_metrics", "calculate_metrics")
+def _calculate_high_school_metrics(context: dict) -> list:
+    from pages.process_data import merge_high_school_data
+    from pages.calculate_metrics import calculate_high_school_metrics
+
+    calls = []
+    for s in context["hs"]:
+        school_data, corp_data = hs_data(context, s)
+
+        try:
+            data = merge_high_school_data(school_data.copy(), corp_data.copy())
+        except Exception as e:
+            calls.append(e)
+            continue
+
+        calls.append(lambda data=data: calculate_high_school_metrics(data))
+
+    return calls
+
+## chart and table builders ##
+
+@stage("build_analysis_figures", "charts")
+def _build_analysis_figures(context: dict) -> list:
+    from pages.analysis_helpers import build_analysis_figures
+
+    return [
+        lambda data=analysis_data(context, group): build_analysis_figures(data, "serial")
+        for group in school_groups(context)
+    ]
+
+@stage("build_analysis_figures.process", "charts")
+def _build_analysis_figures_process(context: dict) -> list:
+    # only faster than serial with a core per figure to spare
+    from pages.analysis_helpers import build_analysis_figures
+
+    return [
+        lambda data=analysis_data(context, group): build_analysis_figures(data, "process")
+        for group in school_groups(context)
+    ]
+
+@stage("make_bar_chart", "charts")
+def _make_bar_chart(context: dict) -> list:
+    import pandas as pd
+    from pages.load_data import info_categories
+    from pages.chart_helpers import make_bar_chart
+
+    category = "School Total|ELA Proficient %"
+
+    calls = []
+    for group in school_groups(context):
+        data = analysis_data(context, group)[info_categories + [category]].copy()
+        data[category] = pd.to_numeric(data[category])
+        calls.append(lambda data=data: make_bar_chart(data, category, "ELA Proficiency"))
+
+    return calls
+
+@stage("make_line_chart", "charts")
+def _make_line_chart(context: dict) -> list:
+    from pages.chart_helpers import make_line_chart
+
+    calls = []
+    for s in context["k8"]:
+        data = k8_yearly_data(context, s)
+        data = data[data["Category"].str.contains(r"^Grade \d\|ELA", regex=True)]
+        data = data[["Category"] + [c for c in data.columns if c.endswith("School")]]
+        data = data.set_index("Category").T.rename_axis("Year").rename_axis(None, axis=1).reset_index()
+        data["Year"] = data["Year"].str.replace("School", "")
+        data["School Name"] = "School " + str(s)
+
+        calls.append(lambda data=data: make_line_chart(data, "ELA Proficiency by Grade"))
+
+    return calls
+
+@stage("make_growth_chart", "charts")
+def _make_growth_chart(context: dict) -> list:
+    from pages.load_data import get_growth_data
+    from pages.process_data import process_growth_data
+    from pages.chart_helpers import make_growth_chart
+
+    calls = []
+    for s in context["k8"]:
+        fig_data, _ = process_growth_data(get_growth_data(s), "Grade Level")
+
+        # one chart per subject (the chart labels each line with the part before the "|")
+        for subject in ["ELA", "Math"]:
+            data_me = fig_data.filter(regex=r"^Majority Enrolled_.*\|" + subject + "$").rename(columns=lambda c: c.split("_", 1)[1])
+            data_162 = fig_data.filter(regex=r"^162 Days_.*\|" + subject + "$").rename(columns=lambda c: c.split("_", 1)[1])
+
+            calls.append(lambda a=data_me, b=data_162: make_growth_chart(a.copy(), b.copy(), "Adequate Growth by Grade"))
+
+    return calls
+
+@stage("create_growth_table", "tables")
+def _create_growth_table(context: dict) -> list:
+    from pages.load_data import get_growth_data
+    from pages.process_data import process_growth_data
+    from pages.table_helpers import create_growth_table
+
+    calls = []
+    for s in context["k8"]:
+        _, table_data = process_growth_data(get_growth_data(s), "Grade Level")
+        calls.append(lambda data=table_data: create_growth_table(data.copy(), "Adequate Growth by Grade"))
+
+    return calls
+
+@stage("create_comparison_table", "tables")
+def _create_comparison_table(context: dict) -> list:
+    from pages.string_helpers import create_school_label
+    from pages.table_helpers import create_comparison_table
+
+    category = "School Total|ELA Proficient %"
+
+    calls = []
+    for group in school_groups(context):
+        data = analysis_data(context, group)
+        table_data = data[["School Name", category]].copy()
+        table_data["School Name"] = create_school_label(data)
+        calls.append(lambda data=table_data: create_comparison_table(data.copy(), "Proficiency"))
+
+    return calls
+
+@stage("create_metric_table", "tables")
+def _create_metric_table(context: dict) -> list:
+    from pages.calculate_metrics import calculate_k8_comparison_metrics
+    from pages.table_helpers import create_metric_table
+
+    calls = []
+    for s in context["k8"]:
+        data = calculate_k8_comparison_metrics(k8_yearly_data(context, s).copy(), k8_corp_data(context, s).copy(), context["year"])
+        calls.append(lambda data=data: create_metric_table(["Comparison: Proficiency"], data.copy()))
+
+    return calls
+
+## callbacks ##
+
+@stage("update_academic_analysis", "callbacks")
+def _update_academic_analysis(context: dict) -> list:
+    from app import update_academic_analysis
+
+    update = uncached(update_academic_analysis)
+
+    return [
+        lambda group=group: update(context["year"], group)
+        for group in school_groups(context)
+    ]
+
+def _dispatch(output: str, *values):
+    # the callback through Dash's dispatch, including JSON serialization
+    from pages.headless import run_callback
+
+    result = run_callback(output, *values)
+    if result["error"]:
+        raise RuntimeError(result["error"])
+
+    return result
+
+@stage("dispatch.update_academic_analysis", "callbacks")
+def _dispatch_update_academic_analysis(context: dict) -> list:
+    return [
+        lambda group=group: _dispatch("fig14c", context["year"], group)
+        for group in school_groups(context)
+    ]
+
+@stage("dispatch.set_corp_dropdown_options", "callbacks")
+def _dispatch_set_corp_dropdown_options(context: dict) -> list:
+    return [lambda year=year: _dispatch("corporation-dropdown.options", year, []) for year in context["years"]]
+
+@stage("dispatch.set_school_dropdown_options", "callbacks")
+def _dispatch_set_school_dropdown_options(context: dict) -> list:
+    from pages.load_data import get_academic_data
+
+    corps = academic_data(get_academic_data, context["k8"], context["year"], "^Corporation ID$")["Corporation ID"].unique()
+
+    return [lambda corp=corp: _dispatch("school-dropdown.options", [int(corp)], []) for corp in corps]
+
+## main ##
+
+def run(db_path: str, rounds: int = 5, sample_size: int = 20, pattern: str = "", indexes: bool = True,
+    min_inputs: int = 3) -> dict:
+    """
+    Runs every registered stage (or those whose name matches pattern) against the
+    database at db_path. Must be called before anything in pages is imported, as the
+    database path and cache settings are read at import time.
+
+    Args:
+        db_path (str): path to the database
+        rounds (int, optional): timed rounds per stage. Defaults to 5.
+        sample_size (int, optional): K8 and HS schools used as inputs. Defaults to 20.
+        pattern (str, optional): regular expression selecting stages. Defaults to all.
+        indexes (bool, optional): create the db_maintenance indexes first. Defaults to True.
+        min_inputs (int, optional): timed inputs a stage needs (at most sample_size) - a
+            stage with fewer gets an "error". Defaults to 3.
+
+    Returns:
+        dict: the results (metadata and one entry per stage)
+    """
+    os.environ["DB_PATH"] = db_path
+    os.environ["OUTPUT_CACHE_MAX_ENTRIES"] = "0"
+    os.environ.pop("OUTPUT_CACHE_DIR", None)
+
+    try:
+        from pages import db_maintenance
+    except ImportError:
+        print("No pages.db_maintenance in this tree - running without the indexes")
+        db_maintenance = None
+
+    if db_maintenance is not None:
+        if hasattr(db_maintenance, "build_comparable_schools") and not has_table(db_path, "comparable_schools"):
+            db_maintenance.build_comparable_schools(db_path)
+
+        if indexes:
+            db_maintenance.create_indexes(db_path)
+
+    import numpy as np
+    import pandas as pd
+    import plotly
+
+    context = build_context(db_path, sample_size)
+    required = min(min_inputs, sample_size)
+
+    results = {
+        "metadata": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "database": os.path.abspath(db_path),
+            "database_bytes": os.path.getsize(db_path),
+            "rounds": rounds,
+            "sample_size": sample_size,
+            "year": context["year"],
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "plotly": plotly.__version__,
+            "platform": platform.platform(),
+        },
+        "benchmarks": {},
+    }
+
+    for item in stages:
+        if pattern and not re.search(pattern, item["name"]):
+            continue
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            result = run_stage(item, context, rounds)
+
+        if result["inputs"] < required:
+            result["error"] = str(result["inputs"]) + " inputs, " + str(required) + " required"
+
+        results["benchmarks"][item["name"]] = result
+
+        if "median" in result:
+            print("{:<52} {:>10.2f} ms  (iqr {:.2f}, {} inputs, {} skipped)".format(
+                item["name"], result["median"] * 1000, result["iqr"] * 1000, result["inputs"], result["skipped"]))
+        else:
+            print("{:<52} {:>13}  ({} skipped)".format(item["name"], "no inputs", result["skipped"]))
+
+        if "error" in result:
+            print("    ERROR: " + result["error"] + "".join("; " + e for e in result["errors"]))
+
+    return results
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard data pipeline")
+    parser.add_argument("--scale", type=float, default=1, help="use (and generate if missing) the synthetic database at this scale")
+    parser.add_argument("--db", default="", help="database to benchmark instead of a synthetic one")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--schools", type=int, default=20, help="K8 and HS schools used as inputs")
+    parser.add_argument("--filter", default="", help="only run stages matching this regular expression")
+    parser.add_argument("--no-indexes", action="store_true", help="do not create the db_maintenance indexes")
+    parser.add_argument("--min-inputs", type=int, default=3, help="timed inputs a stage needs before it counts as an error")
+    parser.add_argument("--output", default="", help="results file (default: benchmarks/results/<timestamp>.json)")
+    options = parser.parse_args(argv)
+
+    db_path = options.db or default_path(options.scale)
+
+    if not os.path.exists(db_path):
+        if options.db:
+            parser.error("database not found: " + db_path)
+
+        print("Generating " + db_path + " . . .")
+        generate_database(db_path, options.scale)
+
+    results = run(db_path, options.rounds, options.schools, options.filter, not options.no_indexes, options.min_inputs)
+    results["metadata"]["scale"] = None if options.db else options.scale
+
+    output = options.output or os.path.join(
+        "benchmarks", "results", datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print("Wrote " + output)
+
+    failed = [name for name, result in results["benchmarks"].items() if "error" in result]
+    if failed:
+        print("FAILED: " + ", ".join(failed))
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+##############################################
+# ICSB Dashboard - Academic Analysis Figures #
+##############################################
+# author:   jbetley
+# version:  1.09
+# date:     08/14/23
+
+# The figure/table pairs on the academic analysis page. Each one only reads the
+# display_academic_data dataframe, so build_analysis_figures() can build them one after
+# another (the default), or fan them out to a bounded process pool - on a host with
+# spare cores a multi-school selection then takes about as long as the slowest figure
+# rather than the sum of all seven. The builders are pure Python (plotly and pandas
+# object handling), so a thread pool would only interleave them under the GIL. The
+# time taken by each figure is logged (DEBUG) to this module's logger and recorded as
+# a figure.<name> stage (see instrumentation.py).
+#
+# Process mode and fork safety: the dashboard worker is threaded (Flask/gunicorn
+# threads, the fetch pool), and a process forked from it could inherit a lock another
+# thread was holding at the time. So the pool's processes are never forked from the
+# worker - they are started by a "forkserver", a separate single-threaded process, and
+# import this module (and load_data) themselves. The first call in each worker pays
+# for starting the pool. Results come back pickled with cache.dumps_output.
+#
+# Configuration (environment):
+#   ANALYSIS_FIGURE_MODE      "serial" (default) or "process"
+#   ANALYSIS_FIGURE_WORKERS   pool size (default: 7 - one per figure)
+
+import logging
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+from .load_data import ethnicity, subgroup, info_categories
+from .cache import dumps_output
+from .instrumentation import record_stage
+from .chart_helpers import no_data_fig_label, make_bar_chart, make_group_bar_chart
+from .table_helpers import create_comparison_table, no_data_table, combine_group_barchart_and_table, \
+    combine_barchart_and_table
+from .string_helpers import create_school_label, identify_missing_categories, combine_school_name_and_grade_levels, \
+    create_chart_label
+
+logger = logging.getLogger(__name__)
+
+figure_modes = ["serial", "process"]
+figure_mode = os.getenv("ANALYSIS_FIGURE_MODE", "serial")
+figure_workers = int(os.getenv("ANALYSIS_FIGURE_WORKERS", 7))
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+def make_proficiency_figure(data: pd.DataFrame, category: str, title: str) -> list:
+    """
+    Current year proficiency for one category compared to similar schools (1.4.c,
+    1.4.d, and IREAD) - a bar chart and a table.
+
+    Args:
+        data (pd.DataFrame): display academic data (one row per school)
+        category (str): the proficiency column, e.g. "School Total|ELA Proficient %"
+        title (str): chart title
+
+    Returns:
+        list: the chart and table layout
+    """
+    # Get school value for specific category
+    if category in data.columns:
+
+        fig_data = data[info_categories + [category]].copy()
+
+        fig_table_data = fig_data.copy()
+
+        fig_data[category] = pd.to_numeric(fig_data[category])
+
+        fig_chart = make_bar_chart(fig_data, category, title)
+
+        fig_table_data["School Name"] = create_school_label(fig_table_data)
+
+        fig_table_data = fig_table_data[["School Name", category]]
+        fig_table_data = fig_table_data.reset_index(drop=True)
+
+        fig_table = create_comparison_table(fig_table_data, "Proficiency")
+
+    else:
+        # NOTE: This should never ever happen. So yeah.
+        fig_chart = no_data_fig_label(title, 200)
+        fig_table = no_data_table(["Proficiency"])
+
+    return combine_barchart_and_table(fig_chart, fig_table)
+
+def make_group_figure(data: pd.DataFrame, groups: list, subject: str, title: str) -> tuple:
+    """
+    Proficiency by ethnicity or subgroup compared to similar schools (1.6.a.1, 1.6.b.1,
+    1.6.a.2, and 1.6.b.2) - a group bar chart and a table.
+
+    Args:
+        data (pd.DataFrame): display academic data (one row per school)
+        groups (list): ethnicity or subgroup
+        subject (str): "ELA" or "Math"
+        title (str): chart title (used when there is no data)
+
+    Returns:
+        tuple: the chart and table layout and the style of its container
+    """
+    headers = [g + "|" + subject + " Proficient %" for g in groups]
+
+    categories = info_categories + headers
+
+    # filter dataframe by categories
+    group_data = data.loc[:, (data.columns.isin(categories))]
+
+    if len(group_data.columns) > 3:
+
+        final_data, category_string, school_string = identify_missing_categories(group_data, headers)
+
+        label = create_chart_label(final_data)
+        chart = make_group_bar_chart(final_data, label)
+        table_data = combine_school_name_and_grade_levels(final_data)
+        table = create_comparison_table(table_data, "")
+
+        figure = combine_group_barchart_and_table(chart, table, category_string, school_string)
+        container = {"display": "block"}
+
+    else:
+        figure = no_data_fig_label(title, 200)
+        container = {"display": "none"}
+
+    return figure, container
+
+# (name, builder, arguments after the data) - in output order
+analysis_figures = [
+    ("fig14c", make_proficiency_figure, ("School Total|ELA Proficient %", "Comparison: Current Year ELA Proficiency")),
+    ("fig14d", make_proficiency_figure, ("School Total|Math Proficient %", "Comparison: Current Year Math Proficiency")),
+    ("fig_iread", make_proficiency_figure, ("IREAD Proficient %", "Comparison: Current Year IREAD Proficiency")),
+    ("fig16a1", make_group_figure, (ethnicity, "ELA", "Comparison: ELA Proficiency by Ethnicity")),
+    ("fig16b1", make_group_figure, (ethnicity, "Math", "Comparison: Math Proficiency by Ethnicity")),
+    ("fig16a2", make_group_figure, (subgroup, "ELA", "Comparison: ELA Proficiency by Subgroup")),
+    ("fig16b2", make_group_figure, (subgroup, "Math", "Comparison: Math Proficiency by Subgroup")),
+]
+
+def _build_figure(builder, data: pd.DataFrame, args: tuple) -> tuple:
+    start = time.perf_counter()
+    result = builder(data, *args)
+
+    return result, time.perf_counter() - start
+
+def _build_figure_serialized(builder, data: pd.DataFrame, args: tuple) -> tuple:
+    # runs in a pool process. The result goes back pickled with dumps_output, as
+    # unpickling go.Figure objects in the parent would cost more than building them
+    result, elapsed = _build_figure(builder, data, args)
+
+    return dumps_output(result), elapsed
+
+def _get_executor():
+    with _executors_lock:
+        # a forked process (e.g. a gunicorn worker) cannot use its parent's pool
+        key = os.getpid()
+        executor = _executors.get(key)
+
+        if executor is None:
+            # see the module notes on fork safety
+            executor = _executors[key] = ProcessPoolExecutor(
+                max_workers=figure_workers, mp_context=multiprocessing.get_context("forkserver")
+            )
+
+    return executor
+
+def build_analysis_figures(data: pd.DataFrame, mode: str = "") -> dict:
+    """
+    Builds every figure in analysis_figures from the display academic data.
+
+    Args:
+        data (pd.DataFrame): display academic data (one row per school). Not modified.
+        mode (str, optional): "serial" or "process". Defaults to ANALYSIS_FIGURE_MODE.
+
+    Returns:
+        dict: the result of each builder, by figure name
+    """
+    mode = mode or figure_mode
+
+    if mode not in figure_modes:
+        raise ValueError("Unknown figure mode: " + mode + " (expected one of " + ", ".join(figure_modes) + ")")
+
+    start = time.perf_counter()
+
+    if mode == "serial" or figure_workers <= 1:
+        built = [_build_figure(builder, data, args) for _, builder, args in analysis_figures]
+
+    else:
+        executor = _get_executor()
+        futures = [executor.submit(_build_figure_serialized, builder, data, args) for _, builder, args in analysis_figures]
+        built = [(pickle.loads(result), elapsed) for result, elapsed in (future.result() for future in futures)]
+
+    figures = {}
+    for (name, _, _), (result, elapsed) in zip(analysis_figures, built):
+        figures[name] = result
+        record_stage("figure." + name, elapsed)
+        logger.debug("%s built in %.4fs", name, elapsed)
+
+    logger.debug("analysis figures (%s) built in %.4fs", mode, time.perf_counter() - start)
+
+    return figures
@@ -0,0 +1,546 @@
+#####################################
+# ICSB Dashboard - Callback Caching #
+#####################################
+# author:   jbetley
+# version:  1.09
+# date:     08/14/23
+
+# Output cache for page callbacks. Many users look at the same corporations, so the
+# figures and tables a callback returns for a given set of inputs are kept and handed
+# back on a repeat view instead of being rebuilt. Two tiers:
+#   1) an in-process LRU (per gunicorn worker), limited by entries and bytes
+#   2) an optional on-disk tier shared by every worker on the host (see DiskCache)
+# Entries are stored pickled, so every hit returns a fresh copy, and are tagged with
+# the database version (load_data.get_database_version()) - replacing the database
+# invalidates both tiers. Plotly figures are stored as their figure dicts (what
+# dcc.Graph sends to the browser anyway): unpickling a go.Figure re-validates every
+# property and is ~50x slower than the dict.
+#
+# Usage: put @memoize_output under the Dash @callback decorator. key builds the part
+# of the cache key that identifies the inputs, e.g. the year plus the order-insensitive
+# set of selected schools:
+#
+#   @callback(...)
+#   @memoize_output(key=lambda year, schools: (year, frozenset(schools)))
+#   def update_page(year, schools):
+#
+# Exceptions (including PreventUpdate) are never cached. The decorator works the same
+# way for functions that return dataframes (e.g. calculate_attendance_metrics).
+#
+# Concurrent identical requests are coalesced: within a worker, threads that miss on a
+# key another thread is already computing wait for its result (see SingleFlight - the
+# same layer is used by load_data.run_query and the dropdown callbacks), and with the
+# disk tier enabled, workers wait on each other the same way (see DiskCache.lock).
+#
+# Configuration (environment):
+#   OUTPUT_CACHE_MAX_ENTRIES      in-process entries per worker (default: 256, 0 disables caching)
+#   OUTPUT_CACHE_MAX_BYTES        in-process size limit per worker (default: 128 MiB)
+#   OUTPUT_CACHE_DIR              directory for the shared disk tier (default: none - disabled)
+#   OUTPUT_CACHE_DISK_MAX_BYTES   disk tier size limit (default: 1 GiB)
+#   OUTPUT_CACHE_LOCK_TIMEOUT     seconds to wait for another worker's result (default: 60)
+
+import copy
+import functools
+import hashlib
+import io
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from plotly.basedatatypes import BaseFigure
+
+output_cache_max_entries = int(os.getenv("OUTPUT_CACHE_MAX_ENTRIES", 256))
+output_cache_max_bytes = int(os.getenv("OUTPUT_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+output_cache_dir = os.getenv("OUTPUT_CACHE_DIR", "")
+output_cache_disk_max_bytes = int(os.getenv("OUTPUT_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024))
+output_cache_lock_timeout = float(os.getenv("OUTPUT_CACHE_LOCK_TIMEOUT", 60))
+
+_output_cache = OrderedDict()
+_output_cache_lock = threading.Lock()
+_output_cache_stats = {
+    "hits": 0, "disk_hits": 0, "misses": 0, "waits": 0, "evictions": 0, "invalidations": 0, "bytes": 0
+}
+_output_cache_version = None
+
+def _canonical(value):
+    # a stable, hashable form of a key - sets are sorted so that the same selection
+    # gives the same key (and the same disk file name) in every worker
+    if isinstance(value, dict):
+        return ("dict", tuple(sorted((str(k), _canonical(v)) for k, v in value.items())))
+    if isinstance(value, (set, frozenset)):
+        return ("set", tuple(sorted((_canonical(v) for v in value), key=repr)))
+    if isinstance(value, (list, tuple)):
+        return tuple(_canonical(v) for v in value)
+    return value
+
+class _OutputPickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        if isinstance(obj, BaseFigure):
+            return (dict, (obj.to_plotly_json(),))
+        return NotImplemented
+
+def dumps_output(result) -> bytes:
+    # pickles a callback output (see the module notes on figures)
+    buffer = io.BytesIO()
+    _OutputPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(result)
+    return buffer.getvalue()
+
+def _check_version(version):
+    # called with the cache lock held
+    global _output_cache_version
+
+    if version != _output_cache_version:
+        if _output_cache:
+            _output_cache_stats["invalidations"] += 1
+        _output_cache.clear()
+        _output_cache_stats["bytes"] = 0
+        _output_cache_version = version
+
+def _store_memory(key, payload: bytes):
+    size = len(payload)
+
+    if size > output_cache_max_bytes:
+        return
+
+    with _output_cache_lock:
+        if key in _output_cache:
+            _output_cache_stats["bytes"] -= len(_output_cache.pop(key))
+
+        _output_cache[key] = payload
+        _output_cache_stats["bytes"] += size
+
+        while len(_output_cache) > output_cache_max_entries or _output_cache_stats["bytes"] > output_cache_max_bytes:
+            _, evicted = _output_cache.popitem(last=False)
+            _output_cache_stats["bytes"] -= len(evicted)
+            _output_cache_stats["evictions"] += 1
+
+class DiskCache:
+    """
+    A byte-limited LRU cache in a local SQLite file that every process on the host can
+    share. Values are bytes (pickles). Each entry carries a version tag and is only
+    returned for the same version. Writes are single transactions, so a reader never
+    sees a partial entry, and the least recently read entries are evicted once the
+    stored values exceed max_bytes.
+
+    lock()/unlock() give stampede protection: the first process to miss on a key takes
+    a lease on it, and the others wait (wait_for) for the value it stores instead of
+    computing it themselves. A lease expires after lock_timeout seconds, so a worker
+    that dies mid-computation does not block the key. Leases are not re-entrant.
+
+    Args:
+        path (str): the cache file
+        max_bytes (int): size limit for the stored values
+        lock_timeout (float, optional): lease length in seconds. Defaults to 60.
+    """
+    def __init__(self, path: str, max_bytes: int, lock_timeout: float = 60):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock_timeout = lock_timeout
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        # one connection per thread (and per process - connections do not survive a fork)
+        db = getattr(self._local, "db", None)
+
+        if db is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("PRAGMA synchronous = NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, version TEXT, "
+                "value BLOB, size INTEGER, accessed REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries (accessed)")
+            db.execute("CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+
+            self._local.db = db
+            self._local.pid = os.getpid()
+
+        return db
+
+    @staticmethod
+    def _owner() -> str:
+        return str(os.getpid()) + "." + str(threading.get_ident())
+
+    def get(self, key: str, version: str):
+        """
+        Returns the stored bytes for key, or None if there is no entry for this version.
+        """
+        db = self._connect()
+        row = db.execute("SELECT version, value FROM entries WHERE key = ?", (key,)).fetchone()
+
+        if row is None or row[0] != version:
+            return None
+
+        db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+
+        return row[1]
+
+    def set(self, key: str, version: str, value: bytes):
+        """
+        Stores value for key (replacing any entry for another version) and evicts the
+        least recently read entries if the cache is over its size limit.
+        """
+        size = len(value)
+
+        if size > self.max_bytes:
+            return
+
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO entries (key, version, value, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, version, value, size, time.time()),
+            )
+
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+            if total > self.max_bytes:
+                for evict_key, evict_size in db.execute(
+                    "SELECT key, size FROM entries WHERE key != ? ORDER BY accessed", (key,)
+                ).fetchall():
+                    db.execute("DELETE FROM entries WHERE key = ?", (evict_key,))
+                    total -= evict_size
+
+                    if total <= self.max_bytes:
+                        break
+
+            db.execute("COMMIT")
+
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def lock(self, key: str) -> bool:
+        """
+        Tries to take the computation lease for key. Returns True if this call took it,
+        False if the lease is already held - by another process or thread, or by an
+        earlier call from this thread.
+        """
+        db = self._connect()
+        now = time.time()
+
+        db.execute("BEGIN IMMEDIATE")
+
+        try:
+            db.execute("DELETE FROM locks WHERE key = ? AND expires < ?", (key, now))
+            inserted = db.execute(
+                "INSERT OR IGNORE INTO locks (key, owner, expires) VALUES (?, ?, ?)",
+                (key, self._owner(), now + self.lock_timeout),
+            ).rowcount
+            db.execute("COMMIT")
+
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+        return inserted == 1
+
+    def unlock(self, key: str):
+        self._connect().execute("DELETE FROM locks WHERE key = ? AND owner = ?", (key, self._owner()))
+
+    def wait_for(self, key: str, version: str, poll: float = 0.05):
+        """
+        Waits while another process holds the lease for key. Returns the value it
+        stored, or None if the lease was released (or expired) without a value.
+        """
+        db = self._connect()
+
+        while True:
+            value = self.get(key, version)
+            if value is not None:
+                return value
+
+            row = db.execute("SELECT expires FROM locks WHERE key = ?", (key,)).fetchone()
+            if row is None or row[0] < time.time():
+                return None
+
+            time.sleep(poll)
+
+    def clear(self):
+        db = self._connect()
+        db.execute("DELETE FROM entries")
+        db.execute("DELETE FROM locks")
+
+    def stats(self) -> dict:
+        row = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": row[0], "bytes": row[1]}
+
+_disk_cache = None
+
+def get_disk_cache():
+    """
+    Returns the shared DiskCache (OUTPUT_CACHE_DIR/output_cache.db), or None if the
+    disk tier is disabled.
+    """
+    global _disk_cache
+
+    if not output_cache_dir:
+        return None
+
+    if _disk_cache is None:
+        _disk_cache = DiskCache(
+            os.path.join(output_cache_dir, "output_cache.db"), output_cache_disk_max_bytes, output_cache_lock_timeout
+        )
+
+    return _disk_cache
+
+def _disk_key(key) -> str:
+    return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+def get_output_cache_stats() -> dict:
+    """
+    Returns a snapshot of the output cache counters (in-process hits, disk hits,
+    misses, waits for another worker, evictions, invalidations), the number of
+    in-process entries, and their size in bytes.
+    """
+    with _output_cache_lock:
+        stats = dict(_output_cache_stats)
+        stats["entries"] = len(_output_cache)
+
+    return stats
+
+def clear_output_cache(disk: bool = False):
+    """
+    Empties the in-process tier and, if disk is True, removes every entry in the
+    disk tier.
+    """
+    with _output_cache_lock:
+        _output_cache.clear()
+        _output_cache_stats["bytes"] = 0
+
+    disk_cache = get_disk_cache()
+
+    if disk and disk_cache:
+        disk_cache.clear()
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key within a process: while one call for
+    a key is in flight, other threads asking for the same key wait for it and get its
+    result (or its exception) instead of running the function again. Nothing is kept
+    once the call finishes - this is not a cache.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {"calls": 0, "executions": 0, "coalesced": 0}
+
+    def do(self, key, func) -> tuple:
+        """
+        Runs func() unless a call for key is already in flight.
+
+        Args:
+            key (hashable): identifies the call
+            func (callable): called with no arguments
+
+        Returns:
+            tuple: (result, shared) - shared is True if the result came from another
+            thread's call (so it is the same object that thread received)
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+
+            if call is not None:
+                self._stats["coalesced"] += 1
+                leader = False
+            else:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self._calls[key] = call
+                self._stats["executions"] += 1
+                leader = True
+
+        if not leader:
+            call["done"].wait()
+
+            if call["error"] is not None:
+                raise call["error"]
+
+            return call["result"], True
+
+        try:
+            call["result"] = func()
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+        return call["result"], False
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+
+        return stats
+
+_single_flights = {}
+_single_flights_lock = threading.Lock()
+
+def get_single_flight(name: str) -> SingleFlight:
+    """
+    Returns the process-wide SingleFlight registered under name (created on first use).
+    """
+    with _single_flights_lock:
+        flight = _single_flights.get(name)
+
+        if flight is None:
+            flight = _single_flights[name] = SingleFlight()
+
+    return flight
+
+def get_single_flight_stats() -> dict:
+    """
+    Returns the counters (calls, executions, coalesced, in_flight) of every
+    registered SingleFlight, by name.
+    """
+    with _single_flights_lock:
+        flights = dict(_single_flights)
+
+    return {name: flight.stats() for name, flight in flights.items()}
+
+def single_flight(key=None, name: str = ""):
+    """
+    Decorator that coalesces concurrent identical calls of a function (e.g. a callback
+    that several users trigger at once) with a SingleFlight. Threads that join a call
+    in flight get a deep copy of its result.
+
+    Args:
+        key (callable, optional): called with the function's arguments, returns the
+            values that identify them. Defaults to all of the arguments as given.
+        name (str, optional): the SingleFlight to use. Defaults to the function's
+            module and name.
+
+    Returns:
+        callable: the decorator
+    """
+    def decorator(func):
+        flight = get_single_flight(name or func.__module__ + "." + func.__qualname__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            inputs = key(*args, **kwargs) if key else (args, kwargs)
+            result, shared = flight.do(_canonical(inputs), lambda: func(*args, **kwargs))
+
+            return copy.deepcopy(result) if shared else result
+
+        return wrapper
+
+    return decorator
+
+def memoize_output(key=None, name: str = ""):
+    """
+    Decorator that caches the return value of a callback (see the module notes).
+
+    Args:
+        key (callable, optional): called with the callback's arguments, returns the
+            values that identify them. Defaults to all of the arguments as given.
+        name (str, optional): namespace for the entries. Defaults to the function's
+            module and name.
+
+    Returns:
+        callable: the decorator
+    """
+    def decorator(func):
+        namespace = name or func.__module__ + "." + func.__qualname__
+        flight = get_single_flight(namespace)
+
+        def load(cache_key, version, args, kwargs) -> tuple:
+            # returns (result, payload) - result is None if the payload came from the disk tier
+            disk_cache = get_disk_cache()
+
+            if disk_cache is None:
+                with _output_cache_lock:
+                    _output_cache_stats["misses"] += 1
+
+                result = func(*args, **kwargs)
+                payload = dumps_output(result)
+                _store_memory(cache_key, payload)
+
+                return result, payload
+
+            disk_key = _disk_key(cache_key)
+            disk_version = str(version)
+
+            payload = disk_cache.get(disk_key, disk_version)
+
+            # another worker may be computing this key - wait for its result
+            while payload is None and not disk_cache.lock(disk_key):
+                with _output_cache_lock:
+                    _output_cache_stats["waits"] += 1
+
+                payload = disk_cache.wait_for(disk_key, disk_version)
+
+            if payload is None:
+                try:
+                    # the lock holder may have stored the value between the get and the lock
+                    payload = disk_cache.get(disk_key, disk_version)
+
+                    if payload is None:
+                        with _output_cache_lock:
+                            _output_cache_stats["misses"] += 1
+
+                        result = func(*args, **kwargs)
+
+                        payload = dumps_output(result)
+                        _store_memory(cache_key, payload)
+                        disk_cache.set(disk_key, disk_version, payload)
+
+                        return result, payload
+
+                finally:
+                    disk_cache.unlock(disk_key)
+
+            with _output_cache_lock:
+                _output_cache_stats["disk_hits"] += 1
+            _store_memory(cache_key, payload)
+
+            return None, payload
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if output_cache_max_entries <= 0:
+                return func(*args, **kwargs)
+
+            inputs = key(*args, **kwargs) if key else (args, kwargs)
+            cache_key = (namespace, _canonical(inputs))
+            # imported here - load_data imports this module (run_query uses SingleFlight)
+            from .load_data import get_database_version
+
+            version = get_database_version()
+
+            with _output_cache_lock:
+                _check_version(version)
+                payload = _output_cache.get(cache_key)
+
+                if payload is not None:
+                    _output_cache.move_to_end(cache_key)
+                    _output_cache_stats["hits"] += 1
+
+            if payload is not None:
+                return pickle.loads(payload)
+
+            # threads in this worker asking for the same key share one load
+            (result, payload), shared = flight.do(
+                (cache_key, version), lambda: load(cache_key, version, args, kwargs)
+            )
+
+            if shared or result is None:
+                return pickle.loads(payload)
+
+            return result
+
+        return wrapper
+
+    return decorator
@@ -9,16 +9,19 @@ import pandas as pd
 import numpy as np
 import itertools
 
-from .load_data import get_demographic_data
+from .load_data import get_demographic_data, get_corporation_demographic_data, run_fetch_plan
 from .process_data import get_attendance_data
-from .calculations import calculate_year_over_year, set_academic_rating, conditional_fillna, calculate_difference, \
-    get_excluded_years
+from .calculations import calculate_differences, add_rating_columns, conditional_fillna, get_excluded_years
+from .cache import memoize_output
+from .instrumentation import instrument
 
+@memoize_output(key=lambda school, year: (str(school), str(year)))
+@instrument("metrics")
 def calculate_attendance_metrics(school: str, year: str) -> pd.DataFrame:
     """
     Gets attendance data (df) for school and school corporation, calculates the
-    year over year difference using calculate_year_over_year than adds a Rating
-    using set_academic_rating
+    difference from the corporation using calculate_differences than adds a Rating
+    using set_academic_ratings
 
     Args:
         school (str): a school ID number
@@ -27,39 +30,33 @@ def calculate_attendance_metrics(school: str, year: str) -> pd.DataFrame:
     Returns:
         pd.DataFrame: a dataframe with School, Diff, & Rate columns for each year
     """
-    selected_school = get_school_index(school)    
-    corp_id = int(selected_school["GEO Corp"].values[0])
+    # the corp data is looked up through the school's GEO Corp in the same query, so
+    # the two fetches are independent
+    demographics = run_fetch_plan({
+        "school": (get_demographic_data, school),
+        "corp": (get_corporation_demographic_data, school),
+    })
 
-    corp_demographics = get_demographic_data(corp_id)
+    corp_attendance_rate = get_attendance_data(demographics["corp"], year)
+    school_attendance_rate = get_attendance_data(demographics["school"], year)
 
-    school_demographics = get_demographic_data(school)
-    corp_attendance_rate = get_attendance_data(corp_demographics, year)
-    school_attendance_rate = get_attendance_data(school_demographics, year)    
+    # corp years aligned with the school years by name - a year missing from the
+    # corp data is compared against NaN
+    years = [c for c in school_attendance_rate.columns if c != "Category"]
 
-    corp_attendance_rate = (corp_attendance_rate.set_index(["Category"]).add_suffix("Corp Avg").reset_index())
-    school_attendance_rate = (school_attendance_rate.set_index(["Category"]).add_suffix("School").reset_index())
-    school_attendance_rate = school_attendance_rate.drop("Category", axis=1)
-    corp_attendance_rate = corp_attendance_rate.drop("Category", axis=1)
+    school_attendance_rate = school_attendance_rate[years].reset_index(drop=True)
+    corp_attendance_rate = corp_attendance_rate.reindex(columns=years).reset_index(drop=True)
 
-    # concat the two df's and reorder so that the columns alternate
-    attendance_metrics = pd.concat([school_attendance_rate, corp_attendance_rate], axis=1)
-    reordered_cols = list(sum(zip(school_attendance_rate.columns, corp_attendance_rate.columns), ()))
+    differences = calculate_differences(school_attendance_rate, corp_attendance_rate)
 
-    attendance_metrics = attendance_metrics[reordered_cols]
+    # YYYYSchool, YYYYCorp Avg, YYYYDiff for each year
+    attendance_columns = {"Category": "1.1.a. Attendance Rate"}
+    for j, year in enumerate(years):
+        attendance_columns[year + "School"] = school_attendance_rate[year]
+        attendance_columns[year + "Corp Avg"] = corp_attendance_rate[year]
+        attendance_columns[year[0:4] + "Diff"] = differences[:, j]
 
-    # loops over dataframe calculating difference between a pair of columns, inserts the result in
-    # the following column, and then skips over the calculated columns to the next pair
-    y = 0
-    z = 2
-    end = int(len(attendance_metrics.columns)/2)
-
-    for x in range(0, end):
-        values = calculate_year_over_year(attendance_metrics.iloc[:, y], attendance_metrics.iloc[:, y + 1])
-        attendance_metrics.insert(loc = z, column = attendance_metrics.columns[y][0:4] + "Diff", value = values)
-        y+=3
-        z+=3
-
-    attendance_metrics.insert(loc=0, column="Category", value="1.1.a. Attendance Rate")
+    attendance_metrics = pd.DataFrame(attendance_columns, index=school_attendance_rate.index)
 
     attendance_limits = [
         0,
@@ -68,47 +65,28 @@ def calculate_attendance_metrics(school: str, year: str) -> pd.DataFrame:
     ]
 
     # NOTE: Calculates and adds an accountability rating ("MS", "DNMS", "N/A", etc)
-    # as a new column to existing dataframe:
-    #   1) the loop ("for i in range(attendance_data_metrics.shape[1], 1, -3)")
-    #   counts backwards by -3, beginning with the index of the last column in
-    #   the dataframe ("attendance_data_metrics.shape[1]") to "1" (actually "2"
-    #   as range does not include the last number). These are indexes, so the
-    #   loop stops at the third column (which has an index of 2);
-    #   2) for each step, the code inserts a new column, at index "i". The column
-    #   header is a string that is equal to "the year (YYYY) part of the column
-    #   string (attendance_data_metrics.columns[i-1])[:7 - 3]) + "Rate" + "i"
-    #   (the value of "i" doesn"t matter other than to differentiate the columns) +
-    #   the accountability value, a string returned by the set_academic_rating() function.
-    #   3) the set_academic_rating() function calculates an "accountability rating"
-    #   ("MS", "DNMS", "N/A", etc) taking as args:
-    #       i) the "value" to be rated. this will be from the "School" column, if
+    # as new columns to the existing dataframe:
+    #   1) add_rating_columns() works backwards by 3, beginning with the index of
+    #   the last column in the dataframe, to index 2 - so a rating column follows
+    #   every "Diff" column. The column header is the year (YYYY) part of the
+    #   rated column + "Rate" + its index (the index doesn"t matter other than to
+    #   differentiate the columns);
+    #   2) the set_academic_ratings() function calculates an "accountability rating"
+    #   ("MS", "DNMS", "N/A", etc) for a whole column, taking as args:
+    #       i) the "values" to be rated. this will be from the "School" column, if
     #       the value itself is rated (e.g., iread performance), or the difference
     #       ("Diff") column, if there is an additional calculation required (e.g.,
     #       year over year or compared to corp);
     #       ii) a list of the threshold "limits" to be used in the calculation; and
     #       iii) an integer "flag" which tells the function which calculation to use.
-    
-    [
-        attendance_metrics.insert(
-            i,
-            str(attendance_metrics.columns[i - 1])[: 7 - 3]
-            + "Rate"
-            + str(i),
-            attendance_metrics.apply(
-                lambda x: set_academic_rating(
-                    x[attendance_metrics.columns[i - 1]], attendance_limits, 3
-                ),
-                axis=1,
-            ),
-        )
-        for i in range(attendance_metrics.shape[1], 1, -3)
-    ]
+    attendance_metrics = add_rating_columns(attendance_metrics, attendance_limits, 3)
 
     # drop corp rates
     attendance_metrics = attendance_metrics.loc[:, ~attendance_metrics.columns.str.contains("Corp")]
     
     return attendance_metrics
 
+@instrument("metrics")
 def calculate_k8_yearly_metrics(data: pd.DataFrame) -> pd.DataFrame:
     """
     Takes a dataframe of school academic data and calculates the proficiency difference
@@ -128,29 +106,25 @@ def calculate_k8_yearly_metrics(data: pd.DataFrame) -> pd.DataFrame:
     category_header = data["Category"]
     data = data.drop("Category", axis=1)
 
-    # temporarily store last column (first year of data chronologically) as
-    # this is not used in first year-over-year calculation
-    first_year = pd.DataFrame()
-    first_year[data.columns[-1]] = data[data.columns[-1]]
-
-    # NOTE: different take on the for-loop- but still almost instantaneous
-    # loops over dataframe calculating difference between col (Year) and col+2 (Previous Year)
-    # and insert the result into the dataframe at every third index position
-    z = 2
-    x = 0
-    num_loops = int((len(data.columns) - 2) / 2)
-  
-    for y in range(0, num_loops):
-        values = calculate_year_over_year(data.iloc[:, x], data.iloc[:, x + 2])
-        data.insert(loc = z, column = data.columns[x][0:4] + "Diff", value = values)
-        z+=3
-        x+=3
-
-    data.insert(loc=0, column="Category", value=category_header)
+    # columns alternate YYYYSchool, YYYYN-Size with the most recent year first. Every
+    # year except the last (first year of data chronologically) is compared with the
+    # year after it (the previous year) in a single pass
+    school_cols = list(data.columns[0::2])
+    nsize_cols = list(data.columns[1::2])
+
+    differences = calculate_differences(data[school_cols[:-1]], data[school_cols[1:]])
+
+    # YYYYSchool, YYYYN-Size, YYYYDiff for each year (no Diff for the first year)
+    yearly_columns = {"Category": category_header}
+    for j, (school_col, nsize_col) in enumerate(zip(school_cols, nsize_cols)):
+        yearly_columns[school_col] = data[school_col]
+        yearly_columns[nsize_col] = data[nsize_col]
+
+        if j < len(school_cols) - 1:
+            yearly_columns[school_col[0:4] + "Diff"] = differences[:, j]
+
+    data = pd.DataFrame(yearly_columns, index=data.index)
     data["Category"] = (data["Category"].str.replace(" Proficient %", "").str.strip())
-    
-    # Add first_year data back
-    data[first_year.columns] = first_year
 
     # Create clean col lists - (YYYY + "School") and (YYYY + "Diff")
     school_years_cols = list(data.columns[1:])
@@ -158,34 +132,12 @@ def calculate_k8_yearly_metrics(data: pd.DataFrame) -> pd.DataFrame:
     # thresholds for academic ratings
     years_limits = [0.05, 0.02, 0, 0]
 
-    # Slightly different formula for this one:
-    #   1) the loop "for i in range(data.shape[1]-2, 1, -3)" counts backwards by -3,
-    #   beginning with 2 minus the index of the last column in the dataframe
-    #   ("data.shape[1]-2") to "1." This ignores the last two columns which will always
-    #   be "first year" data and "first year" n-size. These are indexes, so the
-    #   loop stops at the third column (which has an index of 2);
-    #   e.g., 12 col dataframe - from index 11 to 0 - we want to get rating of 9,6,3
-    #   2) for each step, the code inserts a new column, at index "i". The column
-    #   header is a string that is equal to "the year (YYYY) part of the column
-    #   string (attendance_data_metrics.columns[i-1])[:7 - 3]) + "Rate" + "i"
-    #   (the value of "i" doesn"t matter other than to differentiate the columns) +
-    #   the accountability value, a string returned by the set_academic_rating() function.
-    
-    [
-        data.insert(
-            i,
-            str(data.columns[i - 1])[: 7 - 3]
-            + "Rate"
-            + str(i),
-            data.apply(
-                lambda x: set_academic_rating(
-                    x[data.columns[i - 1]], years_limits, 1
-                ),
-                axis=1,
-            ),
-        )
-        for i in range(data.shape[1]-2, 1, -3)
-    ]
+    # Slightly different formula for this one: the ratings start at 2 minus the index
+    # of the last column in the dataframe ("data.shape[1]-2"). This ignores the last two
+    # columns which will always be "first year" data and "first year" n-size.
+    # e.g., 12 col dataframe - from index 11 to 0 - we want to get rating of 9,6,3
+    # (see calculate_attendance_metrics() for a description)
+    data = add_rating_columns(data, years_limits, 1, end=data.shape[1] - 2)
     data = conditional_fillna(data)
 
     data.columns = data.columns.astype(str)
@@ -221,6 +173,7 @@ def calculate_k8_yearly_metrics(data: pd.DataFrame) -> pd.DataFrame:
     return data
 
 
+@instrument("metrics")
 def calculate_k8_comparison_metrics(school_data: pd.DataFrame, corp_data: pd.DataFrame, year: str) -> pd.DataFrame:
     """
     Take a school and corp dataframe (and year string), calculates the differences between the two for
@@ -274,33 +227,24 @@ def calculate_k8_comparison_metrics(school_data: pd.DataFrame, corp_data: pd.Dat
     merged_cols = list(itertools.chain(*zip(school_cols, corp_cols, nsize_cols)))
     merged_cols.insert(0, "Category")
 
-    merged_data = school_data.merge(corp_data, on="Category", how="left")
-    merged_data = merged_data[merged_cols]
-
-    school_data = school_data.reset_index(drop=True)
+    all_merged_data = school_data.merge(corp_data, on="Category", how="left")
+    merged_data = all_merged_data[merged_cols]
 
-    tmp_category = school_data["Category"]
-    school_data = school_data.drop("Category", axis=1)
-    corp_data = corp_data.drop("Category", axis=1)
+    # school minus corp for every Category and year in a single pass. The merge on
+    # Category aligns the rows (a year missing from the corp data is compared against NaN)
+    differences = calculate_differences(
+        all_merged_data.reindex(columns=[y + "School" for y in year_cols]),
+        all_merged_data.reindex(columns=[y + "Corp" for y in year_cols]),
+        year_over_year=False,
+    )
 
-    k8_result = pd.DataFrame()
-    for c in school_data.columns:
-        c = c[0:4]
-        k8_result[c + "Diff"] = calculate_difference(
-            school_data[c + "School"], corp_data[c + "Corp"]
-        )
+    k8_result = pd.DataFrame(differences, columns=result_cols, index=merged_data.index).infer_objects()
 
     # reorganize headers
     final_cols = list(itertools.chain(*zip(school_cols, nsize_cols, result_cols)))
     final_cols.insert(0, "Category")
 
-    k8_result = k8_result.set_axis(result_cols, axis=1)
-    k8_result.insert(loc=0, column="Category", value=tmp_category)
-
-    # merge and reorder cols
-    final_k8_academic_data = merged_data.merge(k8_result, on="Category", how="left")
-
-    final_k8_academic_data = final_k8_academic_data[final_cols]
+    final_k8_academic_data = pd.concat([merged_data, k8_result], axis=1)[final_cols]
     
     # NOTE: Pretty sure this is redundant as we add "Proficient %; suffix to totals
     # above, then remove it here, then pass to academic_analysis page, and add it
@@ -310,24 +254,13 @@ def calculate_k8_comparison_metrics(school_data: pd.DataFrame, corp_data: pd.Dat
 
     # Add metric ratings. See get_attendance_metrics() for a description
     delta_limits = [0.1, 0.02, 0, 0]  
-    [
-        final_k8_academic_data.insert(
-            i,
-            str(final_k8_academic_data.columns[i - 1])[: 7 - 3] + "Rate" + str(i),
-            final_k8_academic_data.apply(
-                lambda x: set_academic_rating(
-                    x[final_k8_academic_data.columns[i - 1]], delta_limits, 1
-                ),
-                axis=1,
-            ),
-        )
-        for i in range(final_k8_academic_data.shape[1], 1, -3)
-    ]
+    final_k8_academic_data = add_rating_columns(final_k8_academic_data, delta_limits, 1)
 
     final_k8_academic_data = conditional_fillna(final_k8_academic_data)
 
     return final_k8_academic_data
 
+@instrument("metrics")
 def calculate_high_school_metrics(merged_data: pd.DataFrame) -> pd.DataFrame:
     """
     Takes a school dataframe and assigns an academic rating for each category for each year.
@@ -342,45 +275,11 @@ def calculate_high_school_metrics(merged_data: pd.DataFrame) -> pd.DataFrame:
 
     grad_limits_state = [0, 0.05, 0.15, 0.15]
     state_grad_metric = data.loc[data["Category"] == "State Graduation Average"]
-
-    [
-        state_grad_metric.insert(
-            i,
-            str(state_grad_metric.columns[i - 1])[: 7 - 3]
-            + "Rate"
-            + str(i),
-            state_grad_metric.apply(
-                lambda x: set_academic_rating(
-                    x[state_grad_metric.columns[i - 1]],
-                    grad_limits_state,
-                    2,
-                ),
-                axis=1,
-            ),
-        )
-        for i in range(state_grad_metric.shape[1], 1, -3)
-    ]
+    state_grad_metric = add_rating_columns(state_grad_metric, grad_limits_state, 2)
 
     grad_limits_local = [0, 0.05, 0.10, 0.10]
     local_grad_metric = data[data["Category"].isin(["Total Graduation Rate", "Non Waiver Graduation Rate"])]
-
-    [
-        local_grad_metric.insert(
-            i,
-            str(local_grad_metric.columns[i - 1])[: 7 - 3]
-            + "Rate"
-            + str(i),
-            local_grad_metric.apply(
-                lambda x: set_academic_rating(
-                    x[local_grad_metric.columns[i - 1]],
-                    grad_limits_local,
-                    2,
-                ),
-                axis=1,
-            ),
-        )
-        for i in range(local_grad_metric.shape[1], 1, -3)
-    ]
+    local_grad_metric = add_rating_columns(local_grad_metric, grad_limits_local, 2)
 
     # NOTE: Strength of Diploma is not currently displayed
     strength_diploma = data[data["Category"] == "Strength of Diploma"]
@@ -403,6 +302,7 @@ def calculate_high_school_metrics(merged_data: pd.DataFrame) -> pd.DataFrame:
     
     return combined_grad_metrics
 
+@instrument("metrics")
 def calculate_adult_high_school_metrics(school: str, data: pd.DataFrame) -> pd.DataFrame:
     """
     Takes a school dataframe and school ID string and assigns an academic rating
@@ -435,20 +335,9 @@ def calculate_adult_high_school_metrics(school: str, data: pd.DataFrame) -> pd.D
 
         ahs_data = (ahs_data.set_index(["Category"]).add_suffix("School").reset_index())
 
+        # every column is rated (the rating header years are the same as data_columns)
         ccr_limits = [0.5, 0.499, 0.234]
-        [
-            ahs_data.insert(
-                i,
-                str(data_columns[i - 2]) + "Rate" + str(i),
-                ahs_data.apply(
-                    lambda x: set_academic_rating(
-                        x[ahs_data.columns[i - 1]], ccr_limits, 2
-                    ),
-                    axis=1,
-                ),
-            )
-            for i in range(ahs_data.shape[1], 1, -1)
-        ]
+        ahs_data = add_rating_columns(ahs_data, ccr_limits, 2, step=1)
 
         school_letter_grades = get_letter_grades(school)
         school_letter_grades = (school_letter_grades.set_index("Year").T.rename_axis("Category").rename_axis(None, axis=1).reset_index())
@@ -463,22 +352,7 @@ def calculate_adult_high_school_metrics(school: str, data: pd.DataFrame) -> pd.D
         ahs_state_grades = ahs_state_grades.loc[:,ahs_state_grades.columns.str.contains("|".join(data_columns + ["Category"]))]
 
         letter_grade_limits = ["A", "B", "C", "D", "F"]
-
-        [
-            ahs_state_grades.insert(
-                i,
-                str(data_columns[i - 2]) + "Rate" + str(i),
-                ahs_state_grades.apply(
-                    lambda x: set_academic_rating(
-                        x[ahs_state_grades.columns[i - 1]],
-                        letter_grade_limits,
-                        4,
-                    ),
-                    axis=1,
-                ),
-            )
-            for i in range(ahs_state_grades.shape[1], 1, -1)
-        ]
+        ahs_state_grades = add_rating_columns(ahs_state_grades, letter_grade_limits, 4, step=1)
 
         # concatenate and add metric column
         ahs_data = pd.concat([ahs_state_grades, ahs_data])
@@ -491,6 +365,7 @@ def calculate_adult_high_school_metrics(school: str, data: pd.DataFrame) -> pd.D
 
     return ahs_data
 
+@instrument("metrics")
 def calculate_iread_metrics(data: pd.DataFrame) -> pd.DataFrame:
     """
     Takes a school dataframe and an academic rating for iread proficiency
@@ -505,26 +380,14 @@ def calculate_iread_metrics(data: pd.DataFrame) -> pd.DataFrame:
     iread_limits = [0.9, 0.8, 0.7, 0.7] 
 
     data = (data.set_index(["Category"]).add_suffix("School").reset_index())
-
-    [
-        data.insert(
-            i,
-            str(data.columns[i - 1])[: 7 - 3] + "Rate" + str(i),
-            data.apply(
-                lambda x: set_academic_rating(
-                    x[data.columns[i - 1]], iread_limits, 1
-                ),
-                axis=1,
-            ),
-        )
-        for i in range(data.shape[1], 1, -1)
-    ]
+    data = add_rating_columns(data, iread_limits, 1, step=1)
 
     data = conditional_fillna(data)
     data.columns = data.columns.astype(str)
 
     return data
 
+@instrument("metrics")
 def calculate_financial_metrics(data: pd.DataFrame) -> pd.DataFrame:
     """
     Takes a dataframe of float values and returns the same dataframe with one
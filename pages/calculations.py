@@ -5,12 +5,14 @@
 # version:  1.09
 # date:     08/14/23
 
+import threading
 import pandas as pd
 import numpy as np
 from typing import Tuple
 import scipy.spatial as spatial
 
-from .load_data import current_academic_year
+from .load_data import current_academic_year, split_suppressed
+from .instrumentation import instrument
 
 def get_excluded_years(year: str) -> list:
     # "excluded years" is a list of year strings (format YYYY) of all years
@@ -49,68 +51,94 @@ def conditional_fillna(data: pd.DataFrame) -> pd.DataFrame:
     return data
 
 
-def calculate_graduation_rate(data: pd.DataFrame) -> pd.DataFrame:
+def calculate_ratios(data: pd.DataFrame, numerator: str, denominator: str, result: str,
+    exclude: str = "", drop_empty: bool = False) -> pd.DataFrame:
+    """
+    Calculates every "<prefix><result>" ratio column in a dataframe at once. Each column
+    containing the denominator string (e.g. "Grade 3|ELA Total Tested") is paired with
+    its numerator column ("Grade 3|ELA Total Proficient"), and all of the ratios are
+    computed with a single 2-D numpy operation using the same rules as calculate_percentage.
 
-    cohorts = data[data.columns[data.columns.str.contains(r"Cohort Count")]].columns.tolist()
+    If drop_empty is True, a category is dropped (both the numerator and denominator
+    columns, with no ratio column) when the denominator is 0 or NaN for every row, or when
+    it is > 0 but the numerator is NaN for every row (a NaN numerator means the value was
+    a "***" before being converted to numeric).
 
-    for cohort in cohorts:
-        if cohort in data.columns:
-            cat_sub = cohort.split("|Cohort Count")[0]
-            data[cat_sub + " Graduation Rate"] = calculate_percentage(data[cat_sub + "|Graduates"], data[cohort])
+    Args:
+        data (pd.DataFrame): academic data
+        numerator (str): numerator column suffix (e.g. " Total Proficient")
+        denominator (str): denominator column suffix (e.g. " Total Tested")
+        result (str): ratio column suffix (e.g. " Proficient %")
+        exclude (str, optional): skip denominator columns containing this string. Defaults to "".
+        drop_empty (bool, optional): apply the drop rules. Defaults to False.
 
-    return data
+    Returns:
+        pd.DataFrame: a new dataframe with the ratio columns added (data is not changed)
+    """
+    denominators = [c for c in data.columns if denominator in c and not (exclude and exclude in c)]
 
-# def calculate_strength_of_diploma(data: pd.DataFrame) -> pd.DataFrame:
-#     data["Strength of Diploma"] = pd.to_numeric((data["Non Waiver|Cohort Count"] * 1.08)) \
-#          / pd.to_numeric(data["Total|Cohort Count"])
+    if not denominators:
+        return data
 
-#     return data
+    prefixes = [c.split(denominator)[0] for c in denominators]
+    numerators = [p + numerator for p in prefixes]
+    results = [p + result for p in prefixes]
 
-def calculate_sat_rate(data: pd.DataFrame) -> pd.DataFrame:
+    num_values, num_suppressed = split_suppressed(data[numerators], ["***"])
+    den_values, den_suppressed = split_suppressed(data[denominators], ["***"])
+
+    num = num_values.to_numpy()
+    den = den_values.to_numpy()
+
+    if drop_empty:
+        tested = np.nansum(den, axis=0)
+        drop = (tested == 0) | data[denominators].isna().all().to_numpy() | \
+            ((tested > 0) & data[numerators].isna().all().to_numpy())
+    else:
+        drop = np.zeros(len(denominators), dtype=bool)
+
+    keep = ~drop
 
-    tested = data[data.columns[data.columns.str.contains(r"Total Tested")]].columns.tolist()
+    ratios = _percentage(num[:, keep], num_suppressed.to_numpy()[:, keep], den[:, keep], den_suppressed.to_numpy()[:, keep])
 
-    for test in tested:
-        if test in data.columns:
-            
-            # get Category + Subject string
-            cat_sub = test.split(" Total Tested")[0]
-            data[cat_sub + " Benchmark %"] = calculate_percentage(data[cat_sub + " At Benchmark"], data[test])
+    if drop.any():
+        dropped = [c for c, d in zip(denominators, drop) if d] + [c for c, d in zip(numerators, drop) if d]
+        data = data.drop(dropped, axis=1)
+
+    results = [r for r, k in zip(results, keep) if k]
+    if results:
+        # one concat - assigning a list of new columns inserts them one at a time,
+        # which fragments the frame
+        data = pd.concat([data.drop(columns=[r for r in results if r in data.columns]),
+            pd.DataFrame(ratios, index=data.index, columns=results)], axis=1)
 
     return data
 
-# TODO: This is slow. Refactor
-def calculate_proficiency(data: pd.DataFrame) -> pd.DataFrame:
+def calculate_graduation_rate(data: pd.DataFrame) -> pd.DataFrame:
 
-# Calculates proficiency. If Total Tested == 0 or NaN or if Total Tested > 0, but Total Proficient is
-# NaN, all associated columns are dropped
+    return calculate_ratios(data, "|Graduates", "|Cohort Count", " Graduation Rate")
+
+# def calculate_strength_of_diploma(data: pd.DataFrame) -> pd.DataFrame:
+#     data["Strength of Diploma"] = pd.to_numeric((data["Non Waiver|Cohort Count"] * 1.08)) \
+#          / pd.to_numeric(data["Total|Cohort Count"])
 
-    # Get a list of all "Total Tested" columns except those for ELA & Math
-    tested_categories = data[data.columns[data.columns.str.contains(r"Total Tested")]].columns.tolist()
-    tested_categories = [i for i in tested_categories if "ELA and Math" not in i]
+#     return data
 
-    for total_tested in tested_categories:
-        if total_tested in data.columns:
-            
-            cat_sub = total_tested.split(" Total Tested")[0]
-            total_proficient = cat_sub + " Total Proficient"
-            proficiency = cat_sub + " Proficient %"
+def calculate_sat_rate(data: pd.DataFrame) -> pd.DataFrame:
 
-            # drop the entire category if ("Total Tested" == 0 or NaN) or if 
-            # ("Total Tested" > 0 and "Total Proficient" is NaN. A "Total Proficient"
-            # value of NaN means it was a "***" before being converted to numeric
-            # we use sum/all because there could be one or many columns
+    return calculate_ratios(data, " At Benchmark", " Total Tested", " Benchmark %")
 
-            if (pd.to_numeric(data[total_tested], errors="coerce").sum() == 0 or pd.isna(data[total_tested]).all()) | \
-                (pd.to_numeric(data[total_tested], errors="coerce").sum() > 0 and pd.isna(data[total_proficient]).all()):
+@instrument("calc")
+def calculate_proficiency(data: pd.DataFrame) -> pd.DataFrame:
 
-                data = data.drop([total_tested, total_proficient], axis=1)
-            else:
-                data[proficiency] = calculate_percentage(data[total_proficient], data[total_tested])
+# Calculates proficiency. If Total Tested == 0 or NaN or if Total Tested > 0, but Total Proficient is
+# NaN, all associated columns are dropped (ELA and Math is not a proficiency category)
 
-    return data
+    return calculate_ratios(data, " Total Proficient", " Total Tested", " Proficient %",
+        exclude="ELA and Math", drop_empty=True)
 
 
+@instrument("calc")
 def recalculate_total_proficiency(corp_data: pd.DataFrame, school_data: pd.DataFrame) -> pd.DataFrame:
     """
     In order for an apples to apples comparison between aggregated school corporation academic
@@ -146,6 +174,56 @@ def recalculate_total_proficiency(corp_data: pd.DataFrame, school_data: pd.DataF
 
     return corp_data
 
+def _split_values(data: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    # float64 values and a "***" mask, converted once (see load_data.split_suppressed).
+    # only "***" counts as suppressed here - "^" is replaced with "***" before the
+    # calculations run, and any other string is treated as missing
+    values, mask = split_suppressed(data, ["***"])
+
+    return values.to_numpy(), mask.to_numpy(dtype=bool)
+
+def _integer_difference(value1: pd.Series, value2: pd.Series) -> np.ndarray|None:
+    # two all-integer series subtract to integers (nothing can be missing or
+    # suppressed), which is what the tables expect - the float64 path would
+    # return e.g. 0.0 instead of 0
+    if pd.api.types.infer_dtype(value1, skipna=False) == "integer" and \
+        pd.api.types.infer_dtype(value2, skipna=False) == "integer":
+        return (np.asarray(value1, dtype=np.int64) - np.asarray(value2, dtype=np.int64)).astype(object)
+
+    return None
+
+def _difference(first: np.ndarray, first_suppressed: np.ndarray, second: np.ndarray, second_suppressed: np.ndarray) -> np.ndarray:
+    # calculate_difference rules on float64 arrays (any shape) - see calculate_difference
+    result = (first - second).astype(object)
+
+    result[np.isnan(first)] = None
+    result[first_suppressed | second_suppressed] = "***"
+
+    return result
+
+def _year_over_year(current: np.ndarray, current_suppressed: np.ndarray, previous: np.ndarray,
+    previous_suppressed: np.ndarray, previous_missing: np.ndarray) -> np.ndarray:
+    # calculate_year_over_year rules on float64 arrays (any shape) - previous_missing
+    # is True where the previous value is None/NaN (not just non-numeric)
+    result = (current - previous).astype(object)
+
+    # the order matters - later assignments take precedence
+    result[np.isnan(previous)] = None
+    result[current_suppressed | previous_suppressed] = "***"
+    result[(current == 0) & (previous_missing | previous_suppressed)] = "-***"
+
+    return result
+
+def _percentage(num: np.ndarray, num_suppressed: np.ndarray, den: np.ndarray, den_suppressed: np.ndarray) -> np.ndarray:
+    # calculate_percentage rules on float64 arrays (any shape) - see calculate_percentage
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = np.where(np.isnan(num), 0.0, num / den).astype(object)
+
+    result[np.isnan(num) & np.isnan(den)] = None
+    result[num_suppressed | den_suppressed] = "***"
+
+    return result
+
 def calculate_percentage(numerator: str, denominator: str) -> np.ndarray: #[float|None|str]:
     """Incompatible return value type (got "ndarray[Any, dtype[Any]]
     Calculates a percentage given a numerator and a denominator, while accounting for two
@@ -162,19 +240,10 @@ def calculate_percentage(numerator: str, denominator: str) -> np.ndarray: #[floa
     Returns:
         float|None|str: see conditions
     """
-    return np.where(
-        (numerator == "***") | (denominator == "***"),
-        "***",
-        np.where(
-            pd.to_numeric(numerator, errors="coerce").isna() & pd.to_numeric(denominator, errors="coerce").isna(),
-            None,
-            np.where(
-                pd.to_numeric(numerator, errors="coerce").isna(),
-                0,
-                pd.to_numeric(numerator, errors="coerce") / pd.to_numeric(denominator, errors="coerce"),
-            ),
-        ),
-    )
+    num, num_suppressed = _split_values(numerator)
+    den, den_suppressed = _split_values(denominator)
+
+    return _percentage(num, num_suppressed, den, den_suppressed)
 
 def calculate_difference(value1: str, value2: str) -> np.ndarray:
     """
@@ -188,16 +257,14 @@ def calculate_difference(value1: str, value2: str) -> np.ndarray:
     Returns:
         float|None|str: see conditions
     """
+    result = _integer_difference(value1, value2)
+    if result is not None:
+        return result
 
-    return np.where(
-        (value1 == "***") | (value2 == "***"),
-        "***",
-        np.where(
-            pd.to_numeric(value1, errors="coerce").isna(),
-            None,
-            pd.to_numeric(value1, errors="coerce") - pd.to_numeric(value2, errors="coerce"),
-        ),
-    )
+    first, first_suppressed = _split_values(value1)
+    second, second_suppressed = _split_values(value2)
+
+    return _difference(first, first_suppressed, second, second_suppressed)
 
 def calculate_year_over_year(current_year: pd.Series, previous_year: pd.Series) -> np.ndarray:
     """
@@ -222,19 +289,66 @@ def calculate_year_over_year(current_year: pd.Series, previous_year: pd.Series)
         np.ndarray: Either the difference between the current and previous year values, None, 
         or a string ('***')
     """
-    return np.where(
-        (current_year == 0) & ((previous_year.isna()) | (previous_year == "***")), "-***",
-        np.where(
-            (current_year == "***") | (previous_year == "***"), "***",
-            np.where(
-                (pd.to_numeric(current_year, errors="coerce").isna()) & (pd.to_numeric(previous_year, errors="coerce").isna()), None,
-                np.where(
-                    (~pd.to_numeric(current_year, errors="coerce").isna()) & (pd.to_numeric(previous_year, errors="coerce").isna()), None,              
-                    pd.to_numeric(current_year, errors="coerce") - pd.to_numeric(previous_year, errors="coerce"),
-                ),
-            ),
-        ),
-    )
+    result = _integer_difference(current_year, previous_year)
+    if result is not None:
+        return result
+
+    current, current_suppressed = _split_values(current_year)
+    previous, previous_suppressed = _split_values(previous_year)
+
+    return _year_over_year(current, current_suppressed, previous, previous_suppressed, pd.isna(previous_year).to_numpy())
+
+@instrument("calc")
+def calculate_differences(data: pd.DataFrame, comparison: pd.DataFrame, year_over_year: bool = True) -> np.ndarray:
+    """
+    Whole-frame version of calculate_year_over_year() (or calculate_difference() if
+    year_over_year is False). data and comparison are 2-D blocks aligned by position -
+    e.g. a school's years and the same years for the corporation, or a school's years
+    and its previous years - and every difference is calculated in a single pass with
+    the same "***", "-***", and None rules as the column functions.
+
+    Args:
+        data (pd.DataFrame): the values (e.g. current year or school)
+        comparison (pd.DataFrame): the values to subtract (e.g. previous year or corp),
+            with the same shape as data
+        year_over_year (bool, optional): use the calculate_year_over_year() rules.
+            Defaults to True.
+
+    Returns:
+        np.ndarray: a 2-D object array of differences with the same shape as data
+    """
+    if data.shape != comparison.shape:
+        raise ValueError("Cannot compare blocks of shape " + str(data.shape) + " and " + str(comparison.shape))
+
+    if data.shape[1] == 0:
+        return np.empty(data.shape, dtype=object)
+
+    # positional alignment - drop the labels
+    data = data.set_axis(range(data.shape[1]), axis=1).reset_index(drop=True)
+    comparison = comparison.set_axis(range(comparison.shape[1]), axis=1).reset_index(drop=True)
+
+    values, suppressed = split_suppressed(data, ["***"])
+    compare_values, compare_suppressed = split_suppressed(comparison, ["***"])
+
+    if year_over_year:
+        result = _year_over_year(
+            values.to_numpy(), suppressed.to_numpy(dtype=bool),
+            compare_values.to_numpy(), compare_suppressed.to_numpy(dtype=bool),
+            pd.isna(comparison).to_numpy(),
+        )
+    else:
+        result = _difference(
+            values.to_numpy(), suppressed.to_numpy(dtype=bool),
+            compare_values.to_numpy(), compare_suppressed.to_numpy(dtype=bool),
+        )
+
+    # integer columns stay integer (see _integer_difference)
+    for j in range(data.shape[1]):
+        integers = _integer_difference(data[j], comparison[j])
+        if integers is not None:
+            result[:, j] = integers
+
+    return result
 
 def set_academic_rating(data: str|float|None, threshold: list, flag: int) -> str:
     """
@@ -320,6 +434,117 @@ def set_academic_rating(data: str|float|None, threshold: list, flag: int) -> str
 
     return indicator
 
+def set_academic_ratings(values, threshold: list, flag: int) -> np.ndarray:
+    """
+    Vectorized version of set_academic_rating() - rates a whole series/array of values at
+    once, with the same rules (and in the same order): "***" and "No Grade" -> "NA",
+    "-***" -> "DNMS", None -> "NA", then the letter grade (flag 4) or numeric (flags 1-3)
+    thresholds, with NaN -> "NA" for the numeric flags. As with set_academic_rating(),
+    any other string raises a ValueError for the numeric flags.
+
+    Args:
+        values (pd.Series|np.ndarray|list): the values to rate
+        threshold (list): a list of floats (flags 1-3) or letter grades (flag 4)
+        flag (int): a integer
+
+    Returns:
+        np.ndarray: an object array of ratings with the same shape as values
+    """
+    values = np.array(values, dtype=object)
+
+    if flag not in [1, 2, 3, 4]:
+        raise ValueError("Unknown rating flag: " + str(flag))
+
+    no_rating = (values == "***") | (values == "No Grade")
+    negative = values == "-***"
+    missing = np.array([v is None for v in values.ravel()], dtype=bool).reshape(values.shape)
+
+    conditions = [no_rating, negative, missing]
+    choices = ["NA", "DNMS", "NA"]
+
+    # letter_grade ratings (type string)
+    if flag == 4:
+        conditions += [values == threshold[0], values == threshold[1], values == threshold[2]]
+        choices += ["ES", "MS", "AS"]
+
+        return np.select(conditions, choices, default="DNMS").astype(object)
+
+    # numeric checks - everything not already rated is converted with float()
+    # (which raises on any other string, like set_academic_rating)
+    rated = no_rating | negative | missing
+    data = np.full(values.shape, np.nan)
+    data[~rated] = values[~rated].astype(float)
+
+    conditions.append(np.isnan(data))
+    choices.append("NA")
+
+    with np.errstate(invalid="ignore"):
+
+        # academic ratings (numeric) - the thresholds used leave no gap between AS and
+        # DNMS, so anything below AS is DNMS
+        if flag == 1:
+            conditions += [data >= threshold[0], data > threshold[1], data >= threshold[2]]
+            choices += ["ES", "MS", "AS"]
+
+        # graduation rate ratings (numeric)
+        elif flag == 2:
+            conditions += [
+                data >= threshold[0],
+                (data < threshold[0]) & (data >= threshold[1]),
+                (data < threshold[1]) & (data >= threshold[2]),
+            ]
+            choices += ["ES", "MS", "AS"]
+
+        # attendance rate ratings (numeric)
+        elif flag == 3:
+            conditions += [data > threshold[0], (data < threshold[0]) & (data >= threshold[1])]
+            choices += ["ES", "MS"]
+
+        ratings = np.select(conditions, choices, default="DNMS")
+
+    return ratings.astype(object)
+
+@instrument("calc")
+def add_rating_columns(data: pd.DataFrame, threshold: list, flag: int, step: int = 3, end: int = None) -> pd.DataFrame:
+    """
+    Adds an accountability rating column after every [step]th column, working back
+    from the column before index [end] (the last column by default) to the column at
+    index 1. Each rating column rates the column before it (see set_academic_ratings)
+    and is named YYYY + "Rate" + its index, e.g. "2022Rate4" - the same columns the
+    metric builders used to add one at a time with DataFrame.insert(), but built in
+    a single concat.
+
+    Args:
+        data (pd.DataFrame): metric data - columns after "Category" start with the year
+        threshold (list): rating thresholds
+        flag (int): rating flag
+        step (int, optional): distance between rated columns. Defaults to 3.
+        end (int, optional): index of the first rating column. Defaults to the number of columns.
+
+    Returns:
+        pd.DataFrame: a new dataframe with the rating columns added
+    """
+    end = data.shape[1] if end is None else end
+    positions = sorted(range(end, 1, -step))
+
+    if not positions:
+        return data
+
+    ratings = pd.DataFrame(
+        {str(data.columns[i - 1])[: 7 - 3] + "Rate" + str(i): set_academic_ratings(data.iloc[:, i - 1], threshold, flag) for i in positions},
+        index=data.index,
+    )
+
+    # original columns in order, with rating column k following column positions[k] - 1
+    order = []
+    rating_positions = {i - 1: data.shape[1] + k for k, i in enumerate(positions)}
+    for j in range(data.shape[1]):
+        order.append(j)
+        if j in rating_positions:
+            order.append(rating_positions[j])
+
+    return pd.concat([data, ratings], axis=1).iloc[:, order]
+
 def round_nearest(data: pd.DataFrame, step: int) -> int:
     """
     Determine a tick value for a plotly chart based on the maximum value in a
@@ -508,6 +733,7 @@ def check_for_insufficient_n_size(data: pd.DataFrame) -> str:
 
     return df_string
 
+@instrument("calc")
 def find_nearest(school_idx: pd.Index, data: pd.DataFrame) -> Tuple[np.ndarray,np.ndarray]:
     """
     Based on https://stackoverflow.com/q/43020919/190597
@@ -516,6 +742,10 @@ def find_nearest(school_idx: pd.Index, data: pd.DataFrame) -> Tuple[np.ndarray,n
     https://kanoki.org/2020/08/05/find-nearest-neighbor-using-kd-tree/
 
     Used to find the [20] nearest schools to the selected school.
+
+    NOTE: This rebuilds the tree on every call. The dashboard reads precomputed lists
+    with load_data.get_nearest_schools() (built by db_maintenance with SchoolSpatialIndex,
+    which applies the grade span/school type filters inside the search).
  
     Takes a dataframe of schools and their Lat and Lon coordinates and the index of the
     selected school within that list. Calculates the distances of all schools in the
@@ -537,7 +767,7 @@ def find_nearest(school_idx: pd.Index, data: pd.DataFrame) -> Tuple[np.ndarray,n
     num_hits = 26
 
     # the radius of earth in miles. For kilometers use 6372.8 km
-    R = 3959.87433 
+    R = earth_radius
 
     # as the selected school already exists in the 'data' df,
     # just pass in index and use that to find it
@@ -556,4 +786,216 @@ def find_nearest(school_idx: pd.Index, data: pd.DataFrame) -> Tuple[np.ndarray,n
     # match the [num_hits] number of 'nearest neighbor' schools
     distance, index = tree.query(data.iloc[school_idx][['x', 'y','z']], k = num_hits)
 
-    return index, distance
\ No newline at end of file
+    return index, distance
+
+# the radius of earth in miles. For kilometers use 6372.8 km
+earth_radius = 3959.87433
+
+def get_grade_level(grade) -> float:
+    # "PK" -> -1, "KG" (or "K") -> 0, "1" to "12" -> 1 to 12, anything else -> NaN
+    grade = str(grade).strip().upper()
+
+    if grade in ["PK", "PRE-K"]:
+        return -1.0
+
+    if grade in ["K", "KG"]:
+        return 0.0
+
+    try:
+        return float(grade)
+    except ValueError:
+        return np.nan
+
+class SchoolSpatialIndex:
+    """
+    Nearest neighbor index for one year of schools (see db_maintenance). Coordinates
+    are converted to 3-D Cartesian points once, and a scipy KDTree is built for every
+    distinct set of search predicates the first time it is used. Each tree only holds the
+    schools that satisfy its predicates, so the search itself never returns a school that
+    would have to be filtered out afterwards (no oversampling). Distances are great
+    circle distances in miles.
+
+    Predicates:
+        grade_span: None (any school), "overlap" (schools whose grade span overlaps the
+            selected school's span), or a (low grade, high grade) tuple, e.g. ("KG", "8")
+        school_type: None (any school), a School Type string, or a list of them
+    """
+
+    def __init__(self, data: pd.DataFrame, school_types: pd.DataFrame = None):
+        """
+        Args:
+            data (pd.DataFrame): get_school_coordinates() data (Lat, Lon, School ID,
+                Low Grade, High Grade)
+            school_types (pd.DataFrame, optional): get_school_types() data (School ID,
+                School Type). Required for school_type predicates.
+        """
+        school_ids = pd.to_numeric(data["School ID"], errors="coerce").to_numpy(dtype=float)
+        lat = pd.to_numeric(data["Lat"], errors="coerce").to_numpy(dtype=float)
+        lon = pd.to_numeric(data["Lon"], errors="coerce").to_numpy(dtype=float)
+
+        # schools without coordinates cannot be located
+        located = ~(np.isnan(school_ids) | np.isnan(lat) | np.isnan(lon))
+
+        self.school_ids = school_ids[located].astype(np.int64)
+        self.low_grades = np.array([get_grade_level(g) for g in data["Low Grade"]], dtype=float)[located]
+        self.high_grades = np.array([get_grade_level(g) for g in data["High Grade"]], dtype=float)[located]
+
+        if school_types is not None:
+            types = dict(zip(pd.to_numeric(school_types["School ID"], errors="coerce"), school_types["School Type"]))
+            self.school_types = np.array([types.get(i) for i in self.school_ids], dtype=object)
+        else:
+            self.school_types = None
+
+        phi = np.deg2rad(lat[located])
+        theta = np.deg2rad(lon[located])
+        self.points = np.column_stack([
+            earth_radius * np.cos(phi) * np.cos(theta),
+            earth_radius * np.cos(phi) * np.sin(theta),
+            earth_radius * np.sin(phi),
+        ])
+
+        self.positions = {school_id: i for i, school_id in enumerate(self.school_ids)}
+
+        self._trees = {}
+        self._trees_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.school_ids)
+
+    def _predicate(self, position: int, grade_span, school_type) -> tuple:
+        # the cache key of the subtree for a school - (low, high, types)
+        if grade_span is None:
+            low = high = None
+        elif isinstance(grade_span, str) and grade_span == "overlap":
+            low, high = self.low_grades[position], self.high_grades[position]
+        else:
+            low, high = get_grade_level(grade_span[0]), get_grade_level(grade_span[1])
+
+        if school_type is None:
+            types = None
+        else:
+            if self.school_types is None:
+                raise ValueError("School type predicates need the school_types data")
+            types = (school_type,) if isinstance(school_type, str) else tuple(sorted(school_type))
+
+        return (low, high, types)
+
+    def _subtree(self, key: tuple) -> tuple:
+        with self._trees_lock:
+            subtree = self._trees.get(key)
+
+            if subtree is None:
+                low, high, types = key
+                mask = np.ones(len(self.school_ids), dtype=bool)
+
+                if low is not None:
+                    # NaN (unknown) grade spans never match
+                    mask &= (self.low_grades <= high) & (self.high_grades >= low)
+
+                if types is not None:
+                    mask &= np.isin(self.school_types, types)
+
+                positions = np.flatnonzero(mask)
+                tree = spatial.KDTree(self.points[positions]) if len(positions) else None
+                subtree = (tree, positions)
+                self._trees[key] = subtree
+
+        return subtree
+
+    def _search(self, key: tuple, query_positions: np.ndarray, k: int) -> tuple:
+        # k nearest schools (other than the school itself) to each query school as two
+        # (len(query_positions), k) arrays - the index positions (-1 if there are fewer
+        # than k matching schools) and the distances in miles (NaN if missing)
+        tree, positions = self._subtree(key)
+
+        found = np.full((len(query_positions), k), -1, dtype=np.int64)
+        miles = np.full((len(query_positions), k), np.nan)
+
+        if tree is None or k < 1:
+            return found, miles
+
+        # ask for one extra in case the school is in its own tree
+        hits = min(k + 1, len(positions))
+        chord, idx = tree.query(self.points[query_positions], k=hits)
+        chord = chord.reshape(len(query_positions), hits)
+        idx = idx.reshape(len(query_positions), hits)
+
+        neighbors = positions[idx]
+        keep = neighbors != query_positions[:, None]
+
+        for row in range(len(query_positions)):
+            row_neighbors = neighbors[row][keep[row]][:k]
+            found[row, :len(row_neighbors)] = row_neighbors
+            miles[row, :len(row_neighbors)] = chord[row][keep[row]][:k]
+
+        # convert the straight line (chord) distance through the earth to the great
+        # circle distance along its surface
+        miles = 2 * earth_radius * np.arcsin(np.clip(miles / (2 * earth_radius), 0, 1))
+
+        return found, miles
+
+    def query(self, school_id: int, k: int = 20, grade_span = None, school_type = None) -> pd.DataFrame:
+        """
+        Finds the k nearest schools to a school that satisfy the predicates.
+
+        Args:
+            school_id (int): the selected school
+            k (int, optional): number of schools to return. Defaults to 20.
+            grade_span (optional): grade span predicate (see class). Defaults to None.
+            school_type (optional): school type predicate (see class). Defaults to None.
+
+        Returns:
+            pd.DataFrame: School ID and Distance (miles) columns, nearest first - fewer
+            than k rows if there are not enough matching schools, and empty if the
+            selected school is not in the index
+        """
+        position = self.positions.get(int(school_id))
+
+        if position is None:
+            return pd.DataFrame({"School ID": pd.Series(dtype=np.int64), "Distance": pd.Series(dtype=float)})
+
+        key = self._predicate(position, grade_span, school_type)
+        found, miles = self._search(key, np.array([position]), k)
+
+        valid = found[0] >= 0
+
+        return pd.DataFrame({"School ID": self.school_ids[found[0][valid]], "Distance": miles[0][valid]})
+
+    def query_all(self, k: int = 20, grade_span = None, school_type = None) -> pd.DataFrame:
+        """
+        Batch version of query() - the k nearest schools for every school in the
+        index. Schools that share a subtree are searched with a single KDTree query.
+
+        Args:
+            k (int, optional): number of schools per school. Defaults to 20.
+            grade_span (optional): grade span predicate (see class). Defaults to None.
+            school_type (optional): school type predicate (see class). Defaults to None.
+
+        Returns:
+            pd.DataFrame: School ID, Rank (1 = nearest), Comparable School ID, and
+            Distance (miles) columns, ordered by School ID and Rank
+        """
+        groups = {}
+        for position in range(len(self.school_ids)):
+            key = self._predicate(position, grade_span, school_type)
+            groups.setdefault(key, []).append(position)
+
+        results = []
+        for key, group in groups.items():
+            query_positions = np.array(group)
+            found, miles = self._search(key, query_positions, k)
+
+            valid = found >= 0
+            rows, ranks = np.nonzero(valid)
+
+            results.append(pd.DataFrame({
+                "School ID": self.school_ids[query_positions[rows]],
+                "Rank": ranks + 1,
+                "Comparable School ID": self.school_ids[found[valid]],
+                "Distance": miles[valid],
+            }))
+
+        if not results:
+            return pd.DataFrame(columns=["School ID", "Rank", "Comparable School ID", "Distance"])
+
+        return pd.concat(results, ignore_index=True).sort_values(["School ID", "Rank"]).reset_index(drop=True)
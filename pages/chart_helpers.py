@@ -13,7 +13,7 @@ from plotly.subplots import make_subplots
 from dash import html, dcc
 from .calculations import check_for_insufficient_n_size, check_for_no_data
 from .string_helpers import customwrap
-import time
+from .instrumentation import instrument
 
 # Colors
 # https://codepen.io/ctf0/pen/BwLezW
@@ -153,6 +153,7 @@ def no_data_fig_label(label: str = 'No Data to Display', height: int = 400) -> l
 
     return fig_layout
 
+@instrument("chart")
 def make_stacked_bar(values: pd.DataFrame, label: str) -> list:
     """
     Create a layout with a 100% stacked bar chart showing proficiency percentages for
@@ -166,8 +167,6 @@ def make_stacked_bar(values: pd.DataFrame, label: str) -> list:
         list: a plotly dash html layout in the form of a list containing a string and a stacked bar chart figure (px.bar)
     """
 
-    t12 = time.process_time()
-
     data = values.copy()
     stacked_color = ['#df8f2d', '#ebbb81', '#96b8db', '#74a2d7']
     
@@ -257,9 +256,9 @@ def make_stacked_bar(values: pd.DataFrame, label: str) -> list:
         )
     ]
 
-    print(f'Time to process stacked bar chart: ' + str(time.process_time() - t12))    
     return fig_layout
 
+@instrument("chart")
 def make_line_chart(values: pd.DataFrame, label: str) -> list:
     """
     Creates a dash html.Div layout with a label, a basic line (scatter) plot (px.line), and a
@@ -274,8 +273,6 @@ def make_line_chart(values: pd.DataFrame, label: str) -> list:
         and another string(s) if certain conditions are met.
     """
 
-    t9 = time.process_time()
-    
     data = values.copy()
 
     data.columns = data.columns.str.split('|').str[0]
@@ -560,10 +557,9 @@ def make_line_chart(values: pd.DataFrame, label: str) -> list:
                     )
             ]
 
-    print(f'Processing line chart: ' + str(time.process_time() - t9))
-    
     return fig_layout
 
+@instrument("chart")
 def make_growth_chart(data_me: pd.DataFrame, data_162: pd.DataFrame, label: str) -> list:
     """
     Creates a dash html.Div layout with a label, and a multi-line (scatter) plot (px.line) representing
@@ -715,6 +711,7 @@ def make_growth_chart(data_me: pd.DataFrame, data_162: pd.DataFrame, label: str)
 
     return fig_layout
 
+@instrument("chart")
 def make_bar_chart(values: pd.DataFrame, category: str, label: str) -> list:
     """
     Creates a dash html.Div layout with a label and a simple bar chart (px.bar)
@@ -812,6 +809,7 @@ def make_bar_chart(values: pd.DataFrame, category: str, label: str) -> list:
 
     return fig_layout
 
+@instrument("chart")
 def make_group_bar_chart(values: pd.DataFrame, label: str) -> list:
     """
     Creates a layout containing a label and a grouped bar chart (px.bar)
@@ -0,0 +1,286 @@
+#########################################
+# ICSB Dashboard - Database Maintenance #
+#########################################
+# author:   jbetley
+# version:  1.09
+# date:     08/14/23
+
+# Usage (from the project root):
+#   python -m pages.db_maintenance indexes     - create the indexes used by load_data and run ANALYZE
+#   python -m pages.db_maintenance check       - EXPLAIN QUERY PLAN every load_data query and exit
+#                                                with an error if any of them falls back to a full
+#                                                table scan
+#   python -m pages.db_maintenance comparable  - (re)build the comparable_schools table. Run this
+#                                                whenever a new year of data is loaded
+
+import argparse
+import sqlite3
+import sys
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from . import load_data
+from .load_data import db_path, engine, capture_queries, current_academic_year, get_display_column_name
+from .calculations import SchoolSpatialIndex
+
+# (table, indexed columns) - column names are the raw SQLite names. The covering
+# indexes let the dropdown (get_school_corporation_list, get_public_school_list) and
+# state average (get_graduation_data) queries be answered from the index alone.
+indexes = [
+    ("academic_data_k8", ["Year", "SchoolID"]),
+    ("academic_data_k8", ["CorporationID", "SchoolName", "SchoolID"]),
+    ("corporation_data_k8", ["CorporationID", "Year"]),
+    ("corporation_data_k8", ["Year", "CorporationName", "CorporationID"]),
+    ("academic_data_hs", ["SchoolID"]),
+    ("academic_data_hs", ["Year", "SchoolType", "Total|Graduates", "Total|CohortCount"]),
+    ("corporation_data_hs", ["CorporationID"]),
+    ("demographic_data", ["SchoolID"]),
+    ("growth", ["MajorityEnrolledSchoolID"]),
+    ("school_index", ["SchoolID", "GEOCorp"]),
+    ("school_index", ["SchoolID", "SchoolType"]),
+    ("comparable_schools", ["SchoolID", "Year", "Rank"]),
+]
+
+# the number of comparable schools stored for each school and year
+comparable_schools_count = 20
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+def index_name(table: str, columns: list) -> str:
+    cols = "_".join("".join(ch for ch in c if ch.isalnum()) for c in columns)
+    return "idx_" + table + "_" + cols
+
+def create_indexes(path: str = db_path) -> list:
+    """
+    Creates (if they do not already exist) the indexes in the indexes list and
+    then runs ANALYZE so the query planner has current statistics. Tables that
+    do not exist in the database are skipped.
+
+    Args:
+        path (str, optional): path to the database. Defaults to the load_data database.
+
+    Returns:
+        list: the names of the indexes that exist after the run
+    """
+    # the dashboard engine may be read-only, so use a separate writable connection
+    db = sqlite3.connect(path)
+
+    try:
+        tables = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+        created = []
+        for table, columns in indexes:
+            if table not in tables:
+                print("Skipping " + table + " (table does not exist)")
+                continue
+
+            name = index_name(table, columns)
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+                    quote(name), quote(table), ", ".join(quote(c) for c in columns)
+                )
+            )
+            created.append(name)
+            print("Index: " + name)
+
+        db.execute("ANALYZE")
+        db.commit()
+
+    finally:
+        db.close()
+
+    return created
+
+def read_frame(db: sqlite3.Connection, query: str, params: tuple = ()) -> pd.DataFrame:
+    # a query result with display column names, as run_query returns it
+    data = pd.read_sql_query(query, db, params=params)
+    data.columns = [get_display_column_name(c) for c in data.columns]
+
+    return data
+
+def build_comparable_schools(path: str = db_path, count: int = comparable_schools_count) -> int:
+    """
+    Writes the comparable_schools table: for every year of K-8 data and every school,
+    the [count] nearest schools with an overlapping grade span, ranked by distance
+    (Year, SchoolID, Rank, ComparableSchoolID, Distance in miles). The lists only change
+    when new data is loaded, so the dashboard reads them with get_nearest_schools()
+    instead of running the spatial search on every request.
+
+    Args:
+        path (str, optional): path to the database. Defaults to the load_data database.
+        count (int, optional): schools per list. Defaults to comparable_schools_count.
+
+    Returns:
+        int: the number of rows written
+    """
+    # everything is read from path (not through the load_data engine), so the lists
+    # always describe the database they are written to
+    db = sqlite3.connect(path)
+
+    try:
+        years = sorted(int(row[0]) for row in db.execute("SELECT DISTINCT Year FROM academic_data_k8"))
+        school_types = read_frame(db, "SELECT SchoolID, SchoolType FROM school_index")
+
+        rows = []
+        for year in years:
+            coordinates = read_frame(
+                db, "SELECT Lat, Lon, SchoolID, HighGrade, LowGrade FROM academic_data_k8 WHERE Year = ?", (year,)
+            )
+            neighbors = SchoolSpatialIndex(coordinates, school_types).query_all(k=count, grade_span="overlap")
+            rows.extend(
+                (year, int(school), int(rank), int(comparable), float(distance))
+                for school, rank, comparable, distance in neighbors.itertuples(index=False)
+            )
+            print("Comparable schools: " + str(year) + " (" + str(len(neighbors)) + " rows)")
+
+    finally:
+        db.close()
+
+    # the dashboard engine may be read-only, so use a separate writable connection. The
+    # table is replaced in a single transaction, so readers see either the old or new rows
+    db = sqlite3.connect(path, isolation_level=None)
+
+    try:
+        db.execute("BEGIN")
+        db.execute("DROP TABLE IF EXISTS comparable_schools")
+        db.execute(
+            "CREATE TABLE comparable_schools (Year INTEGER, SchoolID INTEGER, Rank INTEGER, "
+            "ComparableSchoolID INTEGER, Distance REAL)"
+        )
+        db.executemany("INSERT INTO comparable_schools VALUES (?, ?, ?, ?, ?)", rows)
+
+        for table, columns in indexes:
+            if table == "comparable_schools":
+                db.execute(
+                    "CREATE INDEX {} ON {} ({})".format(
+                        quote(index_name(table, columns)), quote(table), ", ".join(quote(c) for c in columns)
+                    )
+                )
+
+        db.execute("ANALYZE comparable_schools")
+        db.execute("COMMIT")
+
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+
+    finally:
+        db.close()
+
+    return len(rows)
+
+def get_sample_arguments() -> dict:
+    # real ids for the accessors - the plan does not depend on the values, but
+    # the queries need valid parameters to be EXPLAINed
+    db = engine.raw_connection()
+    cur = db.cursor()
+
+    cur.execute("SELECT SchoolID, CorporationID FROM academic_data_k8 WHERE Year = ? LIMIT 1", (current_academic_year,))
+    school, corp = cur.fetchone()
+
+    cur.execute("SELECT SchoolID FROM academic_data_hs LIMIT 1")
+    row = cur.fetchone()
+    hs_school = row[0] if row else school
+
+    db.close()
+
+    return {"year": current_academic_year, "school": school, "corp": corp, "hs_school": hs_school}
+
+def collect_queries() -> list:
+    """
+    Runs every load_data accessor once with sample arguments and records the
+    statements they issue through run_query.
+
+    Returns:
+        list: a list of (accessor name, statement, parameters) tuples
+    """
+    args = get_sample_arguments()
+
+    accessors = [
+        ("get_academic_dropdown_years", ()),
+        ("get_school_corporation_list", (args["year"],)),
+        ("get_public_school_list", ([args["corp"]],)),
+        ("get_academic_data", ([args["school"]], args["year"])),
+        ("get_graduation_data", ()),
+        ("get_demographic_data", (args["school"],)),
+        ("get_corporation_demographic_data", (args["school"],)),
+        ("get_k8_corporation_academic_data", (args["school"],)),
+        ("get_high_school_academic_data", (args["hs_school"],)),
+        ("get_hs_corporation_academic_data", (args["hs_school"],)),
+        ("get_growth_data", (args["school"],)),
+        ("get_school_coordinates", (args["year"],)),
+        ("get_school_types", ()),
+        ("get_nearest_schools", (args["school"], args["year"])),
+    ]
+
+    queries = [("get_current_year", text("SELECT MAX(Year) FROM academic_data_k8"), None)]
+
+    for name, accessor_args in accessors:
+        with capture_queries() as captured:
+            try:
+                getattr(load_data, name)(*accessor_args)
+            except OperationalError as e:
+                # e.g. comparable_schools has not been built yet
+                print("Skipping " + name + " (" + str(e.orig) + ")")
+                continue
+
+        queries.extend((name, q, params) for q, params in captured)
+
+    return queries
+
+def find_table_scans(plan: list) -> list:
+    # a plan row looks like "SCAN academic_data_k8" (full table scan), "SCAN
+    # academic_data_k8 USING COVERING INDEX ..." (index-only scan - fine), or
+    # "SEARCH academic_data_k8 USING INDEX ..." (fine)
+    scans = []
+    for detail in plan:
+        if detail.startswith("SCAN ") and " USING " not in detail and "CONSTANT ROW" not in detail:
+            scans.append(detail)
+
+    return scans
+
+def check_query_plans() -> bool:
+    """
+    Prints the EXPLAIN QUERY PLAN output for every query in load_data.
+
+    Returns:
+        bool: True if no query uses a full table scan
+    """
+    ok = True
+
+    with engine.connect() as conn:
+        for name, q, params in collect_queries():
+            explain = text("EXPLAIN QUERY PLAN " + q.text)
+            plan = [row[-1] for row in conn.execute(explain, params or {}).fetchall()]
+            scans = find_table_scans(plan)
+
+            status = "FULL SCAN" if scans else "ok"
+            print(name + ": " + status)
+            for detail in plan:
+                print("    " + detail)
+
+            if scans:
+                ok = False
+
+    return ok
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="ICSB Dashboard database maintenance")
+    parser.add_argument("command", choices=["indexes", "check", "comparable"])
+    parser.add_argument("--count", type=int, default=comparable_schools_count, help="comparable schools per school (comparable)")
+    options = parser.parse_args(argv)
+
+    if options.command == "indexes":
+        create_indexes()
+        return 0
+
+    if options.command == "comparable":
+        build_comparable_schools(count=options.count)
+        return 0
+
+    return 0 if check_query_plans() else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
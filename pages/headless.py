@@ -0,0 +1,277 @@
+#############################################
+# ICSB Dashboard - Headless Callback Runner #
+#############################################
+# author:   jbetley
+# version:  1.09
+# date:     08/14/23
+
+# Runs the dashboard's callbacks from Python - no browser, no login, and no HTTP
+# round trip - for batch rendering, profiling, load testing and cache warming. A
+# callback is found by the ID of one of its outputs, called with the given input
+# values through Dash's own dispatch (so validation, no_update handling and JSON
+# serialization are exactly what the browser would get), and the JSON payload is
+# returned with its size and how long it took.
+#
+#   from pages.headless import run_callback
+#   result = run_callback("fig14c", "2023", [1001, 1002])
+#   result["bytes"], result["seconds"], json.loads(result["payload"])
+#
+#   python -m pages.headless fig14c '"2023"' '[1001, 1002]' [--repeat 5] [--payload]
+#   python -m pages.headless --list
+#
+# Input values are passed in the order of the callback's Inputs (then States). The
+# dashboard's output cache (pages/cache.py) still applies - set OUTPUT_CACHE_MAX_ENTRIES=0
+# to time the work rather than a cache hit. Background callbacks (BACKGROUND_CALLBACKS=1)
+# are run in-process rather than as a background job. The stage timings of the run (see
+# pages/instrumentation.py) are returned as well.
+
+import argparse
+import contextvars
+import json
+import sys
+import threading
+import time
+
+import dash
+from dash import _validate
+from dash._callback import NoUpdate
+from dash._callback_context import context_value
+from dash._utils import AttributeDict, split_callback_id, to_json
+from dash.exceptions import PreventUpdate
+
+from .instrumentation import collect_stages
+
+_app = None
+_app_lock = threading.Lock()
+
+def get_app() -> dash.Dash:
+    """
+    Imports the dashboard (app.py) and does the setup Dash otherwise does on the
+    first request (e.g. collecting the callbacks registered with @callback).
+
+    Returns:
+        dash.Dash: the dashboard app
+    """
+    global _app
+
+    with _app_lock:
+        if _app is None:
+            import app as dashboard
+
+            with dashboard.server.test_request_context():
+                dashboard.app._setup_server()
+
+            _app = dashboard.app
+
+    return _app
+
+def _outputs(callback_id: str) -> list:
+    outputs = split_callback_id(callback_id)
+
+    return outputs if isinstance(outputs, list) else [outputs]
+
+def list_callbacks() -> list:
+    """
+    Returns:
+        list: (callback id, output ids, input ids) for every server side callback
+    """
+    app = get_app()
+
+    return [
+        (
+            callback_id,
+            [o["id"] + "." + o["property"] for o in _outputs(callback_id)],
+            [i["id"] + "." + i["property"] for i in entry["inputs"] + entry["state"]],
+        )
+        for callback_id, entry in app.callback_map.items()
+    ]
+
+def find_callback(output: str) -> str:
+    """
+    Resolves a callback by one of its outputs.
+
+    Args:
+        output (str): a component id ("fig14c"), an id and property ("fig14c.children"),
+            or a full callback id
+
+    Returns:
+        str: the callback id (the key in app.callback_map)
+    """
+    app = get_app()
+
+    if output in app.callback_map:
+        return output
+
+    matches = []
+    for callback_id in app.callback_map:
+        for o in _outputs(callback_id):
+            if output in (o["id"], o["id"] + "." + o["property"]):
+                matches.append(callback_id)
+                break
+
+    if not matches:
+        raise KeyError("No callback has the output " + output)
+
+    if len(matches) > 1:
+        raise ValueError("More than one callback has the output " + output + " (use id.property): " + ", ".join(matches))
+
+    return matches[0]
+
+def _build_body(callback_id: str, values: list, triggered: list = None) -> dict:
+    entry = get_app().callback_map[callback_id]
+    dependencies = entry["inputs"] + entry["state"]
+
+    if len(values) != len(dependencies):
+        raise ValueError(
+            callback_id + " takes " + str(len(dependencies)) + " input values (" +
+            ", ".join(d["id"] + "." + d["property"] for d in dependencies) + "), got " + str(len(values))
+        )
+
+    inputs = [dict(d, value=v) for d, v in zip(entry["inputs"], values)]
+    state = [dict(d, value=v) for d, v in zip(entry["state"], values[len(entry["inputs"]):])]
+
+    # by default every input counts as changed (as on a page load)
+    if triggered is None:
+        triggered = [i["id"] + "." + i["property"] for i in entry["inputs"]]
+
+    return {
+        "output": callback_id,
+        "outputs": split_callback_id(callback_id),
+        "inputs": inputs,
+        "state": state,
+        "changedPropIds": triggered,
+    }
+
+def _run_in_process(app: dash.Dash, body: dict) -> str:
+    # a background callback returns a job id from dispatch, so the function itself is
+    # called (with the same callback context) and its return value serialized the way
+    # dispatch would
+    entry = app.callback_map[body["output"]]
+    outputs = _outputs(body["output"])
+
+    callback_context = AttributeDict(
+        inputs_list=body["inputs"],
+        states_list=body["state"],
+        outputs_list=body["outputs"],
+        input_values={i["id"] + "." + i["property"]: i.get("value") for i in body["inputs"]},
+        state_values={s["id"] + "." + s["property"]: s.get("value") for s in body["state"]},
+        triggered_inputs=[{"prop_id": t, "value": None} for t in body["changedPropIds"]],
+        ignore_register_page=True,
+    )
+    context_value.set(callback_context)
+
+    args = [d.get("value") for d in body["inputs"] + body["state"]]
+    func_args, func_kwargs = _validate.validate_and_group_input_args(args, entry["inputs_state_indices"])
+
+    output_value = entry["callback"].__wrapped__(*func_args, **func_kwargs)
+
+    if len(outputs) == 1 and not body["output"].startswith(".."):
+        output_value = [output_value]
+
+    response = {}
+    for value, spec in zip(output_value, outputs):
+        if not isinstance(value, NoUpdate):
+            response.setdefault(spec["id"], {})[spec["property"]] = value
+
+    if not response:
+        raise PreventUpdate
+
+    return to_json({"multi": True, "response": response})
+
+def run_callback(output: str, *values, triggered: list = None) -> dict:
+    """
+    Runs a callback with the given input values.
+
+    Args:
+        output (str): an output of the callback (see find_callback)
+        *values: the value of each Input, then each State, in the callback's order
+        triggered (list, optional): the "id.property" inputs reported as changed
+            (dash.ctx.triggered). Defaults to every input.
+
+    Returns:
+        dict: output (the callback id), status (200; 204 if the callback raised
+        PreventUpdate or returned no_update for every output; 500 if it raised an
+        exception), payload (the JSON response body, "" unless 200), bytes (payload
+        size), seconds (callback plus serialization), error (the exception, if any), and
+        stages (stage name -> seconds)
+    """
+    app = get_app()
+    callback_id = find_callback(output)
+    body = _build_body(callback_id, list(values), triggered)
+
+    background = bool(app.callback_map[callback_id].get("long"))
+
+    error = None
+    start = time.perf_counter()
+
+    with app.server.test_request_context("/_dash-update-component", method="POST", json=body), \
+            collect_stages() as timings:
+        try:
+            if background:
+                payload = contextvars.copy_context().run(_run_in_process, app, body)
+            else:
+                payload = app.dispatch().get_data(as_text=True)
+            status = 200
+
+        except PreventUpdate:
+            payload = ""
+            status = 204
+
+        except Exception as e:
+            # reported rather than raised, so a batch keeps going (as the server would
+            # answer 500 and keep serving)
+            payload = ""
+            status = 500
+            error = type(e).__name__ + ": " + str(e)
+
+    seconds = time.perf_counter() - start
+
+    return {
+        "output": callback_id,
+        "status": status,
+        "payload": payload,
+        "bytes": len(payload.encode("utf-8")),
+        "seconds": seconds,
+        "error": error,
+        "stages": {name: seconds for name, (seconds, _) in timings.stages.items()},
+    }
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a dashboard callback without a browser")
+    parser.add_argument("output", nargs="?", help="an output of the callback, e.g. fig14c or school-dropdown.options")
+    parser.add_argument("values", nargs="*", help="input values as JSON, in the callback's order")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--payload", action="store_true", help="print the JSON payload")
+    parser.add_argument("--list", action="store_true", help="list the callbacks and their inputs")
+    options = parser.parse_args(argv)
+
+    if options.list:
+        for callback_id, outputs, inputs in list_callbacks():
+            print(", ".join(outputs) + "\n    <- " + ", ".join(inputs))
+        return 0
+
+    if not options.output:
+        parser.error("an output is required (or --list)")
+
+    if options.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    values = [json.loads(v) for v in options.values]
+
+    for _ in range(options.repeat):
+        result = run_callback(options.output, *values)
+        print("status {}  {} bytes  {:.2f} ms".format(result["status"], result["bytes"], result["seconds"] * 1000))
+
+        if result["error"]:
+            print(result["error"])
+
+    for name, seconds in result["stages"].items():
+        print("    {:<48} {:>9.2f} ms".format(name, seconds * 1000))
+
+    if options.payload:
+        print(result["payload"])
+
+    return 1 if result["status"] == 500 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
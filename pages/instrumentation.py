@@ -0,0 +1,313 @@
+#####################################
+# ICSB Dashboard - Instrumentation  #
+#####################################
+# author:   jbetley
+# version:  1.09
+# date:     08/14/23
+
+# Stage timing for the request path. The load_data accessors (and the SQL reads behind
+# them), the process_data/calculations functions, the chart and table builders and the
+# page callbacks are wrapped with instrument(); any other block can be timed with
+# timed(). Stage names are "<group>.<function>":
+#
+#   @instrument("chart")
+#   def make_line_chart(values, label):         # -> chart.make_line_chart
+#
+#   with timed("process.merge"):
+#       ...
+#
+# Every stage is added to a per-process latency histogram, and - when it runs during a
+# request - to that request's timings, which init_instrumentation() sends back in a
+# Server-Timing header (shown in the browser's network panel):
+#
+#   Server-Timing: sql;dur=41.2;desc="6 calls", load.get_academic_data;dur=44.9, ...,
+#       callback.update_academic_analysis;dur=262.7, total;dur=281.3
+#
+# Stages nest (a load stage includes its sql time, a callback includes everything it
+# calls), so the durations do not add up to the total. The total minus the callback
+# stage is Dash's validation and JSON serialization of the response plus the login
+# check. Work on the fetch pool is attributed to the request that submitted it. Of the
+# analysis figures built in pool processes, only the figure.<name> totals are.
+#
+# With METRICS_PATH set, the histograms (plus one for whole requests, by route and
+# callback) are served in the Prometheus text format at that path. The endpoint needs
+# no login - restrict it at the proxy. Each gunicorn worker keeps its own histograms,
+# so a scrape only sees the worker that answered it. Every label comes from a fixed set
+# (the server's routes, the app's callbacks - anything else is "other" - and status
+# codes), and requests the login check rejects (see skip_request()) are not recorded,
+# so clients cannot add series.
+#
+# Configuration (environment):
+#   INSTRUMENTATION     "0" to leave every function unwrapped (default: "1")
+#   SERVER_TIMING       "0" to leave out the Server-Timing header (default: "1")
+#   METRICS_PATH        path of the Prometheus endpoint (default: none - disabled), e.g. /metrics
+#   METRICS_BUCKETS     comma separated histogram bounds in seconds
+#                       (default: 0.001,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10)
+
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import Flask, Response, g, request
+
+instrumentation_enabled = os.getenv("INSTRUMENTATION", "1") == "1"
+server_timing_enabled = os.getenv("SERVER_TIMING", "1") == "1"
+metrics_path = os.getenv("METRICS_PATH", "")
+metrics_buckets = sorted(float(b) for b in os.getenv(
+    "METRICS_BUCKETS", "0.001,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(",") if b.strip())
+
+class StageTimings:
+    # the stages of one request: name -> [seconds, calls]. Pool threads add to it too
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def header(self, total: float = None) -> str:
+        with self._lock:
+            items = list(self.stages.items())
+
+        entries = []
+        for name, (seconds, calls) in items:
+            entry = name + ";dur=" + format(seconds * 1000, ".1f")
+            if calls > 1:
+                entry += ';desc="' + str(calls) + ' calls"'
+            entries.append(entry)
+
+        if total is not None:
+            entries.append("total;dur=" + format(total * 1000, ".1f"))
+
+        return ", ".join(entries)
+
+class Histogram:
+    # cumulative Prometheus histograms, one per label set
+    def __init__(self, buckets: list):
+        self.buckets = buckets
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, seconds: float):
+        with self._lock:
+            series = self.series.get(labels)
+
+            if series is None:
+                series = self.series[labels] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series["counts"][i] += 1
+
+            series["sum"] += seconds
+            series["count"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {labels: dict(s, counts=list(s["counts"])) for labels, s in self.series.items()}
+
+stage_histogram = Histogram(metrics_buckets)
+request_histogram = Histogram(metrics_buckets)
+
+_current_timings = contextvars.ContextVar("stage_timings", default=None)
+
+def record_stage(name: str, seconds: float):
+    """
+    Adds a measured stage to the histograms and to the current request (if any).
+
+    Args:
+        name (str): stage name, e.g. "figure.fig14c"
+        seconds (float): duration
+    """
+    if not instrumentation_enabled:
+        return
+
+    stage_histogram.observe((name,), seconds)
+
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+@contextmanager
+def timed(name: str):
+    """
+    Times the enclosed block as a stage (also when it raises).
+
+    Args:
+        name (str): stage name
+    """
+    if not instrumentation_enabled:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+def instrument(group: str, name: str = ""):
+    """
+    Decorator that times every call of a function as the stage "<group>.<name>". Put it
+    under @memoize_output, so __wrapped__ still skips the output cache.
+
+    Args:
+        group (str): e.g. "load", "process", "calc", "chart", "table", "callback"
+        name (str, optional): Defaults to the function's name.
+
+    Returns:
+        callable: the decorator
+    """
+    def decorator(func):
+        if not instrumentation_enabled:
+            return func
+
+        stage_name = group + "." + (name or func.__name__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_stage(stage_name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+@contextmanager
+def collect_stages():
+    """
+    Collects the stages run in this context (and in pool threads it submits work to),
+    e.g. for one headless callback run.
+
+    Yields:
+        StageTimings: the timings collected so far (stages: name -> [seconds, calls])
+    """
+    timings = StageTimings()
+    token = _current_timings.set(timings)
+
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_histogram(metric: str, description: str, label_names: tuple, histogram: Histogram) -> list:
+    lines = ["# HELP " + metric + " " + description, "# TYPE " + metric + " histogram"]
+
+    for labels, series in sorted(histogram.snapshot().items()):
+        label_text = ",".join(n + '="' + _escape(v) + '"' for n, v in zip(label_names, labels))
+        prefix = label_text + "," if label_text else ""
+
+        for bound, count in zip(histogram.buckets, series["counts"]):
+            lines.append(metric + "_bucket{" + prefix + 'le="' + format(bound, "g") + '"} ' + str(count))
+
+        lines.append(metric + "_bucket{" + prefix + 'le="+Inf"} ' + str(series["count"]))
+        lines.append(metric + "_sum{" + label_text + "} " + repr(series["sum"]))
+        lines.append(metric + "_count{" + label_text + "} " + str(series["count"]))
+
+    return lines
+
+def format_metrics() -> str:
+    """
+    Returns:
+        str: the stage and request histograms in the Prometheus text format
+    """
+    lines = _format_histogram("dashboard_stage_seconds", "Time spent in an instrumented stage.",
+        ("stage",), stage_histogram)
+    lines += _format_histogram("dashboard_request_seconds", "Time to answer a request, by route and callback.",
+        ("route", "callback", "status"), request_histogram)
+
+    return "\n".join(lines) + "\n"
+
+def skip_request():
+    """
+    Leaves the current request out of the request histogram and the Server-Timing
+    header, e.g. a request the login check rejects. Its stages are still recorded.
+    """
+    g.instrumentation_skip = True
+
+def _callback_label(callbacks: dict) -> str:
+    # the first output of a Dash callback request. The output comes from the request
+    # body, so it is only used if it is one of the app's callbacks
+    if request.method != "POST" or not request.is_json:
+        return ""
+
+    body = request.get_json(silent=True)
+    output = body.get("output") if isinstance(body, dict) else None
+
+    if not isinstance(output, str) or output not in callbacks:
+        return "other"
+
+    if output.startswith(".."):
+        output = output[2:].split("...")[0]
+
+    return output.split(".")[0]
+
+def init_instrumentation(server: Flask, path: str = None, server_timing: bool = None, callbacks: dict = None) -> bool:
+    """
+    Registers the request timing (Server-Timing header, request histogram) and the
+    metrics endpoint on the Flask server. Call before the first request.
+
+    Args:
+        server (Flask): the dashboard's Flask server
+        path (str, optional): metrics endpoint ("" to disable). Defaults to METRICS_PATH.
+        server_timing (bool, optional): send the header. Defaults to SERVER_TIMING.
+        callbacks (dict, optional): the Dash app's callback_map - callback requests for
+            any other output are labelled "other". Defaults to none (all "other").
+
+    Returns:
+        bool: True if the metrics endpoint is enabled
+    """
+    path = metrics_path if path is None else path
+    server_timing = server_timing_enabled if server_timing is None else server_timing
+    callbacks = {} if callbacks is None else callbacks
+
+    if not instrumentation_enabled:
+        return False
+
+    def start_request():
+        g.instrumentation_start = time.perf_counter()
+        g.instrumentation_token = _current_timings.set(StageTimings())
+
+    def finish_request(response):
+        start = g.pop("instrumentation_start", None)
+        if start is None:
+            return response
+
+        total = time.perf_counter() - start
+        timings = _current_timings.get()
+
+        token = g.pop("instrumentation_token", None)
+        if token is not None:
+            _current_timings.reset(token)
+
+        if g.pop("instrumentation_skip", False):
+            return response
+
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        request_histogram.observe((route, _callback_label(callbacks), str(response.status_code)), total)
+
+        if server_timing and timings is not None:
+            response.headers["Server-Timing"] = timings.header(total)
+
+        return response
+
+    # first, so the total includes the other before_request functions (e.g. the login check)
+    server.before_request_funcs.setdefault(None, []).insert(0, start_request)
+    server.after_request(finish_request)
+
+    if path:
+        server.add_url_rule(path, "metrics", lambda: Response(format_metrics(),
+            content_type="text/plain; version=0.0.4; charset=utf-8"))
+
+    return bool(path)
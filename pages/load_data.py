@@ -27,9 +27,29 @@
 # https://stackoverflow.com/questions/14850341/connect-to-aws-rds-mysql-database-instance-with-flask-sqlalchemy?rq=1
 # https://stackoverflow.com/questions/62059016/connecting-flask-to-aws-rds-using-flask-sqlalchemy
 
+import contextvars
+import logging
+import os
+import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
 from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+
+from .cache import get_single_flight
+from .instrumentation import instrument, timed
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
 
 # global variables
 max_display_years = 5
@@ -85,13 +105,224 @@ grades_ordinal = [
     "8th"
 ]
 
-# Create a simple database
-engine = create_engine('sqlite:///data/db_all.db')
+# Column patterns (regex, matched against display column names) for the loaders that
+# feed the processing functions. Only matching columns are selected from the wide
+# academic tables - see build_projected_query(). Keep these in sync with the filters
+# in process_k8_academic_data(), filter_high_school_academic_data() and
+# process_high_school_academic_data().
+k8_academic_columns = r"Total Tested$|Total Proficient$|^IREAD Pass N|^IREAD Test N|Year|School Name|Low Grade|High Grade"
+
+# NOTE: process_high_school_academic_data() expects the eight identity/AHS columns
+# (Year, Corporation ID, Corporation Name, School ID, School Name, School Type,
+# AHS|Grad All, AHS|CCR) to always be present
+hs_academic_columns = r"^Year$|^Corporation ID$|^Corporation Name$|^School ID$|^School Name$|^School Type$|" \
+    r"Cohort Count$|Graduates$|^AHS|Benchmark$|Total Tested$"
+
+# Create the database engine. The dashboard never writes to db_all.db, so by default
+# connections are opened read-only (mode=ro, query_only) with the whole file memory-mapped
+# and a large page cache, and are pooled so that Flask worker threads reuse already-open
+# connections instead of opening and parsing the database on every query. Settings:
+#   DB_PATH             path to the database (default: data/db_all.db)
+#   DB_READ_ONLY        "0" to use a plain read/write engine (default: "1")
+#   DB_IMMUTABLE        "1" to open with immutable=1 (no locking or change detection -
+#                       only safe if the file is never modified while the app runs)
+#   DB_MMAP_SIZE        bytes to memory-map (default: the size of the file)
+#   DB_CACHE_SIZE_KB    page cache per connection in KiB (default: 65536)
+#   DB_POOL_SIZE        pooled connections (default: 8)
+#   DB_POOL_OVERFLOW    extra connections allowed under load (default: 8)
+db_path = os.getenv("DB_PATH", "data/db_all.db")
+db_read_only = os.getenv("DB_READ_ONLY", "1") == "1"
+db_immutable = os.getenv("DB_IMMUTABLE", "0") == "1"
+db_cache_size_kb = int(os.getenv("DB_CACHE_SIZE_KB", 65536))
+
+def _get_mmap_size() -> int:
+    if os.getenv("DB_MMAP_SIZE"):
+        return int(os.getenv("DB_MMAP_SIZE"))
+
+    try:
+        return os.path.getsize(db_path)
+    except OSError:
+        return 0
+
+def _connect_read_only():
+    uri = "file:" + quote(os.path.abspath(db_path)) + "?mode=ro"
+    if db_immutable:
+        uri += "&immutable=1"
+
+    # a pooled connection is only ever used by one thread at a time
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+if db_read_only:
+    engine = create_engine(
+        "sqlite://",
+        creator=_connect_read_only,
+        poolclass=QueuePool,
+        pool_size=int(os.getenv("DB_POOL_SIZE", 8)),
+        max_overflow=int(os.getenv("DB_POOL_OVERFLOW", 8)),
+    )
+else:
+    engine = create_engine('sqlite:///' + db_path)
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cur = dbapi_connection.cursor()
+    cur.execute("PRAGMA mmap_size = {}".format(_get_mmap_size()))
+    cur.execute("PRAGMA cache_size = {}".format(-db_cache_size_kb))
+    if db_read_only:
+        cur.execute("PRAGMA query_only = ON")
+    cur.close()
+
+def get_engine_settings() -> dict:
+    # effective values as reported by SQLite (mmap_size is capped at compile time)
+    db = engine.raw_connection()
+    cur = db.cursor()
+
+    settings = {"path": db_path, "read_only": db_read_only, "immutable": db_immutable}
+    for pragma in ["mmap_size", "cache_size", "query_only", "page_size"]:
+        cur.execute("PRAGMA " + pragma)
+        settings[pragma] = cur.fetchone()[0]
+
+    db.close()
+
+    return settings
+
+print("Database Engine Created . . . " + ", ".join(k + "=" + str(v) for k, v in get_engine_settings().items()))
 # import importlib.resources as resources
 # with resources.path("dashboard_0123.db") as sqlite_filepath:
 #     engine = create_engine(f"sqlite:///{sqlite_filepath}")
 
-# print('Database Engine Created . . .')
+# sqlite column headers do not have spaces between words. But we need to display the column names,
+# so we have to do a bunch of replacements to account for all conditions. Adding a space between
+# any lowercase character and any uppercase/number character takes care of most of it. The other
+# replacements catch edge cases. The result for each raw column name is computed once and kept in
+# the catalog, so run_query renames with a dict lookup rather than re-running the regexes on every
+# result (academic_data_k8 has 500+ columns). The catalog also keeps the reverse mapping.
+_display_column_names = {}
+_sql_column_names = {}
+_catalog_tables = {}
+_catalog_lock = threading.Lock()
+
+def get_display_column_name(column: str) -> str:
+    name = _display_column_names.get(column)
+
+    if name is None:
+        name = re.sub(r"([a-z])([A-Z1-9%])", r"\1 \2", column)
+        name = re.sub(r"([WADTO])([CATPB&])", r"\1 \2", name)
+        name = re.sub(r"([A])([a])", r"\1 \2", name)
+        name = re.sub(r"([1-9])([(])", r"\1 \2", name)
+        name = name.replace("or ", " or ")
+
+        with _catalog_lock:
+            _display_column_names[column] = name
+            _sql_column_names.setdefault(name, column)
+
+    return name
+
+def get_column_catalog(table: str) -> dict:
+    """
+    Returns a dict mapping each raw SQLite column name in table to its display
+    name, in table order. The table schema is read once per version of the
+    database (see get_database_version()).
+
+    Args:
+        table (str): name of a table in the database
+
+    Returns:
+        dict: {raw column name: display column name}
+    """
+    key = (table, get_database_version())
+    catalog = _catalog_tables.get(key)
+
+    if catalog is None:
+        db = engine.raw_connection()
+        cur = db.cursor()
+        cur.execute('PRAGMA table_info("{}")'.format(table.replace('"', '""')))
+        columns = [row[1] for row in cur.fetchall()]
+        db.close()
+
+        if not columns:
+            raise ValueError("Unknown table: " + table)
+
+        catalog = {c: get_display_column_name(c) for c in columns}
+
+        with _catalog_lock:
+            for stale in [k for k in _catalog_tables if k[1] != key[1]]:
+                del _catalog_tables[stale]
+            _catalog_tables[key] = catalog
+
+    return catalog
+
+def get_sql_column_name(column: str, table: str = "") -> str:
+    """
+    Reverse lookup: takes a display column name (e.g., "Grade 3|ELA Total Tested")
+    and returns the raw SQLite column name ("Grade3|ELATotalTested").
+
+    Args:
+        column (str): display column name
+        table (str, optional): if given, the schema of this table is loaded into the
+            catalog first. Otherwise only names seen by earlier queries are known.
+
+    Returns:
+        str: raw SQLite column name
+    """
+    if table:
+        get_column_catalog(table)
+
+    try:
+        return _sql_column_names[column]
+    except KeyError:
+        raise KeyError("No SQL column name found for: " + column) from None
+
+# Insufficient n-size values are stored in the database as the strings "***" or "^",
+# which makes every measure column an object column. split_suppressed() converts
+# measure data once into float64 values plus a boolean "suppressed" mask (True where
+# the cell was one of the suppression strings, in which case the value is NaN), so
+# the calculations can run on plain numeric arrays. The values and mask stay inside
+# each calculation, which still returns "***" in its result - the rest of the pipeline
+# passes mixed columns along.
+suppression_strings = ["***", "^"]
+
+def split_suppressed(data: pd.Series|pd.DataFrame, codes: list = suppression_strings) -> tuple:
+    """
+    Splits a mixed number/suppression string series or dataframe into a float64 copy
+    and a boolean suppression mask with the same shape and labels.
+
+    Args:
+        data (pd.Series|pd.DataFrame): measure data
+        codes (list, optional): the strings treated as suppressed. Defaults to "***" and "^".
+
+    Returns:
+        tuple: (values, mask) - float64 values (NaN for suppressed or missing cells)
+        and a boolean mask of the suppressed cells
+    """
+    # copy - for an object column to_numpy() returns a view of the caller's data
+    array = data.to_numpy(dtype=object, copy=True)
+
+    mask = np.zeros(array.shape, dtype=bool)
+    for code in codes:
+        mask |= array == code
+
+    # fast path: with the suppression strings removed, an object array of numbers
+    # and None converts directly (pd.to_numeric is ~10x slower on object data). Any
+    # other string raises, and is coerced to NaN by pd.to_numeric instead
+    array[mask] = None
+    try:
+        numbers = array.astype("float64")
+    except (ValueError, TypeError):
+        if isinstance(data, pd.DataFrame):
+            numbers = data.apply(pd.to_numeric, errors="coerce").to_numpy(dtype="float64")
+        else:
+            numbers = pd.to_numeric(data, errors="coerce").to_numpy(dtype="float64")
+        numbers[mask] = np.nan
+
+    if isinstance(data, pd.DataFrame):
+        values = pd.DataFrame(numbers, index=data.index, columns=data.columns)
+        mask = pd.DataFrame(mask, index=data.index, columns=data.columns)
+    else:
+        values = pd.Series(numbers, index=data.index, name=data.name)
+        mask = pd.Series(mask, index=data.index, name=data.name)
+
+    return values, mask
 
 def get_current_year():
 
@@ -106,6 +337,137 @@ def get_current_year():
 # another global variable
 current_academic_year = get_current_year()
 
+# Process-level cache of run_query results. Every callback goes through run_query, and
+# many users ask for the same corporation/year, so the warm path skips SQLite (and the
+# column renaming) entirely. Entries are keyed on the compiled statement and a canonical
+# form of its parameters, evicted LRU-first once either limit is exceeded, and the whole
+# cache is dropped if the database file is replaced (mtime changes). Concurrent misses
+# on the same key are coalesced, so only one thread runs the query (see cache.SingleFlight).
+query_cache_max_entries = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", 512))
+query_cache_max_bytes = int(os.getenv("QUERY_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+_query_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "bytes": 0}
+_query_cache_mtime = None
+_query_flight = get_single_flight("run_query")
+
+# in-memory academic_data_k8 (see load_k8_store()) - cleared with the result cache
+_k8_store = {}
+
+# when not None, run_query appends every (statement, parameters) pair it is asked to
+# run - used by db_maintenance to EXPLAIN the queries each accessor issues
+_captured_queries = None
+
+def _freeze_param(value):
+    # lists of ids (and nested containers) are not hashable, so convert them to tuples
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze_param(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze_param(v) for v in value)
+    return value
+
+def _query_cache_key(q, conditions) -> tuple:
+    return (str(q), _freeze_param(conditions))
+
+def _check_database_version():
+    # called with the cache lock held
+    global _query_cache_mtime
+
+    try:
+        mtime = os.path.getmtime(db_path)
+    except OSError:
+        mtime = None
+
+    if mtime != _query_cache_mtime:
+        if _query_cache:
+            _query_cache_stats["invalidations"] += 1
+        _query_cache.clear()
+        _query_cache_stats["bytes"] = 0
+        _k8_store.clear()
+
+        # pooled connections (particularly immutable ones) may hold pages of the old file
+        if _query_cache_mtime is not None:
+            engine.dispose()
+
+        _query_cache_mtime = mtime
+
+def get_database_version():
+    """
+    Returns the modification time of the database file (None if it cannot be read).
+    Objects derived from the data (e.g. the column catalog and projections) include it
+    in their cache key so they are rebuilt when the database is replaced.
+    """
+    with _query_cache_lock:
+        _check_database_version()
+        return _query_cache_mtime
+
+def get_query_cache_stats() -> dict:
+    """
+    Returns a snapshot of the run_query result cache counters (hits, misses,
+    evictions, invalidations), the number of entries, their approximate size
+    in bytes, and the number of misses coalesced with a query already in flight.
+    """
+    with _query_cache_lock:
+        stats = dict(_query_cache_stats)
+        stats["entries"] = len(_query_cache)
+
+    stats["coalesced"] = _query_flight.stats()["coalesced"]
+
+    return stats
+
+def clear_query_cache():
+    with _query_cache_lock:
+        _query_cache.clear()
+        _query_cache_stats["bytes"] = 0
+
+def _store_query_result(key, df: pd.DataFrame):
+    size = int(df.memory_usage(index=True, deep=True).sum())
+
+    # a single result larger than the whole budget is never cached
+    if size > query_cache_max_bytes:
+        return
+
+    with _query_cache_lock:
+        if key in _query_cache:
+            _query_cache_stats["bytes"] -= _query_cache.pop(key)[1]
+
+        _query_cache[key] = (df, size)
+        _query_cache_stats["bytes"] += size
+
+        while len(_query_cache) > query_cache_max_entries or _query_cache_stats["bytes"] > query_cache_max_bytes:
+            _, (_, evicted_size) = _query_cache.popitem(last=False)
+            _query_cache_stats["bytes"] -= evicted_size
+            _query_cache_stats["evictions"] += 1
+
+def _read_sql(q, conditions = None) -> pd.DataFrame:
+    with timed("sql"), engine.connect() as conn:
+        df = pd.read_sql_query(q, conn, params=conditions)
+
+    # see get_display_column_name()
+    df.columns = [get_display_column_name(str(c)) for c in df.columns]
+
+    return df
+
+def _load_query_result(key, q, conditions) -> pd.DataFrame:
+    df = _read_sql(q, conditions)
+
+    if query_cache_max_bytes > 0:
+        _store_query_result(key, df)
+
+    return df
+
+@contextmanager
+def capture_queries():
+    global _captured_queries
+
+    _captured_queries = []
+
+    try:
+        yield _captured_queries
+    finally:
+        _captured_queries = None
+
 # TODO: Refactor so everything passed in as a tuple of a dict for named placeholders, even if only a single val
 # Return Dataframe (read_sql is a convenience function wrapper around
 # read_sql_query or read_sql_table depending on input)
@@ -113,25 +475,282 @@ current_academic_year = get_current_year()
 def run_query(q, *args):
     conditions = None
 
+    if args:
+        conditions = args[0]
+
+    if _captured_queries is not None:
+        _captured_queries.append((q, conditions))
+
+    key = _query_cache_key(q, conditions)
+
+    with _query_cache_lock:
+        _check_database_version()
+        cached = _query_cache.get(key)
+
+        if cached is not None:
+            _query_cache.move_to_end(key)
+            _query_cache_stats["hits"] += 1
+        else:
+            _query_cache_stats["misses"] += 1
+
+    # callers modify the returned dataframe in place, so always hand out a copy
+    if cached is not None:
+        return cached[0].copy()
+
+    df, _ = _query_flight.do(key, lambda: _load_query_result(key, q, conditions))
+
+    # the loaded dataframe is shared by every coalesced caller (and the cache)
+    return df.copy()
+
+# Fetch plans. A view that needs several independent inputs (school data, corporation
+# data, demographics, ...) can ask for all of them at once and wait once:
+#
+#   data = run_fetch_plan({
+#       "school": (get_demographic_data, school),
+#       "corp": (get_corporation_demographic_data, school),
+#   })
+#
+# The calls run concurrently on a bounded thread pool. Each pool thread checks its own
+# connection out of the engine's pool, and the SQLite work itself runs outside the GIL.
+# FETCH_POOL_SIZE sets the number of threads (default: 4 - keep it at or below
+# DB_POOL_SIZE); 1 runs every plan serially on the calling thread.
+fetch_pool_size = int(os.getenv("FETCH_POOL_SIZE", 4))
+
+_fetch_executor = None
+_fetch_executor_pid = None
+_fetch_executor_lock = threading.Lock()
+
+def _get_fetch_executor() -> ThreadPoolExecutor:
+    global _fetch_executor, _fetch_executor_pid
+
+    with _fetch_executor_lock:
+        # pool threads do not survive a fork (e.g. into a gunicorn worker)
+        if _fetch_executor is None or _fetch_executor_pid != os.getpid():
+            _fetch_executor = ThreadPoolExecutor(max_workers=fetch_pool_size, thread_name_prefix="fetch")
+            _fetch_executor_pid = os.getpid()
+
+    return _fetch_executor
+
+def run_fetch_plan(plan: dict) -> dict:
+    """
+    Runs a set of named accessor calls concurrently and waits for all of them.
+
+    Args:
+        plan (dict): name -> (accessor, *args), e.g. {"school": (get_demographic_data, 1234)}
+
+    Returns:
+        dict: name -> the accessor's result (normally a dataframe). If any call raises,
+        the first exception (in plan order) is raised once every call has finished.
+    """
+    if fetch_pool_size <= 1 or len(plan) <= 1:
+        return {name: call[0](*call[1:]) for name, call in plan.items()}
+
+    executor = _get_fetch_executor()
+
+    # each call runs in a copy of the caller's context, so its stage timings count
+    # towards the caller's request (see instrumentation.py)
+    futures = {name: executor.submit(contextvars.copy_context().run, *call) for name, call in plan.items()}
+
+    # wait for everything before raising, so no call is left running unobserved
+    for future in futures.values():
+        future.exception()
+
+    return {name: future.result() for name, future in futures.items()}
+
+# column lists built by build_projected_query(), keyed on the database version like the
+# column catalog they are built from
+_projections = {}
+
+def _match_column(name: str, columns: str, exclude: str) -> bool:
+    return (not columns or re.search(columns, name) is not None) and not (exclude and re.search(exclude, name))
+
+def build_projected_query(table: str, where: str, columns: str = "", exclude: str = ""):
+    """
+    Builds a SELECT statement with an explicit column list instead of "SELECT *", so
+    SQLite only reads and transfers the columns a consumer actually uses. Columns are
+    matched against their display names (see get_column_catalog()) and are returned
+    in table order, i.e., the same order "SELECT *" would return them in.
+
+    Args:
+        table (str): the table to select from
+        where (str): the WHERE clause (may contain named placeholders)
+        columns (str, optional): regex of display column names to keep. Defaults to all columns.
+        exclude (str, optional): regex of display column names to drop. Defaults to none.
+
+    Returns:
+        sqlalchemy.sql.elements.TextClause: the query
+
+    Raises:
+        ValueError: if no column of the table matches the selection
+    """
+    key = (table, columns, exclude, get_database_version())
+    column_string = _projections.get(key)
+
+    if column_string is None:
+        if columns or exclude:
+            catalog = get_column_catalog(table)
+            selected = [raw for raw, display in catalog.items() if _match_column(display, columns, exclude)]
+
+            if not selected:
+                raise ValueError(
+                    "No columns of " + table + " match the selection (columns=" + repr(columns) + ", exclude=" + repr(exclude) + ")"
+                )
+
+            # colons need to be escaped or text() treats them as bind parameters
+            column_string = ", ".join('"' + c.replace('"', '""').replace(":", "\\:") + '"' for c in selected)
+        else:
+            column_string = "*"
+
+        with _catalog_lock:
+            for stale in [k for k in _projections if k[3] != key[3]]:
+                del _projections[stale]
+            _projections[key] = column_string
+
+    query_string = '''
+        SELECT {}
+            FROM {}
+            WHERE {}'''.format(column_string, table, where)
+
+    return text(query_string)
+
+# Data backends. "sqlite" (the default) runs every accessor as a query. "memory" loads
+# academic_data_k8 once into year partitions and serves get_academic_data,
+# get_public_school_list and get_school_coordinates by position lookup instead of SQL.
+# "arrow" is the same store, but loaded from a memory-mapped Arrow snapshot (see
+# pages/snapshot.py) rather than from SQLite, which is much faster on a cold worker.
+# Return shapes are the same for all three, so they can be benchmarked against each
+# other. Set with DATA_BACKEND or set_data_backend(); SNAPSHOT_PATH sets the snapshot
+# directory (default: data/snapshot).
+data_backends = ["sqlite", "memory", "arrow"]
+data_backend = os.getenv("DATA_BACKEND", "sqlite")
+snapshot_path = os.getenv("SNAPSHOT_PATH", "data/snapshot")
+
+_k8_store_lock = threading.Lock()
+
+def set_data_backend(backend: str):
+    global data_backend
+
+    if backend not in data_backends:
+        raise ValueError("Unknown data backend: " + backend + ". Use one of: " + ", ".join(data_backends))
+
+    data_backend = backend
+
+def _use_store() -> bool:
+    return data_backend in ["memory", "arrow"]
+
+def _read_missing_columns(data: pd.DataFrame) -> dict:
+    # read_sql_query builds a float64 column for a numeric column with nulls, so (as for
+    # a snapshot) the None and int values are put back for the selected rows by
+    # snapshot.take_rows() - column name -> (None, True if SQLite holds integers)
+    missing = [c for c in data.columns if data[c].dtype == "float64" and data[c].isna().any()]
+
+    if not missing:
+        return {}
+
+    raw = {display: name for name, display in get_column_catalog("academic_data_k8").items()}
+    checks = ", ".join("""SUM(typeof("{}") = 'real')""".format(raw[c].replace('"', '""')) for c in missing)
+
     with engine.connect() as conn:
-        if args:
-            conditions = args[0]
+        reals = conn.exec_driver_sql("SELECT " + checks + " FROM academic_data_k8").fetchone()
 
-        df = pd.read_sql_query(q, conn, params=conditions)
+    return {c: (None, not r) for c, r in zip(missing, reals)}
+
+def _read_k8_table() -> tuple:
+    # returns (data, suppressed) - see snapshot.read_table(). The sqlite path returns
+    # the mixed columns read_sql_query builds, so there are no suppression markers
+    if data_backend == "arrow":
+        try:
+            from .snapshot import read_snapshot_table
+
+            data, suppressed = read_snapshot_table(snapshot_path, "academic_data_k8", db_path)
+            data.columns = [get_display_column_name(str(c)) for c in data.columns]
+            suppressed = {get_display_column_name(str(c)): v for c, v in suppressed.items()}
+
+            return data, suppressed
+
+        # pyarrow is not installed, or the snapshot is missing, stale or unreadable
+        # (pyarrow's parse errors are ValueErrors) - anything else is a bug
+        except (ImportError, OSError, ValueError) as e:
+            logger.warning("Unable to load snapshot, reading from the database instead: %s", e)
+
+    data = _read_sql(text("SELECT * FROM academic_data_k8"))
+
+    return data, _read_missing_columns(data)
+
+def load_k8_store() -> dict:
+    """
+    Loads academic_data_k8 into memory (once per process, or again after the
+    database file changes). The table is kept whole - with the arrow backend its
+    numeric columns are views of the memory-mapped snapshot - and each Year keeps
+    its row positions and a map of School ID -> row positions. A separate School
+    Name/School ID/Corporation ID frame (all years, table order) serves the school
+    dropdown.
+
+    Returns:
+        dict: the store
+    """
+    with _query_cache_lock:
+        _check_database_version()
+
+    if _k8_store:
+        return _k8_store
 
-        # sqlite column headers do not have spaces between words. But we need to display the column names,
-        # so we have to do a bunch of str.replace to account for all conditions. May be a better way, but
-        # this is pretty fast. Adding a space between any lowercase character and any  uppercase/number
-        # character takes care of most of it. The other replace functions catch edge cases.           
-        df.columns = df.columns.str.replace(r"([a-z])([A-Z1-9%])", r"\1 \2", regex=True)
-        df.columns = df.columns.str.replace(r"([WADTO])([CATPB&])", r"\1 \2", regex=True)
-        df.columns = df.columns.str.replace(r"([A])([a])", r"\1 \2", regex=True)
-        df.columns = df.columns.str.replace(r"([1-9])([(])", r"\1 \2", regex=True)
-        df.columns = df.columns.str.replace("or ", " or ")
-        df.columns = df.columns.astype(str)
+    with _k8_store_lock:
+        if not _k8_store:
+            data, suppressed = _read_k8_table()
 
-        return df
+            years = {}
+            for year, positions in data.groupby("Year", sort=False).indices.items():
+                school_ids = data["School ID"].iloc[positions].reset_index(drop=True)
+                schools = {k: positions[v] for k, v in school_ids.groupby(school_ids).indices.items()}
+                years[int(year)] = (positions, schools)
 
+            schools = data[["School Name", "School ID", "Corporation ID"]].reset_index(drop=True)
+
+            _k8_store["data"] = data
+            _k8_store["suppressed"] = suppressed
+            _k8_store["years"] = years
+            _k8_store["schools"] = (schools, schools.groupby("Corporation ID").indices)
+
+    return _k8_store
+
+def _take_store_rows(data: pd.DataFrame, positions: np.ndarray, suppressed: dict, columns: list = None) -> pd.DataFrame:
+    # dtypes are re-inferred from the selected rows (as read_sql_query does for a query
+    # result) rather than the whole table, and an empty result is all object columns,
+    # also matching read_sql_query. Rows and columns are selected together, so only the
+    # selected cells are copied out of the store (selecting columns first would copy
+    # whole columns of the table)
+    column_positions = slice(None) if columns is None else data.columns.get_indexer(columns)
+
+    if not len(positions):
+        return data.iloc[0:0, column_positions].astype(object)
+
+    if suppressed:
+        from .snapshot import take_rows
+
+        return take_rows(data, suppressed, positions, columns)
+
+    return data.iloc[positions, column_positions].infer_objects()
+
+def _store_rows(data: pd.DataFrame, index: dict, keys: list, suppressed: dict = None, columns: list = None) -> pd.DataFrame:
+    # rows for the given keys, in table order
+    found = [index[k] for k in keys if k in index]
+    positions = np.sort(np.concatenate(found)) if found else np.array([], dtype=np.intp)
+
+    return _take_store_rows(data, positions, suppressed, columns)
+
+def _get_store_year(year) -> tuple:
+    # (row positions, School ID -> row positions) for a year
+    store = load_k8_store()
+
+    return store["years"].get(int(year), (np.array([], dtype=np.intp), {}))
+
+# load the store up front so the first request does not pay for it (with gunicorn
+# --preload this happens once, before the workers are forked)
+if _use_store():
+    load_k8_store()
+
+@instrument("load")
 def get_academic_dropdown_years():
 
     q = text(''' 
@@ -227,6 +846,7 @@ def get_academic_dropdown_years():
 
 #     return schools
 
+@instrument("load")
 def get_school_corporation_list(selected_year):
 
     params = dict(year=selected_year)
@@ -245,6 +865,7 @@ def get_school_corporation_list(selected_year):
 
     return corps
 
+@instrument("load")
 def get_public_school_list(corp_list):
 
     key = ['corps']
@@ -262,28 +883,45 @@ def get_public_school_list(corp_list):
 
     q = text(query_string)
 
-    school_list = run_query(q, params)
+    if _use_store():
+        schools, index = load_k8_store()["schools"]
+        school_list = _store_rows(schools, index, [int(v) for v in corp_list]).copy()
+    else:
+        school_list = run_query(q, params)
 
     school_list = school_list.drop_duplicates('School ID')
 
     return school_list
 
 
-def get_academic_data(*args):
+# by default, only the columns used by process_k8_academic_data() are selected. pass
+# columns="" to get every column
+@instrument("load")
+def get_academic_data(*args, columns: str = k8_academic_columns):
     keys = ['schools','year']
     params = dict(zip(keys, args))
 
     school_str = ', '.join( [ str(int(v)) for v in params['schools'] ] )
 
-    query_string = '''
-        SELECT *
-            FROM academic_data_k8
-            WHERE Year = :year AND SchoolID IN ({})'''.format( school_str )
+    exclude = "ELA and Math" if columns else ""
 
-    q = text(query_string)
+    if _use_store():
+        store = load_k8_store()
+        _, index = _get_store_year(params['year'])
+
+        data = store["data"]
+        selected = [c for c in data.columns if _match_column(c, columns, exclude)]
+        data = _store_rows(data, index, [int(v) for v in params['schools']], store["suppressed"], selected)
+
+        return data.reset_index(drop=True)
+
+    where = 'Year = :year AND SchoolID IN ({})'.format( school_str )
+
+    q = build_projected_query("academic_data_k8", where, columns, exclude)
 
     return run_query(q, params)
 
+@instrument("load")
 def get_graduation_data():
     params = dict(id='')
 
@@ -300,6 +938,7 @@ def get_graduation_data():
     return run_query(q, params)
 
 # for school corporations, SchoolID and CorpID are the same
+@instrument("load")
 def get_demographic_data(*args):
     keys = ['id']
     params = dict(zip(keys, args))
@@ -312,6 +951,36 @@ def get_demographic_data(*args):
     
     return run_query(q, params)
 
+@instrument("load")
+def get_school_index(*args):
+    keys = ['id']
+    params = dict(zip(keys, args))
+
+    q = text('''
+        SELECT *
+            FROM school_index
+	        WHERE SchoolID = :id
+        ''')
+
+    return run_query(q, params)
+
+# the demographic data of the school corporation the school is located in
+@instrument("load")
+def get_corporation_demographic_data(*args):
+    keys = ['id']
+    params = dict(zip(keys, args))
+
+    q = text('''
+        SELECT *
+            FROM demographic_data
+	        WHERE SchoolID = (
+		        SELECT GEOCorp
+			        FROM school_index
+			        WHERE SchoolID = :id)
+        ''')
+
+    return run_query(q, params)
+
 # def get_k8_school_academic_data(*args):
 #     keys = ['id']
 #     params = dict(zip(keys, args))
@@ -327,6 +996,7 @@ def get_demographic_data(*args):
 
 #     return results
 
+@instrument("load")
 def get_k8_corporation_academic_data(*args):
     keys = ['id']
     params = dict(zip(keys, args))
@@ -345,36 +1015,33 @@ def get_k8_corporation_academic_data(*args):
 
     return results
 
-def get_high_school_academic_data(*args):
+@instrument("load")
+def get_high_school_academic_data(*args, columns: str = hs_academic_columns):
     keys = ['id']
     params = dict(zip(keys, args))
 
-    q = text('''
-        SELECT *
-            FROM academic_data_hs
-	        WHERE SchoolID = :id
-        ''')
+    q = build_projected_query("academic_data_hs", "SchoolID = :id", columns, "ELA and Math" if columns else "")
 
     return run_query(q, params)
 
-def get_hs_corporation_academic_data(*args):
+@instrument("load")
+def get_hs_corporation_academic_data(*args, columns: str = hs_academic_columns):
     keys = ['id']
     params = dict(zip(keys, args))
 
-    q = text('''
-        SELECT *
-	        FROM corporation_data_hs
-	        WHERE CorporationID = (
+    where = '''CorporationID = (
 		        SELECT GEOCorp
 			        FROM school_index
-			        WHERE SchoolID = :id)
-        ''')
+			        WHERE SchoolID = :id)'''
+
+    q = build_projected_query("corporation_data_hs", where, columns, "ELA and Math" if columns else "")
 
     results = run_query(q, params)
     results = results.sort_values(by = 'Year',ascending = False)
 
     return results
 
+@instrument("load")
 def get_growth_data(*args):
     keys = ['id']
     params = dict(zip(keys, args))
@@ -387,6 +1054,7 @@ def get_growth_data(*args):
     return run_query(q, params)
 
 # "SchoolTotal|ELATotalTested" is a proxy for school size. 
+@instrument("load")
 def get_school_coordinates(*args):
     keys = ['year']
     params = dict(zip(keys, args))
@@ -396,5 +1064,38 @@ def get_school_coordinates(*args):
             FROM academic_data_k8 
             WHERE Year = :year
         ''')
-    
+
+    if _use_store():
+        store = load_k8_store()
+        positions, _ = _get_store_year(params['year'])
+
+        selected = ["Lat", "Lon", "School ID", "School Name", "High Grade", "Low Grade", "School Total|ELA Total Tested"]
+
+        return _take_store_rows(store["data"], positions, store["suppressed"], selected).reset_index(drop=True)
+
+    return run_query(q, params)
+
+# the ranked comparable schools for a school and year (see db_maintenance.build_comparable_schools)
+@instrument("load")
+def get_nearest_schools(*args):
+    keys = ['id', 'year']
+    params = dict(zip(keys, args))
+
+    q = text('''
+        SELECT SchoolID, Rank, ComparableSchoolID, Distance
+            FROM comparable_schools
+            WHERE SchoolID = :id AND Year = :year
+            ORDER BY Rank
+        ''')
+
     return run_query(q, params)
+
+@instrument("load")
+def get_school_types():
+
+    q = text('''
+        SELECT SchoolID, SchoolType
+            FROM school_index
+        ''')
+
+    return run_query(q)
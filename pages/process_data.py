@@ -5,7 +5,8 @@
 # version:  1.09
 # date:     08/14/23
 
-# TODO: Explore serverside disk caching for data loading
+# NOTE: Server side caching of callback outputs and processed dataframes (in-process
+# and shared on disk between workers) is in pages/cache.py
 #https://community.plotly.com/t/the-value-of-the-global-variable-does-not-change-when-background-true-is-set-in-the-python-dash-callback/73835
 
 # import time
@@ -14,13 +15,15 @@ import pandas as pd
 import numpy as np
 import itertools
 
-from .load_data import grades, ethnicity, subgroup, get_graduation_data
+from .load_data import grades, ethnicity, subgroup, get_graduation_data, get_school_index
 from .calculations import calculate_percentage, calculate_difference, calculate_proficiency, recalculate_total_proficiency, \
     calculate_graduation_rate, calculate_sat_rate, conditional_fillna, get_excluded_years
+from .instrumentation import instrument
 
 # NOTE: No K8 academic data exists for 2020
 print("#### Loading Data. . . . . ####")
 
+@instrument("process")
 def get_attendance_data(data: pd.DataFrame, year: str) -> pd.DataFrame:
 
     excluded_years = get_excluded_years(year)
@@ -45,6 +48,7 @@ def get_attendance_data(data: pd.DataFrame, year: str) -> pd.DataFrame:
     return attendance_rate
 pd.set_option('display.max_columns', None)
 pd.set_option('display.max_rows', None)  
+@instrument("process")
 def process_k8_academic_data(data: pd.DataFrame) -> pd.DataFrame:
 
     data = data.reset_index(drop = True)
@@ -86,7 +90,7 @@ def process_k8_academic_data(data: pd.DataFrame) -> pd.DataFrame:
 
         # separately calculate IREAD Proficiency
         if "IREAD Test N" in data.columns:
-            data["IREAD Proficient %"] =  calculate_percentage(data["IREAD Pass N"],data["IREAD Test N"])
+            data_proficiency["IREAD Proficient %"] =  calculate_percentage(data["IREAD Pass N"],data["IREAD Test N"])
         
         # create new df with Total Tested and Test N (IREAD) values
         # data_tested = data_proficiency.filter(regex="Total Tested|Test N|School Name", axis=1).copy()
@@ -146,6 +150,7 @@ def process_k8_academic_data(data: pd.DataFrame) -> pd.DataFrame:
 
     return data_proficiency
 
+@instrument("process")
 def process_k8_corp_academic_data(corp_data: pd.DataFrame, school_data: pd.DataFrame) -> pd.DataFrame:
 
     if len(corp_data.index) == 0:
@@ -210,6 +215,7 @@ def process_k8_corp_academic_data(corp_data: pd.DataFrame, school_data: pd.DataF
 
     return corp_data
 
+@instrument("process")
 def filter_high_school_academic_data(data: pd.DataFrame) -> pd.DataFrame:
     # NOTE: Drop columns without data. Generally, we want to keep "result" (e.g., "Graduates", "Pass N",
     # "Benchmark") columns with "0" values if the "tested" (e.g., "Cohort Count", "Total Tested",
@@ -257,6 +263,44 @@ def filter_high_school_academic_data(data: pd.DataFrame) -> pd.DataFrame:
 
     return data
     
+def merge_nsize_rows(data: pd.DataFrame, data_tested: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merges the N-Size (Total Tested/Cohort Count) rows onto the high school proficiency
+    rows. Each N-Size row is keyed by its category (e.g. "Black|EBRW Total Tested" ->
+    "Black|EBRW" and "Black|Cohort Count" -> "Black Graduation"), and each proficiency
+    row by the same key (e.g. "Black|EBRW At Benchmark" and "Black|EBRW Benchmark %"
+    -> "Black|EBRW", "Black Graduation Rate" -> "Black Graduation"). Rows without a
+    matching N-Size row (e.g. CCR Percentage) are dropped.
+
+    Args:
+        data (pd.DataFrame): proficiency data, one row per Category
+        data_tested (pd.DataFrame): N-Size data, one row per Category
+
+    Returns:
+        pd.DataFrame: data (in its original row order) with the N-Size columns added
+    """
+    # dtypes are inferred twice, as the cross merge this replaced did: over every row
+    # of each input (so e.g. an N-Size column with a missing year stays float even if
+    # that row is dropped), and again once the unmatched rows are gone (so a column of
+    # numbers that also held a dropped row's text becomes numeric)
+    data_tested = data_tested.infer_objects()
+    data_tested["Key"] = data_tested["Category"].replace({r" Total Tested$": "", r"\|Cohort Count$": " Graduation"}, regex=True)
+    data_tested = data_tested.drop("Category", axis=1)
+
+    data = data.infer_objects()
+    data["Key"] = data["Category"].replace(
+        {r" Graduation Rate$": " Graduation", r" (Benchmark %|At Benchmark|Approaching Benchmark|Below Benchmark)$": ""}, regex=True
+    )
+
+    # a left merge keeps the row order of data (an inner merge groups rows by key)
+    data = data[data["Key"].isin(data_tested["Key"])]
+    final_data = data.merge(data_tested, on="Key", how="left")
+
+    final_data = final_data.drop("Key", axis=1)
+
+    return final_data.reset_index(drop=True).infer_objects()
+
+@instrument("process")
 def process_high_school_academic_data(data: pd.DataFrame, school: str) -> pd.DataFrame:
 
     school_information = get_school_index(school)
@@ -381,29 +425,7 @@ def process_high_school_academic_data(data: pd.DataFrame, school: str) -> pd.Dat
             # make sure there are no lingering NoneTypes 
             data = data.fillna(value=np.nan)
 
-            # Merge Total Tested DF with Proficiency DF based on substring match
-
-            # add new column with substring values and drop old Category column
-            data_tested["Substring"] = data_tested["Category"].replace({" Total Tested": "", "\|Cohort Count": " Graduation"}, regex=True)
-
-            data_tested = data_tested.drop("Category", axis=1)
-
-            # this cross-merge and substring match process takes about .3s - must be a faster way
-            # t20 = time.process_time()
-
-            final_data = data.merge(data_tested, how="cross")
-
-            # keep only those rows where substring is in Category
-            # Need to temporarily rename "English Learner" because otherwise it 
-            # will match both "English" and "Non English"
-            final_data = final_data.replace({"Non English Language Learners": "Temp1", "English Language Learners": "Temp2"}, regex=True)
-
-            final_data = final_data[[a in b for a, b in zip(final_data["Substring"], final_data["Category"])]]
-            
-            final_data = final_data.replace({"Temp1": "Non English Language Learners", "Temp2": "English Language Learners"}, regex=True)             
-
-            final_data = final_data.drop("Substring", axis=1)
-            final_data = final_data.reset_index(drop=True)
+            final_data = merge_nsize_rows(data, data_tested)
 
             # reorder columns for display
             # NOTE: This final data keeps the Corp N-Size cols, which are not used
@@ -425,6 +447,7 @@ def process_high_school_academic_data(data: pd.DataFrame, school: str) -> pd.Dat
 
     return final_data
 
+@instrument("process")
 def merge_high_school_data(all_school_data: pd.DataFrame, all_corp_data: pd.DataFrame) -> pd.DataFrame:
 
     all_school_data.columns = all_school_data.columns.astype(str)
@@ -517,6 +540,7 @@ def merge_high_school_data(all_school_data: pd.DataFrame, all_corp_data: pd.Data
 
     return final_hs_academic_data
 
+@instrument("process")
 def process_growth_data(data: pd.DataFrame, category: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
 
     # step 1: find the percentage of students with Adequate growth using
@@ -0,0 +1,286 @@
+###################################
+# ICSB Dashboard - Data Snapshots #
+###################################
+# author:   jbetley
+# version:  1.09
+# date:     08/14/23
+
+# Exports tables in db_all.db to (uncompressed) Arrow IPC files that can be memory-mapped
+# by the dashboard workers (DATA_BACKEND=arrow, see load_data). Loading a snapshot skips
+# SQLite and most of the type inference, and all workers on a host share the file pages
+# through the OS cache. Only the tables the arrow backend reads (snapshot_tables) are
+# exported - every other accessor queries SQLite.
+#
+# Usage (from the project root):
+#   python -m pages.snapshot [--output data/snapshot]
+#
+# Column types: SQLite columns that hold numbers plus the "***"/"^" insufficient n-size
+# strings are stored as a float64 column (NaN for suppressed and missing cells, so the
+# column has no validity bitmap and can be read without a copy) and a separate int8
+# "<column>__suppressed" marker (1 = "***", 2 = "^"). Any other strings in a numeric
+# column go to a "<column>__text" string column.
+#
+# read_table() keeps the numeric columns typed and the markers as arrays backed by the
+# mapped file - the suppression strings, and the None and int values of numeric columns
+# with missing cells, are only put back for the rows a query actually selects (see
+# take_rows()), which gives the same values and dtypes the equivalent SQL query would.
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+suppression_codes = {"***": 1, "^": 2}
+suppressed_suffix = "__suppressed"
+integer_key = b"integer"
+text_suffix = "__text"
+manifest_name = "manifest.json"
+
+# the tables load_data reads from a snapshot
+snapshot_tables = ["academic_data_k8"]
+
+def _convert_column(name: str, values: list) -> list:
+    # returns a list of (name or pa.Field, pa.Array) pairs for one SQLite column
+    strings = {v for v in values if isinstance(v, str)}
+
+    if not strings or len(strings) == len({v for v in values if v is not None}):
+        # all numeric (or all null), or a plain text column
+        try:
+            return [(name, pa.array(values))]
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+
+    if strings.issubset(suppression_codes):
+        numbers = np.array([np.nan if v is None or isinstance(v, str) else v for v in values], dtype="float64")
+
+        # remember integer columns, so take_rows() can return ints like sqlite3 does
+        integer = all(isinstance(v, int) for v in values if v is not None and not isinstance(v, str))
+        field = pa.field(name, pa.float64(), metadata={integer_key: b"1" if integer else b"0"})
+
+        marker = np.array([suppression_codes.get(v, 0) if isinstance(v, str) else 0 for v in values], dtype=np.int8)
+
+        return [(field, pa.array(numbers)), (name + suppressed_suffix, pa.array(marker))]
+
+    numbers = [None if isinstance(v, str) else v for v in values]
+    text = [v if isinstance(v, str) else None for v in values]
+
+    return [(name, pa.array(numbers)), (name + text_suffix, pa.array(text, type=pa.string()))]
+
+def export_table(db: sqlite3.Connection, table: str, path: str) -> int:
+    cur = db.execute('SELECT * FROM "{}"'.format(table.replace('"', '""')))
+    names = [d[0] for d in cur.description]
+    rows = cur.fetchall()
+
+    arrays = []
+    for i, name in enumerate(names):
+        arrays.extend(_convert_column(name, [row[i] for row in rows]))
+
+    fields = [f if isinstance(f, pa.Field) else pa.field(f, a.type) for f, a in arrays]
+    table_data = pa.Table.from_arrays([a for _, a in arrays], schema=pa.schema(fields))
+
+    # write to a temporary file and rename so a reader never sees a partial file
+    tmp_path = path + ".tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table_data.schema) as writer:
+            writer.write_table(table_data)
+    os.replace(tmp_path, path)
+
+    return len(rows)
+
+def export_snapshot(db_path: str, output: str, tables: list = None) -> dict:
+    """
+    Exports tables in the database to <output>/<table>.arrow and writes a manifest
+    recording the source database's mtime (used by read_snapshot_table to detect a
+    stale snapshot).
+
+    Args:
+        db_path (str): path to db_all.db
+        output (str): snapshot directory
+        tables (list, optional): the tables to export. Defaults to snapshot_tables.
+
+    Returns:
+        dict: the manifest
+    """
+    os.makedirs(output, exist_ok=True)
+
+    manifest = {"source": os.path.abspath(db_path), "source_mtime": os.path.getmtime(db_path), "tables": {}}
+
+    db = sqlite3.connect(db_path)
+
+    try:
+        for table in tables or snapshot_tables:
+            file_name = table + ".arrow"
+            rows = export_table(db, table, os.path.join(output, file_name))
+            manifest["tables"][table] = {"file": file_name, "rows": rows}
+            print("Exported " + table + " (" + str(rows) + " rows)")
+
+    finally:
+        db.close()
+
+    with open(os.path.join(output, manifest_name), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+def read_manifest(snapshot_path: str) -> dict:
+    with open(os.path.join(snapshot_path, manifest_name)) as f:
+        return json.load(f)
+
+def _to_objects(column) -> np.ndarray:
+    # object array of python ints/floats/strs with None for nulls - the same values
+    # sqlite3 returns. (vectorized - to_pylist() is ~10x slower on wide tables)
+    column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    values = np.empty(len(column), dtype=object)
+
+    if pa.types.is_null(column.type):
+        return values
+
+    nulls = column.is_null().to_numpy(zero_copy_only=False)
+    valid = ~nulls
+    values[valid] = column.drop_null().to_numpy(zero_copy_only=False)
+
+    return values
+
+def _is_number(data_type) -> bool:
+    return pa.types.is_integer(data_type) or pa.types.is_floating(data_type)
+
+def read_table(path: str) -> tuple:
+    """
+    Memory-maps an exported Arrow file. Numeric columns stay typed and, where Arrow
+    allows it (no nulls), are views of the mapped file rather than copies - so every
+    worker on a host shares the same pages. The suppression strings are not put back
+    here: each suppressed column is returned with its marker (see take_rows()).
+
+    Args:
+        path (str): path to a <table>.arrow file
+
+    Returns:
+        tuple: (data, suppressed) - a dataframe with the raw SQLite column names (NaN in
+        suppressed and missing cells), and a dict of column name -> (int8 marker array,
+        or None if the column has no suppressed cells, True if the column holds integers)
+        for every numeric column with suppressed or missing cells
+    """
+    source = pa.memory_map(path, "r")
+    table = pa.ipc.open_file(source).read_all()
+
+    names = table.column_names
+    companions = {n for n in names if n.endswith(suppressed_suffix) or n.endswith(text_suffix)}
+    columns = [n for n in names if n not in companions]
+
+    suppressed = {}
+    text = {}
+    for name in columns:
+        if name + suppressed_suffix in companions:
+            marker = table.column(name + suppressed_suffix).combine_chunks().to_numpy()
+            metadata = table.schema.field(name).metadata or {}
+            suppressed[name] = (marker, metadata.get(integer_key) == b"1")
+
+        elif table.column(name).null_count and _is_number(table.column(name).type):
+            # pandas reads a numeric column with nulls as float64 - take_rows() puts the
+            # None and int values back (there are no suppression strings to restore)
+            suppressed[name] = (None, pa.types.is_integer(table.column(name).type))
+
+        elif name + text_suffix in companions:
+            # any other strings in a numeric column are rare, and are put back here
+            values = _to_objects(table.column(name))
+            strings = _to_objects(table.column(name + text_suffix))
+            has_text = pd.notna(strings)
+            values[has_text] = strings[has_text]
+            text[name] = values
+
+    # split_blocks keeps each column in its own block, so pandas does not copy the
+    # mapped columns into consolidated 2-D blocks
+    data = table.select([n for n in columns if n not in text]).to_pandas(split_blocks=True)
+
+    for name, values in text.items():
+        data[name] = values
+
+    return data[columns], suppressed
+
+def take_rows(data: pd.DataFrame, suppressed: dict, positions: np.ndarray, columns: list = None) -> pd.DataFrame:
+    """
+    Returns the rows at positions with the suppression strings put back, i.e., the
+    mixed number/string columns the equivalent SQL query returns. Only the selected
+    cells are copied and converted.
+
+    Args:
+        data (pd.DataFrame): a table returned by read_table() (display column names are fine)
+        suppressed (dict): its suppression markers, keyed by the same column names
+        positions (np.ndarray): row positions, in the order to return them
+        columns (list, optional): the columns to return. Defaults to all columns.
+
+    Returns:
+        pd.DataFrame: the rows, with dtypes inferred from the selected values
+    """
+    rows = data.iloc[positions] if columns is None else data.iloc[positions, data.columns.get_indexer(columns)]
+
+    restored = {}
+    for name in rows.columns:
+        if name not in suppressed:
+            continue
+
+        marker, integer = suppressed[name]
+        values = rows[name].to_numpy(dtype=object)
+
+        # sqlite3 returns None for a null, and ints for an integer column
+        valid = pd.notna(values)
+        values[~valid] = None
+        if integer:
+            values[valid] = [int(v) for v in values[valid]]
+
+        if marker is not None:
+            codes = marker[positions]
+            for code, value in suppression_codes.items():
+                values[codes == value] = code
+
+        restored[name] = values
+
+    if restored:
+        rows = rows.assign(**restored)
+
+    return rows.infer_objects()
+
+def read_snapshot_table(snapshot_path: str, table: str, db_path: str = "") -> tuple:
+    """
+    Reads one table from a snapshot directory (see read_table()).
+
+    Args:
+        snapshot_path (str): snapshot directory
+        table (str): table name
+        db_path (str, optional): if given, raise ValueError when the snapshot was not
+            exported from the current version of this database
+
+    Returns:
+        tuple: (data, suppressed)
+
+    Raises:
+        OSError: if the snapshot files cannot be read
+        ValueError: if the snapshot is out of date, does not include the table, or
+            cannot be parsed
+    """
+    manifest = read_manifest(snapshot_path)
+
+    if db_path and os.path.exists(db_path) and manifest["source_mtime"] != os.path.getmtime(db_path):
+        raise ValueError("Snapshot in " + snapshot_path + " is out of date - re-run: python -m pages.snapshot")
+
+    if table not in manifest["tables"]:
+        raise ValueError("Snapshot in " + snapshot_path + " does not include " + table)
+
+    return read_table(os.path.join(snapshot_path, manifest["tables"][table]["file"]))
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Export db_all.db to Arrow IPC snapshot files")
+    parser.add_argument("--database", default=os.getenv("DB_PATH", "data/db_all.db"))
+    parser.add_argument("--output", default=os.getenv("SNAPSHOT_PATH", "data/snapshot"))
+    options = parser.parse_args(argv)
+
+    export_snapshot(options.database, options.output)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,6 +9,7 @@ import pandas as pd
 from dash import dash_table, html
 from dash.dash_table import FormatTemplate
 from dash.dash_table.Format import Format, Scheme, Sign
+from .instrumentation import instrument
 
 # Global table styles
 table_style = {
@@ -333,6 +334,7 @@ def create_growth_table_and_fig(table: list, fig, label: str):    # : plotly.gra
 
     return table_layout
 
+@instrument("table")
 def create_growth_table(all_data: pd.DataFrame, label: str = "") -> list:
     """
     Takes a label, a dataframe, and a descriptive (type) string and creates a multi-header
@@ -504,6 +506,7 @@ def create_growth_table(all_data: pd.DataFrame, label: str = "") -> list:
 
     return table_layout
 
+@instrument("table")
 def create_key_table(data: pd.DataFrame, label: str, width: int = 0) -> list:
     """
     Takes a dataframe, a string, and an int (optional) and creates a simple
@@ -661,6 +664,7 @@ def create_key_table(data: pd.DataFrame, label: str, width: int = 0) -> list:
 
     return table_layout
 
+@instrument("table")
 def create_basic_info_table(data: pd.DataFrame, label: str) -> list:
     """
     Takes a dataframe of two or more columns and a label and creates a single
@@ -847,6 +851,7 @@ def create_basic_info_table(data: pd.DataFrame, label: str) -> list:
 
     return table_layout
 
+@instrument("table")
 def create_academic_info_table(data: pd.DataFrame, label: str) -> list:
     """
     Takes a dataframe of two or more columns and a label, and creates a table with multi-headers.
@@ -1112,6 +1117,7 @@ def create_academic_info_table(data: pd.DataFrame, label: str) -> list:
 
     return table_layout
 
+@instrument("table")
 def create_metric_table(label: list, data: pd.DataFrame) -> list:
     """
     Takes a label and a dataframe consisting of Rating and Metric Columns and returns
@@ -1551,6 +1557,7 @@ def set_table_layout(table1: list, table2: list, cols: pd.Series) -> list:
 
     return table_layout
 
+@instrument("table")
 def create_comparison_table(data: pd.DataFrame, label: str) -> list:
     """
     Takes a dataframe that is a column of schools and one or more columns
@@ -0,0 +1,106 @@
+#####################################
+# ICSB Dashboard - Traffic Recorder #
+#####################################
+# author:   jbetley
+# version:  1.09
+# date:     08/14/23
+
+# Opt-in recorder for callback requests. Every request to a recorded endpoint (by
+# default the Dash callback endpoint) is appended to a JSON-lines file with its
+# request body (the callback output, input and state values), status, response size
+# and duration - the real mix of year/corporation/school selections, which
+# benchmarks/replay.py can fire at a candidate build.
+#
+# One line per request:
+#   {"ts": 1692028800.123, "pid": 4242, "method": "POST", "endpoint": "/_dash-update-component",
+#    "query": "", "output": "..fig14c.children...", "body": {...}, "status": 200,
+#    "bytes": 83313, "ms": 271.4}
+#
+# Each line is written with a single O_APPEND write, so the gunicorn workers can share
+# one file. Nothing but the request body is recorded (no cookies or headers).
+#
+# Configuration (environment):
+#   TRAFFIC_LOG           path of the JSON-lines file (default: none - recording disabled)
+#   TRAFFIC_ENDPOINTS     comma separated paths to record (default: /_dash-update-component)
+
+import json
+import os
+import threading
+import time
+from flask import Flask, g, request
+
+traffic_log = os.getenv("TRAFFIC_LOG", "")
+traffic_endpoints = [e.strip() for e in os.getenv("TRAFFIC_ENDPOINTS", "/_dash-update-component").split(",") if e.strip()]
+
+_log_fd = None
+_log_fd_pid = None
+_log_lock = threading.Lock()
+
+def _write_record(path: str, record: dict):
+    global _log_fd, _log_fd_pid
+
+    line = (json.dumps(record, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+
+    with _log_lock:
+        # a forked worker opens its own descriptor
+        if _log_fd is None or _log_fd_pid != os.getpid():
+            _log_fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            _log_fd_pid = os.getpid()
+
+        os.write(_log_fd, line)
+
+def init_traffic_recorder(server: Flask, path: str = "", endpoints: list = None) -> bool:
+    """
+    Registers the recorder on the Flask server (if a log path is configured). Call
+    before the first request.
+
+    Args:
+        server (Flask): the dashboard's Flask server
+        path (str, optional): the JSON-lines file. Defaults to TRAFFIC_LOG.
+        endpoints (list, optional): request paths to record. Defaults to TRAFFIC_ENDPOINTS.
+
+    Returns:
+        bool: True if recording is enabled
+    """
+    path = path or traffic_log
+    endpoints = endpoints or traffic_endpoints
+
+    if not path:
+        return False
+
+    def start_timer():
+        if request.path in endpoints:
+            g.traffic_start = time.perf_counter()
+
+    def record_request(response):
+        if request.path not in endpoints:
+            return response
+
+        start = g.pop("traffic_start", None)
+        body = request.get_json(silent=True)
+
+        if response.is_streamed:
+            size = None
+        else:
+            size = response.content_length if response.content_length is not None else len(response.get_data())
+
+        _write_record(path, {
+            "ts": time.time(),
+            "pid": os.getpid(),
+            "method": request.method,
+            "endpoint": request.path,
+            "query": request.query_string.decode("utf-8", "replace"),
+            "output": body.get("output") if isinstance(body, dict) else None,
+            "body": body,
+            "status": response.status_code,
+            "bytes": size,
+            "ms": None if start is None else round((time.perf_counter() - start) * 1000, 3),
+        })
+
+        return response
+
+    # first, so the time includes the other before_request functions (e.g. the login check)
+    server.before_request_funcs.setdefault(None, []).insert(0, start_timer)
+    server.after_request(record_request)
+
+    return True
@@ -0,0 +1,43 @@
+#############################################
+# ICSB Dashboard - Test Configuration       #
+#############################################
+# author:   jbetley
+# version:  1.09
+# date:     08/14/23
+
+# The tests run against a small synthetic database (see benchmarks/generate_db.py).
+# pages.load_data opens the database when it is first imported, so the environment
+# is set here, before any test module imports it.
+#
+# Usage (from the project root):
+#   python -m pytest tests
+
+import os
+import tempfile
+
+import pytest
+
+from benchmarks.generate_db import generate_database
+
+test_data_dir = tempfile.mkdtemp(prefix="dashboard-tests-")
+test_db_path = os.path.join(test_data_dir, "db_all.db")
+
+generate_database(test_db_path, scale=0.05, seed=0)
+
+os.environ["DB_PATH"] = test_db_path
+os.environ["OUTPUT_CACHE_MAX_ENTRIES"] = "0"
+os.environ.pop("OUTPUT_CACHE_DIR", None)
+os.environ.pop("DATA_BACKEND", None)
+
+@pytest.fixture(scope="session")
+def db_path() -> str:
+    return test_db_path
+
+@pytest.fixture(scope="session")
+def k8_schools() -> list:
+    # (School ID, Corporation ID, Year) for every school in academic_data_k8
+    from pages.load_data import run_query, text
+
+    data = run_query(text("SELECT DISTINCT SchoolID, CorporationID, Year FROM academic_data_k8"))
+
+    return list(data.itertuples(index=False, name=None))
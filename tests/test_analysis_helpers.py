@@ -0,0 +1,53 @@
+import json
+import pickle
+
+import plotly
+import plotly.graph_objects as go
+import pytest
+
+from pages import analysis_helpers
+from pages.analysis_helpers import analysis_figures, build_analysis_figures
+from pages.cache import dumps_output
+
+def to_json(value) -> str:
+    return json.dumps(value, cls=plotly.utils.PlotlyJSONEncoder, sort_keys=True)
+
+@pytest.fixture(scope="module")
+def analysis_data(k8_schools):
+    # the display academic data update_academic_analysis builds (one row per school)
+    from pages.load_data import get_academic_data
+    from pages.process_data import process_k8_academic_data
+
+    year = max(y for _, _, y in k8_schools)
+    data = process_k8_academic_data(get_academic_data([1001, 1004], str(year)).replace({"^": "***"}))
+
+    return data.set_index("Category").T.rename_axis("School Name").rename_axis(None, axis=1).reset_index()
+
+def test_dumps_output_stores_figures_as_their_dicts():
+    figure = go.Figure(go.Bar(x=["a", "b"], y=[1, 2]))
+
+    loaded = pickle.loads(dumps_output([figure, {"display": "block"}]))
+
+    assert isinstance(loaded[0], dict)
+    assert to_json(loaded) == to_json([figure.to_plotly_json(), {"display": "block"}])
+
+@pytest.fixture
+def process_pool(monkeypatch):
+    monkeypatch.setattr(analysis_helpers, "figure_workers", 2)
+
+    yield
+
+    for executor in analysis_helpers._executors.values():
+        executor.shutdown()
+    analysis_helpers._executors.clear()
+
+def test_process_mode_builds_the_same_figures_as_serial(analysis_data, process_pool):
+    serial = build_analysis_figures(analysis_data, "serial")
+    process = build_analysis_figures(analysis_data, "process")
+
+    assert list(process) == [name for name, _, _ in analysis_figures]
+    assert to_json(process) == to_json(pickle.loads(dumps_output(serial)))
+
+def test_unknown_mode_is_rejected(analysis_data):
+    with pytest.raises(ValueError):
+        build_analysis_figures(analysis_data, "thread")
@@ -0,0 +1,54 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("diskcache")
+
+# app.py reads BACKGROUND_CALLBACKS when it is imported, so the app runs in its own
+# process. Jobs are submitted and polled through Dash's dispatch (as the renderer
+# would), and the last line printed is a summary
+script = """
+import json, time
+from pages.headless import get_app, find_callback, _build_body
+
+app = get_app()
+callback_id = find_callback("fig14c")
+
+def post(values, **query):
+    body = _build_body(callback_id, values)
+    with app.server.test_request_context("/_dash-update-component", method="POST", json=body, query_string=query):
+        return json.loads(app.dispatch().get_data(as_text=True) or "{}")
+
+first = post(["2023", [1001, 1004]])
+second = post(["2023", [1006, 1007]], oldJob=first["job"])
+
+deadline = time.time() + 120
+while time.time() < deadline:
+    result = post(["2023", [1006, 1007]], cacheKey=second["cacheKey"], job=second["job"])
+    if "response" in result:
+        break
+    time.sleep(0.2)
+
+manager = app._background_manager
+print(json.dumps({
+    "first_done": manager.result_ready(first["cacheKey"]),
+    "first_running": manager.job_running(first["job"]),
+    "outputs": sorted(result.get("response", {})),
+}))
+"""
+
+def test_background_job_completes_and_a_new_request_cancels_the_old_job(db_path, tmp_path):
+    env = dict(os.environ, DB_PATH=db_path, BACKGROUND_CALLBACKS="1", BACKGROUND_CACHE_DIR=str(tmp_path))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    run = subprocess.run([sys.executable, "-c", script], cwd=root, env=env, capture_output=True, text=True, timeout=300)
+    assert run.returncode == 0, run.stderr
+
+    summary = json.loads(run.stdout.strip().splitlines()[-1])
+
+    assert summary["first_done"] is False
+    assert summary["first_running"] is False
+    assert "fig14c" in summary["outputs"] and "fig16b2" in summary["outputs"]
@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+
+import pytest
+
+from pages import cache
+from pages.cache import DiskCache, SingleFlight, memoize_output
+
+@pytest.fixture
+def disk_tier(tmp_path, monkeypatch):
+    # both tiers on, with the disk tier in a temporary directory
+    monkeypatch.setattr(cache, "output_cache_max_entries", 16)
+    monkeypatch.setattr(cache, "output_cache_dir", str(tmp_path))
+    monkeypatch.setattr(cache, "_disk_cache", None)
+    cache.clear_output_cache()
+
+    yield cache.get_disk_cache()
+
+    cache.clear_output_cache()
+
+def test_disk_cache_evicts_least_recently_read_entries_over_the_byte_limit(tmp_path):
+    disk = DiskCache(str(tmp_path / "cache.db"), max_bytes=250)
+
+    disk.set("a", "1", b"a" * 100)
+    disk.set("b", "1", b"b" * 100)
+    assert disk.get("a", "1") == b"a" * 100
+
+    disk.set("c", "1", b"c" * 100)
+
+    assert disk.get("b", "1") is None
+    assert disk.get("a", "1") is not None and disk.get("c", "1") is not None
+    assert disk.stats() == {"entries": 2, "bytes": 200}
+
+    # a value larger than the whole cache is not stored
+    disk.set("d", "1", b"d" * 300)
+    assert disk.get("d", "1") is None
+
+def test_disk_cache_only_returns_entries_for_the_same_version(tmp_path):
+    disk = DiskCache(str(tmp_path / "cache.db"), max_bytes=1000)
+
+    disk.set("a", "1", b"value")
+
+    assert disk.get("a", "2") is None
+    assert disk.get("a", "1") == b"value"
+
+def test_disk_cache_lease_is_exclusive_until_it_expires(tmp_path):
+    disk = DiskCache(str(tmp_path / "cache.db"), max_bytes=1000, lock_timeout=0.2)
+    other = DiskCache(disk.path, max_bytes=1000, lock_timeout=0.2)
+
+    assert disk.lock("a")
+    assert not disk.lock("a")
+
+    taken = []
+    thread = threading.Thread(target=lambda: taken.append(other.lock("a")))
+    thread.start()
+    thread.join()
+    assert taken == [False]
+
+    # the holder neither stores a value nor unlocks - the lease runs out
+    start = time.perf_counter()
+    assert other.wait_for("a", "1", poll=0.01) is None
+    assert time.perf_counter() - start < 1
+
+    thread = threading.Thread(target=lambda: taken.append(other.lock("a")))
+    thread.start()
+    thread.join()
+    assert taken == [False, True]
+
+def test_memoized_output_is_invalidated_when_the_database_changes(disk_tier, db_path):
+    calls = []
+
+    @memoize_output()
+    def compute(value):
+        calls.append(value)
+        return [value]
+
+    mtime = os.path.getmtime(db_path)
+
+    try:
+        assert compute(1) == [1]
+        assert compute(1) == [1]
+        assert calls == [1]
+
+        # the in-process tier is empty in a new worker - the disk tier still has the entry
+        cache.clear_output_cache()
+        assert compute(1) == [1]
+        assert calls == [1]
+        assert disk_tier.stats()["entries"] == 1
+
+        os.utime(db_path, (mtime + 10, mtime + 10))
+
+        assert compute(1) == [1]
+        assert calls == [1, 1]
+
+    finally:
+        os.utime(db_path, (mtime, mtime))
+
+def run_coalesced(flight: SingleFlight, func, threads: int = 8) -> list:
+    # starts threads that all call flight.do() on one key, and lets the leader finish
+    # only once every other thread has joined its call
+    release = threading.Event()
+    outcomes = [None] * threads
+
+    def leader():
+        release.wait(5)
+        return func()
+
+    def call(i):
+        try:
+            outcomes[i] = flight.do("key", leader)
+        except Exception as e:
+            outcomes[i] = e
+
+    workers = [threading.Thread(target=call, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+
+    deadline = time.perf_counter() + 5
+    while flight.stats()["coalesced"] < threads - 1 and time.perf_counter() < deadline:
+        time.sleep(0.001)
+    release.set()
+
+    for worker in workers:
+        worker.join()
+
+    return outcomes
+
+def test_single_flight_runs_concurrent_calls_once():
+    flight = SingleFlight()
+    executions = []
+
+    def func():
+        executions.append(1)
+        return {"value": 1}
+
+    outcomes = run_coalesced(flight, func)
+
+    assert len(executions) == 1
+    assert sorted(shared for _, shared in outcomes) == [False] + [True] * 7
+    assert all(result is outcomes[0][0] for result, _ in outcomes)
+    assert flight.stats() == {"calls": 8, "executions": 1, "coalesced": 7, "in_flight": 0}
+
+def test_single_flight_raises_the_leaders_exception_in_every_waiter():
+    flight = SingleFlight()
+    error = ValueError("failed")
+
+    def func():
+        raise error
+
+    outcomes = run_coalesced(flight, func)
+
+    assert all(outcome is error for outcome in outcomes)
+    assert flight.stats()["executions"] == 1
+
+    # nothing is kept once the call finishes
+    assert flight.do("key", lambda: 2) == (2, False)
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pages.calculate_metrics import calculate_k8_comparison_metrics
+
+def test_k8_comparison_aligns_corporation_rows_by_category():
+    # a Category with no school data in the most recent year (American Indian) ends
+    # up after the other Categories in the school data, but not in the corporation
+    # data - differences must be taken against the corporation row with the same
+    # Category, not the row in the same position
+    school_data = pd.DataFrame({
+        "Category": [
+            "Grade 3|ELA Proficient %",
+            "Native Hawaiian or Other Pacific Islander|ELA Proficient %",
+            "American Indian|ELA Proficient %",
+        ],
+        "2023School": [0.5, 0.75, np.nan],
+        "2023N-Size": [40, 12, np.nan],
+        "2022School": [0.45, 0.6, 0.3],
+        "2022N-Size": [38, 11, 10],
+    })
+    corp_data = pd.DataFrame({
+        "Category": [
+            "Grade 3|ELA Proficient %",
+            "American Indian|ELA Proficient %",
+            "Native Hawaiian or Other Pacific Islander|ELA Proficient %",
+        ],
+        "2023": [0.4, 0.115, 0.515],
+        "2022": [0.5, 0.35, 0.5],
+    })
+
+    result = calculate_k8_comparison_metrics(school_data, corp_data, "2023").set_index("Category")
+
+    assert result.loc["Grade 3|ELA", "2023Diff"] == pytest.approx(0.1)
+    assert result.loc["Native Hawaiian or Other Pacific Islander|ELA", "2023Diff"] == pytest.approx(0.235)
+    assert result.loc["Native Hawaiian or Other Pacific Islander|ELA", "2022Diff"] == pytest.approx(0.1)
+    assert result.loc["American Indian|ELA", "2022Diff"] == pytest.approx(-0.05)
+
+    assert result.loc["Native Hawaiian or Other Pacific Islander|ELA", "2023Rate4"] == "ES"
+    assert result.loc["American Indian|ELA", "2022Rate7"] == "DNMS"
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pages.calculations import add_rating_columns, set_academic_rating, set_academic_ratings
+
+# (threshold, flag) for every rating calculated in calculate_metrics
+rating_limits = {
+    "attendance": ([0, -0.01, -0.01], 3),
+    "k8 year over year": ([0.05, 0.02, 0, 0], 1),
+    "k8 comparison": ([0.1, 0.02, 0, 0], 1),
+    "graduation state": ([0, 0.05, 0.15, 0.15], 2),
+    "graduation local": ([0, 0.05, 0.10, 0.10], 2),
+    "ccr": ([0.5, 0.499, 0.234], 2),
+    "letter grade": (["A", "B", "C", "D", "F"], 4),
+    "iread": ([0.9, 0.8, 0.7, 0.7], 1),
+}
+
+special_values = ["***", "-***", None, "No Grade", np.nan]
+
+def rating_inputs(threshold: list, flag: int) -> list:
+    if flag == 4:
+        return special_values + ["A", "B", "C", "D", "F", ""]
+
+    # every threshold, and the nearest floats either side of it
+    edges = []
+    for t in threshold:
+        edges += [t, np.nextafter(t, -np.inf), np.nextafter(t, np.inf)]
+
+    return special_values + edges + [-1, 0, 1, -0.5, 0.5, "0.05", "-0.01"]
+
+@pytest.mark.parametrize("name", rating_limits)
+def test_set_academic_ratings_matches_set_academic_rating(name):
+    threshold, flag = rating_limits[name]
+    values = rating_inputs(threshold, flag)
+
+    expected = [set_academic_rating(v, threshold, flag) for v in values]
+
+    assert set_academic_ratings(values, threshold, flag).tolist() == expected
+    assert set_academic_ratings(pd.Series(values, dtype=object), threshold, flag).tolist() == expected
+
+def test_set_academic_ratings_rejects_text_like_set_academic_rating():
+    with pytest.raises(ValueError):
+        set_academic_rating("text", [0.05, 0.02, 0, 0], 1)
+
+    with pytest.raises(ValueError):
+        set_academic_ratings(["text"], [0.05, 0.02, 0, 0], 1)
+
+def insert_rating_columns(data: pd.DataFrame, threshold: list, flag: int, step: int = 3, end: int = None) -> pd.DataFrame:
+    # the DataFrame.insert loop add_rating_columns() replaced
+    data = data.copy()
+    end = data.shape[1] if end is None else end
+
+    for i in range(end, 1, -step):
+        data.insert(
+            i,
+            str(data.columns[i - 1])[: 7 - 3] + "Rate" + str(i),
+            data.apply(lambda x: set_academic_rating(x[data.columns[i - 1]], threshold, flag), axis=1),
+        )
+
+    return data
+
+@pytest.mark.parametrize("step, end", [(3, None), (3, -2), (1, None)])
+def test_add_rating_columns_matches_inserting_columns(step, end):
+    threshold, flag = rating_limits["k8 comparison"]
+    values = rating_inputs(threshold, flag)
+
+    columns = {"Category": ["Row " + str(i) for i in range(len(values))]}
+    for year in ["2023", "2022", "2021"]:
+        columns[year + "School"] = values
+        columns[year + "N-Size"] = list(range(len(values)))
+        columns[year + "Diff"] = values[::-1]
+
+    data = pd.DataFrame(columns)
+    end = data.shape[1] + end if end else None
+
+    pd.testing.assert_frame_equal(
+        add_rating_columns(data, threshold, flag, step=step, end=end),
+        insert_rating_columns(data, threshold, flag, step=step, end=end),
+    )
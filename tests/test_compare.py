@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from benchmarks.compare import compare_results, main
+
+def result(*samples) -> dict:
+    return {"samples": list(samples)} if samples else {"samples": [], "median": None}
+
+@pytest.fixture
+def write_results(tmp_path):
+    def write(name: str, benchmarks: dict) -> str:
+        path = tmp_path / name
+        path.write_text(json.dumps({"metadata": {}, "benchmarks": benchmarks}))
+        return str(path)
+
+    return write
+
+def test_compare_results_statuses():
+    baseline = {"benchmarks": {
+        "update_academic_analysis": result(1.0, 1.0, 1.0),
+        "calculate_proficiency": result(1.0, 1.0, 1.0),
+        "make_bar_chart": result(),
+    }}
+    current = {"benchmarks": {
+        "calculate_proficiency": result(),
+        "make_bar_chart": result(1.0, 1.0, 1.0),
+    }}
+
+    statuses = {row["name"]: row["status"] for row in compare_results(baseline, current)}
+
+    assert statuses == {"update_academic_analysis": "missing", "calculate_proficiency": "skipped", "make_bar_chart": "new"}
+
+@pytest.mark.parametrize("current", [{}, {"update_academic_analysis": result()}])
+def test_missing_or_skipped_hot_path_fails(write_results, current):
+    baseline = write_results("baseline.json", {"update_academic_analysis": result(1.0, 1.0, 1.0)})
+
+    assert main([baseline, write_results("current.json", current)]) == 1
+
+def test_hot_path_change_with_too_few_rounds_fails(write_results):
+    baseline = write_results("baseline.json", {"update_academic_analysis": result(1.0, 1.0)})
+    current = write_results("current.json", {"update_academic_analysis": result(3.0, 3.0)})
+
+    assert main([baseline, current]) == 1
+
+def test_missing_benchmark_only_fails_with_strict(write_results):
+    baseline = write_results("baseline.json", {"make_bar_chart": result(1.0, 1.0, 1.0)})
+    current = write_results("current.json", {})
+
+    assert main([baseline, current]) == 0
+    assert main([baseline, current, "--strict"]) == 1
+
+def test_unchanged_hot_path_passes(write_results):
+    benchmarks = {"update_academic_analysis": result(1.0, 1.01, 0.99)}
+
+    assert main([write_results("baseline.json", benchmarks), write_results("current.json", benchmarks)]) == 0
@@ -0,0 +1,30 @@
+import shutil
+import sqlite3
+
+from pages.calculations import SchoolSpatialIndex
+from pages.db_maintenance import build_comparable_schools
+from pages.load_data import get_school_coordinates, get_school_types
+
+def test_build_comparable_schools_reads_the_database_it_writes(db_path, tmp_path):
+    # a copy of the test database with only the latest year of K-8 data
+    path = str(tmp_path / "db_all.db")
+    shutil.copyfile(db_path, path)
+
+    db = sqlite3.connect(path)
+    year = db.execute("SELECT MAX(Year) FROM academic_data_k8").fetchone()[0]
+    db.execute("DELETE FROM academic_data_k8 WHERE Year != ?", (year,))
+    db.commit()
+
+    build_comparable_schools(path, count=5)
+
+    rows = db.execute("SELECT Year, SchoolID, Rank, ComparableSchoolID FROM comparable_schools").fetchall()
+    tables = {row[0] for row in sqlite3.connect(db_path).execute("SELECT name FROM sqlite_master")}
+    db.close()
+
+    expected = SchoolSpatialIndex(get_school_coordinates(year), get_school_types()).query_all(k=5, grade_span="overlap")
+
+    assert "comparable_schools" not in tables
+    assert {r[0] for r in rows} == {year}
+    assert sorted(r[1:] for r in rows) == sorted(
+        (int(s), int(r), int(c)) for s, r, c in expected[["School ID", "Rank", "Comparable School ID"]].itertuples(index=False)
+    )
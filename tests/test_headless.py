@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from pages.headless import main, run_callback
+from pages.load_data import get_school_corporation_list
+
+# the runner calls into Dash internals (request dispatch, callback context, no_update)
+# - these fail on a Dash release that changes them
+
+def test_run_callback_returns_the_dropdown_options(k8_schools):
+    year = max(y for _, _, y in k8_schools)
+
+    result = run_callback("corporation-dropdown.options", str(year), [])
+
+    assert result["status"] == 200, result["error"]
+    assert result["bytes"] == len(result["payload"].encode("utf-8"))
+
+    response = json.loads(result["payload"])["response"]
+    options = response["corporation-dropdown"]["options"]
+    assert options and {"label", "value"} <= set(options[0])
+
+    corporations = get_school_corporation_list(str(year))
+    assert sorted(str(o["value"]) for o in options) == sorted(corporations["Corporation ID"].astype(str))
+    assert "callback.set_corp_dropdown_options" in result["stages"]
+
+def test_run_callback_renders_the_analysis_figures(k8_schools):
+    year = max(y for _, _, y in k8_schools)
+
+    result = run_callback("fig14c", str(year), [1001, 1004])
+
+    assert result["status"] == 200, result["error"]
+    assert "fig14c" in json.loads(result["payload"])["response"]
+
+def test_main_rejects_a_repeat_below_one():
+    with pytest.raises(SystemExit) as e:
+        main(["fig14c", '"2023"', "[1001, 1004]", "--repeat", "0"])
+
+    assert e.value.code == 2
@@ -0,0 +1,41 @@
+from flask import Flask, jsonify, request
+
+from pages import instrumentation
+from pages.instrumentation import init_instrumentation, skip_request
+
+def make_client():
+    server = Flask(__name__)
+
+    @server.before_request
+    def check_login():
+        if request.headers.get("X-Login") != "yes":
+            skip_request()
+            return jsonify({"status": "401", "statusText": "unauthorized access"})
+
+    @server.route("/_dash-update-component", methods=["POST"])
+    def update():
+        return jsonify({})
+
+    init_instrumentation(server, path="", server_timing=True, callbacks={"graph.figure": None})
+    instrumentation.request_histogram.series.clear()
+
+    return server.test_client()
+
+def test_unknown_callback_outputs_share_one_label():
+    client = make_client()
+
+    client.post("/_dash-update-component", json={"output": "graph.figure"}, headers={"X-Login": "yes"})
+    for i in range(500):
+        client.post("/_dash-update-component", json={"output": f"fake-{i}.children"}, headers={"X-Login": "yes"})
+
+    labels = {labels[1] for labels in instrumentation.request_histogram.series}
+    assert labels == {"graph", "other"}
+
+def test_rejected_requests_are_not_recorded():
+    client = make_client()
+
+    for i in range(50):
+        response = client.post("/_dash-update-component", json={"output": f"fake-{i}.children"})
+        assert "Server-Timing" not in response.headers
+
+    assert instrumentation.request_histogram.series == {}
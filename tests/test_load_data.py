@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pages import load_data
+from pages.load_data import build_projected_query, split_suppressed
+
+def test_split_suppressed_does_not_modify_its_input():
+    data = pd.DataFrame({"a": [1, "***", None], "b": ["^", 2.5, 3]}, dtype=object)
+    original = data.copy()
+
+    values, mask = split_suppressed(data)
+
+    pd.testing.assert_frame_equal(data, original)
+    np.testing.assert_array_equal(values.to_numpy(), [[1, np.nan], [np.nan, 2.5], [np.nan, 3]])
+    np.testing.assert_array_equal(mask.to_numpy(), [[False, True], [True, False], [False, False]])
+
+def test_split_suppressed_uses_the_given_codes():
+    data = pd.Series([1, "***", "^", "n<10"], dtype=object)
+
+    values, mask = split_suppressed(data, codes=["n<10"])
+
+    # "***" and "^" are not suppression codes here, so they are coerced to NaN unmasked
+    np.testing.assert_array_equal(mask.to_numpy(), [False, False, False, True])
+    np.testing.assert_array_equal(values.to_numpy(), [1, np.nan, np.nan, np.nan])
+
+def test_projected_query_rejects_a_selection_with_no_columns():
+    with pytest.raises(ValueError, match="No columns of academic_data_k8"):
+        build_projected_query("academic_data_k8", "Year = :year", "^No Such Column$")
+
+def test_projected_query_is_rebuilt_for_a_new_database_version(monkeypatch):
+    monkeypatch.setattr(load_data, "get_database_version", lambda: "old")
+    catalog = load_data.get_column_catalog("academic_data_k8")
+
+    assert '"SchoolName"' in str(build_projected_query("academic_data_k8", "Year = :year", "School Name"))
+
+    # the same selection against a schema with another matching column
+    monkeypatch.setattr(load_data, "get_database_version", lambda: "new")
+    monkeypatch.setitem(load_data._catalog_tables, ("academic_data_k8", "new"), dict(catalog, SchoolName2="School Name 2"))
+
+    query = str(build_projected_query("academic_data_k8", "Year = :year", "School Name"))
+    assert '"SchoolName", "SchoolName2"' in query
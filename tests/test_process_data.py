@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+from pages import process_data
+from pages.load_data import get_high_school_academic_data, get_hs_corporation_academic_data, run_query, text
+from pages.process_data import filter_high_school_academic_data, merge_nsize_rows, process_high_school_academic_data
+
+def cross_merge_nsize_rows(data: pd.DataFrame, data_tested: pd.DataFrame) -> pd.DataFrame:
+    # the original implementation of merge_nsize_rows() - a cross merge of every
+    # proficiency row with every N-Size row, filtered by substring
+    data_tested = data_tested.copy()
+    data_tested["Substring"] = data_tested["Category"].replace({" Total Tested": "", r"\|Cohort Count": " Graduation"}, regex=True)
+    data_tested = data_tested.drop("Category", axis=1)
+
+    final_data = data.merge(data_tested, how="cross")
+
+    final_data = final_data.replace({"Non English Language Learners": "Temp1", "English Language Learners": "Temp2"}, regex=True)
+    final_data = final_data[[a in b for a, b in zip(final_data["Substring"], final_data["Category"])]]
+    final_data = final_data.replace({"Temp1": "Non English Language Learners", "Temp2": "English Language Learners"}, regex=True)
+
+    final_data = final_data.drop("Substring", axis=1)
+
+    return final_data.reset_index(drop=True)
+
+@pytest.fixture(scope="module")
+def hs_schools() -> list:
+    return run_query(text("SELECT DISTINCT SchoolID FROM academic_data_hs"))["School ID"].tolist()
+
+def test_merge_nsize_rows_matches_the_cross_merge(hs_schools, monkeypatch):
+    merged = []
+    skipped = 0
+
+    def merge(data, data_tested):
+        result = merge_nsize_rows(data, data_tested)
+        merged.append((result, cross_merge_nsize_rows(data, data_tested)))
+        return result
+
+    monkeypatch.setattr(process_data, "merge_nsize_rows", merge)
+
+    for school in hs_schools:
+        for fetch in [get_high_school_academic_data, get_hs_corporation_academic_data]:
+            data = filter_high_school_academic_data(fetch(school))
+
+            # corporation data without Graduates columns cannot be processed (see
+            # merge_high_school_data) - any other failure fails the test
+            if fetch is get_hs_corporation_academic_data and not data.columns.str.endswith("Graduates").any():
+                skipped += 1
+                continue
+
+            process_high_school_academic_data(data, str(school))
+
+    assert len(merged) == 2 * len(hs_schools) - skipped
+
+    for result, expected in merged:
+        pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,72 @@
+import json
+import threading
+
+import pytest
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+from benchmarks.replay import Replayer, load_traffic, percentile
+
+def test_percentile_interpolates_between_ranks():
+    assert percentile([4, 1, 3, 2], 0) == 1
+    assert percentile([4, 1, 3, 2], 50) == 2.5
+    assert percentile([4, 1, 3, 2], 100) == 4
+    assert percentile([], 50) is None
+
+def test_load_traffic_keeps_replayable_posts(tmp_path):
+    records = [
+        {"method": "GET", "body": None, "query": ""},
+        {"method": "POST", "body": None, "query": ""},
+        {"method": "POST", "body": {"output": "a"}, "query": "cacheKey=k&job=1"},
+        {"method": "POST", "body": {"output": "b"}, "query": "oldJob=1"},
+        {"method": "POST", "body": {"output": "c"}, "query": ""},
+    ]
+    path = tmp_path / "traffic.jsonl"
+    path.write_text("\n".join(json.dumps(r) for r in records) + "\n\n")
+
+    assert [r["body"]["output"] for r in load_traffic(str(path))] == ["b", "c"]
+    assert [r["body"]["output"] for r in load_traffic(str(path), limit=1)] == ["b"]
+
+@pytest.fixture
+def background_server():
+    # answers like a Dash background callback: a job id, then an empty answer per
+    # poll until the job is done
+    server = Flask(__name__)
+    polls = []
+
+    @server.route("/_dash-update-component", methods=["POST"])
+    def update():
+        if "job" not in request.args:
+            return jsonify({"cacheKey": "k", "job": 7})
+
+        polls.append(dict(request.args))
+        if len(polls) < 3:
+            return jsonify({})
+
+        return jsonify({"multi": True, "response": {"fig14c": {"children": "x" * 1000}}})
+
+    http = make_server("127.0.0.1", 0, server, threaded=True)
+    thread = threading.Thread(target=http.serve_forever, daemon=True)
+    thread.start()
+
+    yield "http://127.0.0.1:" + str(http.server_port), polls
+
+    http.shutdown()
+
+def test_replayer_waits_for_background_jobs(background_server):
+    url, polls = background_server
+
+    result = Replayer(url, poll_interval=0.01).send({"output": "fig14c.children", "body": {"output": "fig14c.children"}})
+
+    assert result["ok"] and result["status"] == 200
+    assert result["polls"] == 3
+    assert polls[0] == {"cacheKey": "k", "job": "7"}
+    assert result["bytes"] > 1000
+
+def test_replayer_fails_a_job_that_does_not_finish(background_server):
+    url, _ = background_server
+
+    result = Replayer(url, timeout=0.02, poll_interval=0.05).send({"output": "fig14c.children", "body": {}})
+
+    assert not result["ok"]
+    assert result["error"].startswith("TimeoutError")
@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from pages import load_data
+from pages.snapshot import export_snapshot, read_manifest, read_snapshot_table, read_table, snapshot_tables, take_rows
+
+@pytest.fixture(scope="module")
+def snapshot(db_path, tmp_path_factory) -> str:
+    path = str(tmp_path_factory.mktemp("snapshot"))
+    export_snapshot(db_path, path)
+
+    return path
+
+@pytest.fixture(params=["memory", "arrow"])
+def store_backend(request, snapshot, monkeypatch):
+    monkeypatch.setattr(load_data, "snapshot_path", snapshot)
+    load_data.set_data_backend(request.param)
+    load_data._k8_store.clear()
+
+    yield request.param
+
+    load_data.set_data_backend("sqlite")
+    load_data._k8_store.clear()
+
+def test_numeric_columns_are_typed_views_of_the_mapped_file(snapshot):
+    data, suppressed = read_table(snapshot + "/academic_data_k8.arrow")
+
+    markers = {name: marker for name, (marker, _) in suppressed.items() if marker is not None}
+
+    assert markers
+    for name, marker in markers.items():
+        values = data[name].to_numpy()
+
+        assert values.dtype == "float64"
+        assert not values.flags.owndata
+        assert not marker.flags.owndata
+
+def test_take_rows_restores_the_suppression_strings(db_path, snapshot):
+    data, suppressed = read_table(snapshot + "/academic_data_k8.arrow")
+    positions = list(range(len(data)))
+
+    expected = load_data._read_sql(load_data.text("SELECT * FROM academic_data_k8"))
+    restored = take_rows(data, suppressed, positions)
+    restored.columns = expected.columns
+
+    pd.testing.assert_frame_equal(restored, expected)
+
+def test_store_backends_match_sqlite(store_backend, k8_schools):
+    for school, corp, year in k8_schools[::7]:
+        load_data.set_data_backend("sqlite")
+        expected = [
+            load_data.get_academic_data([school], year),
+            load_data.get_academic_data([school], year, columns=""),
+            load_data.get_public_school_list([corp]),
+        ]
+
+        load_data.set_data_backend(store_backend)
+        result = [
+            load_data.get_academic_data([school], year),
+            load_data.get_academic_data([school], year, columns=""),
+            load_data.get_public_school_list([corp]),
+        ]
+
+        for x, y in zip(expected, result):
+            pd.testing.assert_frame_equal(y.reset_index(drop=True), x.reset_index(drop=True))
+
+def test_only_the_tables_the_backend_reads_are_exported(snapshot):
+    assert set(read_manifest(snapshot)["tables"]) == set(snapshot_tables)
+
+    with pytest.raises(ValueError, match="does not include school_index"):
+        read_snapshot_table(snapshot, "school_index")
+
+def test_an_unusable_snapshot_falls_back_to_sqlite(tmp_path, monkeypatch, caplog):
+    # no snapshot was exported to this directory
+    monkeypatch.setattr(load_data, "snapshot_path", str(tmp_path))
+    load_data.set_data_backend("arrow")
+
+    try:
+        data, suppressed = load_data._read_k8_table()
+    finally:
+        load_data.set_data_backend("sqlite")
+
+    assert "Unable to load snapshot" in caplog.text
+    assert len(data) and all(marker is None for marker, _ in suppressed.values())
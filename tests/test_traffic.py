@@ -0,0 +1,42 @@
+import json
+
+from flask import Flask, jsonify
+
+from benchmarks.replay import load_traffic
+from pages.traffic import init_traffic_recorder
+
+def test_recorder_writes_one_json_line_per_callback_request(tmp_path):
+    path = str(tmp_path / "traffic.jsonl")
+    server = Flask(__name__)
+
+    @server.route("/_dash-update-component", methods=["POST"])
+    def update():
+        return jsonify({"multi": True, "response": {}})
+
+    @server.route("/other", methods=["POST"])
+    def other():
+        return jsonify({})
+
+    assert init_traffic_recorder(server, path=path)
+
+    client = server.test_client()
+    body = {"output": "fig14c.children", "inputs": [{"id": "year-dropdown", "property": "value", "value": "2023"}]}
+    client.post("/_dash-update-component", json=body)
+    client.post("/other", json=body)
+    client.post("/_dash-update-component?cacheKey=k&job=1", json=body)
+
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+
+    assert [r["query"] for r in records] == ["", "cacheKey=k&job=1"]
+    assert records[0]["endpoint"] == "/_dash-update-component"
+    assert records[0]["output"] == "fig14c.children"
+    assert records[0]["body"] == body
+    assert records[0]["status"] == 200
+    assert records[0]["bytes"] > 0 and records[0]["ms"] >= 0
+
+    # the job poll is not replayable
+    assert load_traffic(path) == records[:1]
+
+def test_recorder_is_off_without_a_path():
+    assert not init_traffic_recorder(Flask(__name__), path="")